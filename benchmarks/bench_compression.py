@@ -0,0 +1,301 @@
+import argparse
+import gzip
+import json
+import time
+import uuid
+
+from snoindex.config import get_opensearch_client
+
+from snoindex.remote.portal import PortalProps
+from snoindex.remote.portal import make_session
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+
+# Compares bytes on the wire and latency with and without gzip for
+# bulk requests to Opensearch and index-data-view fetches from the
+# portal. Runs offline on generated documents by default, pass
+# --opensearch-url or --portal-url to measure against real services.
+#
+#   $ python benchmarks/bench_compression.py
+#   $ python benchmarks/bench_compression.py --opensearch-url http://localhost:9200
+#   $ python benchmarks/bench_compression.py --portal-url http://localhost:8000 \
+#         --auth user:password --uuids <uuid> <uuid>
+
+
+# Number of embedded objects in small, medium and large documents.
+DOCUMENT_SIZES = {
+    'small': 5,
+    'medium': 50,
+    'large': 500,
+}
+
+# opensearch-py compresses with the gzip module defaults.
+GZIP_LEVEL = 9
+
+# Same cap as OpensearchProps.bulk_max_chunk_bytes.
+MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
+BENCHMARK_INDEX = 'snoindex-bench-compression'
+
+
+def make_embedded_object(i: int) -> Dict[str, Any]:
+    item_uuid = str(uuid.UUID(int=i))
+    return {
+        '@id': f'/biosamples/{item_uuid}/',
+        '@type': ['Biosample', 'Item'],
+        'uuid': item_uuid,
+        'accession': f'IGVFSM{i:07d}',
+        'status': 'released',
+        'summary': f'Homo sapiens K562 cell line sample {i}',
+        'lab': {
+            '@id': '/labs/j-michael-cherry/',
+            'name': 'j-michael-cherry',
+            'title': 'J. Michael Cherry, Stanford',
+            'institute_label': 'Stanford',
+        },
+        'award': '/awards/1U24HG012012-01/',
+        'donors': [f'/human-donors/{item_uuid}/'],
+        'date_created': '2023-03-01T18:30:00.000000+00:00',
+        'schema_version': '7',
+    }
+
+
+def make_document(number_of_embedded: int, i: int = 0) -> Dict[str, Any]:
+    # Shaped like the index-data-view, where the same embedded
+    # objects and uuids repeat throughout the document. Every
+    # document embeds different objects, like a chunk of a reindex.
+    embedded = [
+        make_embedded_object(i * number_of_embedded + j)
+        for j in range(number_of_embedded)
+    ]
+    embedded_uuids = [
+        item['uuid']
+        for item in embedded
+    ]
+    document_uuid = str(uuid.UUID(int=10**9 + i))
+    return {
+        'audit': {},
+        'embedded': {
+            '@id': f'/analysis-sets/{document_uuid}/',
+            'uuid': document_uuid,
+            'samples': embedded,
+        },
+        'object': {
+            '@id': f'/analysis-sets/{document_uuid}/',
+            'uuid': document_uuid,
+            'samples': [
+                item['@id']
+                for item in embedded
+            ],
+        },
+        'embedded_uuids': embedded_uuids,
+        'linked_uuids': embedded_uuids,
+        'uuid': document_uuid,
+        'item_type': 'analysis_set',
+        'index_name': 'analysis_set_bench',
+        'xmin': '100',
+        'paths': [f'/analysis-sets/{document_uuid}/'],
+        'principals_allowed': {
+            'view': ['system.Everyone'],
+            'edit': ['group.admin'],
+        },
+    }
+
+
+def make_bulk_body(number_of_embedded: int, chunk_size: int, index: str) -> bytes:
+    # Stops at chunk_size documents or MAX_CHUNK_BYTES, like streaming_bulk.
+    lines: List[str] = []
+    size = 0
+    for i in range(chunk_size):
+        document = make_document(number_of_embedded, i)
+        action = json.dumps(
+            {
+                'index': {
+                    '_index': index,
+                    '_id': document['uuid'],
+                }
+            }
+        )
+        source = json.dumps(document)
+        size += len(action) + len(source) + 2
+        if lines and size > MAX_CHUNK_BYTES:
+            break
+        lines.extend([action, source])
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def time_call(call: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    # Returns the best time in seconds and the last result.
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = call()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def transfer_seconds(number_of_bytes: int, bandwidth_mbps: float) -> float:
+    return number_of_bytes * 8 / (bandwidth_mbps * 1_000_000)
+
+
+def run_offline(chunk_size: int, bandwidths_mbps: List[float], repeat: int) -> None:
+    print(
+        f'Bulk bodies of up to {chunk_size} documents '
+        f'or {MAX_CHUNK_BYTES} bytes, gzip level {GZIP_LEVEL}'
+    )
+    print(
+        f'{"document":>8} {"raw KiB":>10} {"gzip KiB":>10} {"ratio":>6} '
+        f'{"gzip ms":>8} {"gunzip ms":>9}'
+    )
+    results = []
+    for name, number_of_embedded in DOCUMENT_SIZES.items():
+        body = make_bulk_body(
+            number_of_embedded,
+            chunk_size,
+            'analysis_set_bench',
+        )
+        compress_seconds, compressed = time_call(
+            lambda: gzip.compress(body, compresslevel=GZIP_LEVEL),
+            repeat,
+        )
+        decompress_seconds, _ = time_call(
+            lambda: gzip.decompress(compressed),
+            repeat,
+        )
+        cpu_seconds = compress_seconds + decompress_seconds
+        results.append(
+            (name, len(body), len(compressed), cpu_seconds)
+        )
+        print(
+            f'{name:>8} {len(body) / 1024:>10.1f} {len(compressed) / 1024:>10.1f} '
+            f'{len(body) / len(compressed):>6.1f} {compress_seconds * 1000:>8.1f} '
+            f'{decompress_seconds * 1000:>9.1f}'
+        )
+    print()
+    print('Estimated latency per bulk request in ms, raw / gzip (including CPU)')
+    headers = [
+        f'{bandwidth:g} Mbps'
+        for bandwidth in bandwidths_mbps
+    ]
+    print(
+        f'{"document":>8} ' + ' '.join(
+            f'{header:>17}'
+            for header in headers
+        )
+    )
+    for name, raw_bytes, compressed_bytes, cpu_seconds in results:
+        columns = []
+        for bandwidth in bandwidths_mbps:
+            raw = transfer_seconds(raw_bytes, bandwidth)
+            compressed = cpu_seconds + transfer_seconds(
+                compressed_bytes,
+                bandwidth,
+            )
+            columns.append(f'{raw * 1000:>8.1f}/{compressed * 1000:<8.1f}')
+        print(f'{name:>8} ' + ' '.join(columns))
+
+
+def run_opensearch(url: str, chunk_size: int, repeat: int) -> None:
+    print()
+    print(f'Bulk requests of up to {chunk_size} documents to {url}')
+    print(f'{"document":>8} {"plain ms":>9} {"http_compress ms":>17}')
+    for name, number_of_embedded in DOCUMENT_SIZES.items():
+        body = make_bulk_body(
+            number_of_embedded,
+            chunk_size,
+            BENCHMARK_INDEX,
+        )
+        timings = []
+        for http_compress in [False, True]:
+            client = get_opensearch_client(url, http_compress=http_compress)
+            seconds, _ = time_call(
+                lambda: client.bulk(body=body, request_timeout=300),
+                repeat,
+            )
+            timings.append(seconds)
+        plain, compressed = timings
+        print(f'{name:>8} {plain * 1000:>9.1f} {compressed * 1000:>17.1f}')
+    get_opensearch_client(url).indices.delete(
+        index=BENCHMARK_INDEX,
+        ignore_unavailable=True,
+    )
+
+
+def fetch_from_portal(props: PortalProps, uuids: List[str]) -> Tuple[int, int]:
+    # Returns bytes on the wire and bytes after decoding.
+    session = make_session(props)
+    wire_bytes = 0
+    decoded_bytes = 0
+    for item_uuid in uuids:
+        response = session.get(
+            f'{props.backend_url}/{item_uuid}/{props.index_data_view}/?datastore=database',
+            auth=props.auth,
+            timeout=props.timeout_seconds,
+            stream=True,
+        )
+        response.raise_for_status()
+        raw = response.raw.read(decode_content=False)
+        wire_bytes += len(raw)
+        if response.headers.get('Content-Encoding') == 'gzip':
+            raw = gzip.decompress(raw)
+        decoded_bytes += len(raw)
+    return wire_bytes, decoded_bytes
+
+
+def run_portal(url: str, auth: Tuple[str, str], uuids: List[str], repeat: int) -> None:
+    print()
+    print(f'Fetching {len(uuids)} items from {url}')
+    print(f'{"compress":>8} {"wire KiB":>10} {"decoded KiB":>12} {"ms":>8}')
+    for compress in [False, True]:
+        props = PortalProps(
+            backend_url=url,
+            auth=auth,
+            compress=compress,
+        )
+        seconds, (wire_bytes, decoded_bytes) = time_call(
+            lambda: fetch_from_portal(props, uuids),
+            repeat,
+        )
+        print(
+            f'{str(compress):>8} {wire_bytes / 1024:>10.1f} '
+            f'{decoded_bytes / 1024:>12.1f} {seconds * 1000:>8.1f}'
+        )
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Bytes on the wire and latency with and without gzip.'
+    )
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument(
+        '--bandwidth-mbps',
+        type=float,
+        nargs='+',
+        default=[100.0, 1000.0, 10000.0],
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--opensearch-url')
+    parser.add_argument('--portal-url')
+    parser.add_argument('--auth', help='user:password for the portal')
+    parser.add_argument('--uuids', nargs='+', default=[])
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = get_args()
+    run_offline(args.chunk_size, args.bandwidth_mbps, args.repeat)
+    if args.opensearch_url:
+        run_opensearch(args.opensearch_url, args.chunk_size, args.repeat)
+    if args.portal_url:
+        user, password = (args.auth or ':').split(':', 1)
+        run_portal(args.portal_url, (user, password), args.uuids, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
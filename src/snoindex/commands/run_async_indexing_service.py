@@ -0,0 +1,162 @@
+import os
+
+from snoindex.config import AsyncIndexingServiceConfig
+from snoindex.config import get_flag
+from snoindex.config import get_reverse_links
+from snoindex.config import get_sqs_client
+from snoindex.config import get_opensearch_client
+from snoindex.config import get_async_opensearch_client
+
+from snoindex.services.async_indexing import AsyncIndexingServiceProps
+from snoindex.services.async_indexing import AsyncIndexingService
+
+from snoindex.remote.async_portal import AsyncPortal
+
+from snoindex.remote.portal import PortalProps
+from snoindex.remote.portal import Portal
+
+from snoindex.repository.async_opensearch import AsyncOpensearchProps
+from snoindex.repository.async_opensearch import AsyncOpensearch
+
+from snoindex.repository.opensearch import OpensearchProps
+from snoindex.repository.opensearch import Opensearch
+
+from snoindex.repository.queue.sqs import SQSQueueProps
+from snoindex.repository.queue.sqs import SQSQueue
+
+
+def get_async_indexing_service_config() -> AsyncIndexingServiceConfig:
+    max_concurrent_requests = int(
+        os.environ.get('MAX_CONCURRENT_REQUESTS', 100)
+    )
+    opensearch_http_compress = get_flag(
+        os.environ.get('OPENSEARCH_HTTP_COMPRESS')
+    )
+    return AsyncIndexingServiceConfig(
+        backend_url=os.environ['BACKEND_URL'],
+        auth=(
+            os.environ['BACKEND_KEY'],
+            os.environ['BACKEND_SECRET_KEY'],
+        ),
+        invalidation_queue_url=os.environ['INVALIDATION_QUEUE_URL'],
+        opensearch_client=get_opensearch_client(
+            os.environ['OPENSEARCH_URL'],
+            http_compress=opensearch_http_compress,
+        ),
+        async_opensearch_client=get_async_opensearch_client(
+            os.environ['OPENSEARCH_URL'],
+            maxsize=max_concurrent_requests,
+            http_compress=opensearch_http_compress,
+        ),
+        opensearch_resources_index=os.environ.get('RESOURCES_INDEX'),
+        sqs_client=get_sqs_client(
+            os.environ.get('LOCALSTACK_ENDPOINT_URL')
+        ),
+        messages_to_handle_per_run=int(
+            os.environ.get('MESSAGES_TO_HANDLE_PER_RUN', 100)
+        ),
+        max_concurrent_requests=max_concurrent_requests,
+        skip_up_to_date_messages=get_flag(
+            os.environ.get('SKIP_UP_TO_DATE_MESSAGES')
+        ),
+        reverse_links_path=os.environ.get('REVERSE_LINKS_PATH'),
+        reverse_links_writer=os.environ.get('REVERSE_LINKS_WRITER'),
+        opensearch_http_compress=opensearch_http_compress,
+        portal_compress=get_flag(
+            os.environ.get('PORTAL_COMPRESS'),
+            default=True,
+        ),
+        raw_items=get_flag(
+            os.environ.get('RAW_ITEMS')
+        ),
+    )
+
+
+def make_portal_props_from_config(config: AsyncIndexingServiceConfig) -> PortalProps:
+    return PortalProps(
+        backend_url=config.backend_url,
+        auth=config.auth,
+        pool_maxsize=config.max_concurrent_requests,
+        raw_items=config.raw_items,
+        compress=config.portal_compress,
+    )
+
+
+def make_async_opensearch_from_config(config: AsyncIndexingServiceConfig) -> AsyncOpensearch:
+    return AsyncOpensearch(
+        props=AsyncOpensearchProps(
+            client=config.async_opensearch_client,
+            resources_index=config.opensearch_resources_index,
+            alias_cache_ttl_seconds=60,
+        )
+    )
+
+
+def make_invalidation_queue_from_config(config: AsyncIndexingServiceConfig) -> SQSQueue:
+    return SQSQueue(
+        props=SQSQueueProps(
+            client=config.sqs_client,
+            queue_url=config.invalidation_queue_url,
+        )
+    )
+
+
+def wait(config: AsyncIndexingServiceConfig, async_indexing_service: AsyncIndexingService) -> None:
+    # Blocking clients are fine for waiting before the event loop starts.
+    opensearch = Opensearch(
+        props=OpensearchProps(
+            client=config.opensearch_client,
+            resources_index=config.opensearch_resources_index,
+        )
+    )
+    portal = Portal(
+        props=async_indexing_service.props.portal.props
+    )
+    async_indexing_service.props.invalidation_queue.wait_for_queue_to_exist()
+    opensearch.wait_for_resources_index_to_exist()
+    portal.wait_for_portal_connection()
+    portal.wait_for_access_key_to_exist()
+
+
+def make_async_indexing_service_from_config(config: AsyncIndexingServiceConfig) -> AsyncIndexingService:
+    invalidation_queue = make_invalidation_queue_from_config(
+        config
+    )
+    portal = AsyncPortal(
+        props=make_portal_props_from_config(
+            config
+        )
+    )
+    opensearch = make_async_opensearch_from_config(
+        config
+    )
+    async_indexing_service = AsyncIndexingService(
+        props=AsyncIndexingServiceProps(
+            invalidation_queue=invalidation_queue,
+            portal=portal,
+            opensearch=opensearch,
+            messages_to_handle_per_run=config.messages_to_handle_per_run,
+            max_concurrent_fetches=config.max_concurrent_requests,
+            max_concurrent_writes=config.max_concurrent_requests,
+            skip_up_to_date_messages=config.skip_up_to_date_messages,
+            reverse_links=get_reverse_links(
+                config.reverse_links_path,
+                config.reverse_links_writer,
+            ),
+            extend_visibility_timeout=True,
+        )
+    )
+    wait(config, async_indexing_service)
+    return async_indexing_service
+
+
+def poll() -> None:
+    config = get_async_indexing_service_config()
+    async_indexing_service = make_async_indexing_service_from_config(
+        config
+    )
+    async_indexing_service.poll()
+
+
+if __name__ == '__main__':
+    poll()
@@ -0,0 +1,154 @@
+import os
+
+from snoindex.config import BulkIndexingServiceConfig
+from snoindex.config import get_flag
+from snoindex.config import get_reverse_links
+from snoindex.config import get_sqs_client
+from snoindex.config import get_opensearch_client
+
+from snoindex.domain.batch import AdaptiveBatchSizeProps
+from snoindex.domain.batch import AdaptiveBatchSize
+
+from snoindex.services.indexing import BulkIndexingServiceProps
+from snoindex.services.indexing import BulkIndexingService
+
+from snoindex.remote.portal import PortalProps
+from snoindex.remote.portal import Portal
+
+from snoindex.repository.opensearch import OpensearchProps
+from snoindex.repository.opensearch import Opensearch
+
+from snoindex.repository.queue.sqs import SQSQueueProps
+from snoindex.repository.queue.sqs import SQSQueue
+
+
+def get_bulk_indexing_service_config() -> BulkIndexingServiceConfig:
+    opensearch_http_compress = get_flag(
+        os.environ.get('OPENSEARCH_HTTP_COMPRESS')
+    )
+    return BulkIndexingServiceConfig(
+        backend_url=os.environ['BACKEND_URL'],
+        auth=(
+            os.environ['BACKEND_KEY'],
+            os.environ['BACKEND_SECRET_KEY'],
+        ),
+        bulk_invalidation_queue_url=os.environ['BULK_INVALIDATION_QUEUE_URL'],
+        opensearch_client=get_opensearch_client(
+            os.environ['OPENSEARCH_URL'],
+            http_compress=opensearch_http_compress,
+        ),
+        opensearch_resources_index=os.environ.get('RESOURCES_INDEX'),
+        sqs_client=get_sqs_client(
+            os.environ.get('LOCALSTACK_ENDPOINT_URL')
+        ),
+        skip_up_to_date_messages=get_flag(
+            os.environ.get('SKIP_UP_TO_DATE_MESSAGES')
+        ),
+        reverse_links_path=os.environ.get('REVERSE_LINKS_PATH'),
+        reverse_links_writer=os.environ.get('REVERSE_LINKS_WRITER'),
+        opensearch_http_compress=opensearch_http_compress,
+        portal_compress=get_flag(
+            os.environ.get('PORTAL_COMPRESS'),
+            default=True,
+        ),
+        raw_items=get_flag(
+            os.environ.get('RAW_ITEMS')
+        ),
+        bulk_thread_count=int(
+            os.environ.get('BULK_THREAD_COUNT', 1)
+        ),
+        acknowledge_in_background=get_flag(
+            os.environ.get('ACKNOWLEDGE_IN_BACKGROUND')
+        ),
+    )
+
+
+def make_portal_from_config(config: BulkIndexingServiceConfig) -> Portal:
+    return Portal(
+        props=PortalProps(
+            backend_url=config.backend_url,
+            auth=config.auth,
+            raw_items=config.raw_items,
+            compress=config.portal_compress,
+        )
+    )
+
+
+def make_opensearch_from_config(config: BulkIndexingServiceConfig) -> Opensearch:
+    return Opensearch(
+        props=OpensearchProps(
+            client=config.opensearch_client,
+            resources_index=config.opensearch_resources_index,
+            alias_cache_ttl_seconds=60,
+            bulk_thread_count=config.bulk_thread_count,
+        )
+    )
+
+
+def make_bulk_invalidation_queue_from_config(config: BulkIndexingServiceConfig) -> SQSQueue:
+    return SQSQueue(
+        props=SQSQueueProps(
+            client=config.sqs_client,
+            queue_url=config.bulk_invalidation_queue_url,
+            visibility_timeout=120,
+            max_concurrent_receives=int(
+                os.environ.get('MAX_CONCURRENT_SQS_RECEIVES', 1)
+            ),
+            acknowledge_in_background=config.acknowledge_in_background,
+        )
+    )
+
+
+def wait(bulk_indexing_service: BulkIndexingService) -> None:
+    bulk_indexing_service.props.bulk_invalidation_queue.wait_for_queue_to_exist()
+    bulk_indexing_service.props.opensearch.wait_for_resources_index_to_exist()
+    bulk_indexing_service.props.portal.wait_for_portal_connection()
+    bulk_indexing_service.props.portal.wait_for_access_key_to_exist()
+
+
+def make_bulk_indexing_service_from_config(config: BulkIndexingServiceConfig) -> BulkIndexingService:
+    bulk_invalidation_queue = make_bulk_invalidation_queue_from_config(
+        config
+    )
+    portal = make_portal_from_config(
+        config
+    )
+    opensearch = make_opensearch_from_config(
+        config
+    )
+    bulk_indexing_service = BulkIndexingService(
+        props=BulkIndexingServiceProps(
+            bulk_invalidation_queue=bulk_invalidation_queue,
+            portal=portal,
+            opensearch=opensearch,
+            batch_size=AdaptiveBatchSize(
+                props=AdaptiveBatchSizeProps(
+                    initial_size=50,
+                    min_size=10,
+                    max_size=1000,
+                    # Should be less than visibility_timeout of bulk_invalidation_queue.
+                    target_seconds=60,
+                )
+            ),
+            skip_up_to_date_messages=config.skip_up_to_date_messages,
+            reverse_links=get_reverse_links(
+                config.reverse_links_path,
+                config.reverse_links_writer,
+            ),
+            extend_visibility_timeout=True,
+        )
+    )
+    wait(bulk_indexing_service)
+    return bulk_indexing_service
+
+
+def poll() -> None:
+    config = get_bulk_indexing_service_config()
+    bulk_indexing_service = make_bulk_indexing_service_from_config(
+        config
+    )
+    bulk_indexing_service.poll()
+
+
+if __name__ == '__main__':
+    poll()
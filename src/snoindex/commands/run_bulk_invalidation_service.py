@@ -1,6 +1,7 @@
 import os
 
 from snoindex.config import BulkInvalidationServiceConfig
+from snoindex.config import get_flag
 from snoindex.config import get_sqs_client
 from snoindex.config import get_opensearch_client
 
@@ -25,6 +26,9 @@ def get_bulk_invalidation_service_config() -> BulkInvalidationServiceConfig:
         sqs_client=get_sqs_client(
             os.environ.get('LOCALSTACK_ENDPOINT_URL')
         ),
+        acknowledge_in_background=get_flag(
+            os.environ.get('ACKNOWLEDGE_IN_BACKGROUND')
+        ),
     )
 
 
@@ -33,6 +37,9 @@ def make_opensearch_from_config(config: BulkInvalidationServiceConfig) -> Opense
         props=OpensearchProps(
             client=config.opensearch_client,
             resources_index=config.opensearch_resources_index,
+            related_uuids_search_slices=int(
+                os.environ.get('RELATED_UUIDS_SEARCH_SLICES', 1)
+            ),
         )
     )
 
@@ -43,6 +50,10 @@ def make_transaction_queue_from_config(config: BulkInvalidationServiceConfig) ->
             client=config.sqs_client,
             queue_url=config.transaction_queue_url,
             visibility_timeout=1800,
+            max_concurrent_receives=int(
+                os.environ.get('MAX_CONCURRENT_SQS_RECEIVES', 10)
+            ),
+            acknowledge_in_background=config.acknowledge_in_background,
         )
     )
 
@@ -52,6 +63,9 @@ def make_invalidation_queue_from_config(config: BulkInvalidationServiceConfig) -
         props=SQSQueueProps(
             client=config.sqs_client,
             queue_url=config.invalidation_queue_url,
+            max_concurrent_requests=int(
+                os.environ.get('MAX_CONCURRENT_SQS_REQUESTS', 10)
+            ),
         )
     )
 
@@ -77,10 +91,17 @@ def make_bulk_invalidation_service_from_config(config: BulkInvalidationServiceCo
             transaction_queue=transaction_queue,
             invalidation_queue=invalidation_queue,
             opensearch=opensearch,
+            uuids_per_outbound_message=int(
+                os.environ.get('UUIDS_PER_OUTBOUND_MESSAGE', 1)
+            ),
             messages_to_handle_per_run=5000,
             related_uuids_search_batch_size=1000,
+            max_concurrent_related_uuids_searches=int(
+                os.environ.get('MAX_CONCURRENT_RELATED_UUIDS_SEARCHES', 1)
+            ),
             # Should be less than visibility_timeout of transaction_queue.
             get_messages_timeout_seconds=1500,
+            extend_visibility_timeout=True,
         )
     )
     wait(bulk_invalidation_service)
@@ -1,6 +1,8 @@
 import os
 
 from snoindex.config import IndexingServiceConfig
+from snoindex.config import get_flag
+from snoindex.config import get_reverse_links
 from snoindex.config import get_sqs_client
 from snoindex.config import get_opensearch_client
 
@@ -18,6 +20,10 @@ from snoindex.repository.queue.sqs import SQSQueue
 
 
 def get_indexing_service_config() -> IndexingServiceConfig:
+    max_workers = int(os.environ.get('MAX_WORKERS', 1))
+    opensearch_http_compress = get_flag(
+        os.environ.get('OPENSEARCH_HTTP_COMPRESS')
+    )
     return IndexingServiceConfig(
         backend_url=os.environ['BACKEND_URL'],
         auth=(
@@ -26,12 +32,35 @@ def get_indexing_service_config() -> IndexingServiceConfig:
         ),
         invalidation_queue_url=os.environ['INVALIDATION_QUEUE_URL'],
         opensearch_client=get_opensearch_client(
-            os.environ['OPENSEARCH_URL']
+            os.environ['OPENSEARCH_URL'],
+            # Keep a connection open for every worker.
+            maxsize=max(10, max_workers),
+            http_compress=opensearch_http_compress,
         ),
         opensearch_resources_index=os.environ.get('RESOURCES_INDEX'),
         sqs_client=get_sqs_client(
             os.environ.get('LOCALSTACK_ENDPOINT_URL')
         ),
+        messages_to_handle_per_run=int(
+            os.environ.get('MESSAGES_TO_HANDLE_PER_RUN', max_workers)
+        ),
+        max_workers=max_workers,
+        skip_up_to_date_messages=get_flag(
+            os.environ.get('SKIP_UP_TO_DATE_MESSAGES')
+        ),
+        extend_visibility_timeout=get_flag(
+            os.environ.get('EXTEND_VISIBILITY_TIMEOUT')
+        ),
+        reverse_links_path=os.environ.get('REVERSE_LINKS_PATH'),
+        reverse_links_writer=os.environ.get('REVERSE_LINKS_WRITER'),
+        opensearch_http_compress=opensearch_http_compress,
+        portal_compress=get_flag(
+            os.environ.get('PORTAL_COMPRESS'),
+            default=True,
+        ),
+        raw_items=get_flag(
+            os.environ.get('RAW_ITEMS')
+        ),
     )
 
 
@@ -40,6 +69,9 @@ def make_portal_from_config(config: IndexingServiceConfig) -> Portal:
         props=PortalProps(
             backend_url=config.backend_url,
             auth=config.auth,
+            pool_maxsize=max(10, config.max_workers),
+            raw_items=config.raw_items,
+            compress=config.portal_compress,
         )
     )
 
@@ -49,6 +81,7 @@ def make_opensearch_from_config(config: IndexingServiceConfig) -> Opensearch:
         props=OpensearchProps(
             client=config.opensearch_client,
             resources_index=config.opensearch_resources_index,
+            alias_cache_ttl_seconds=60,
         )
     )
 
@@ -84,6 +117,14 @@ def make_indexing_service_from_config(config: IndexingServiceConfig) -> Indexing
             invalidation_queue=invalidation_queue,
             portal=portal,
             opensearch=opensearch,
+            messages_to_handle_per_run=config.messages_to_handle_per_run,
+            max_workers=config.max_workers,
+            skip_up_to_date_messages=config.skip_up_to_date_messages,
+            reverse_links=get_reverse_links(
+                config.reverse_links_path,
+                config.reverse_links_writer,
+            ),
+            extend_visibility_timeout=config.extend_visibility_timeout,
         )
     )
     wait(indexing_service)
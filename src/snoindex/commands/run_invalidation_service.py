@@ -1,6 +1,9 @@
+import logging
 import os
 
 from snoindex.config import InvalidationServiceConfig
+from snoindex.config import get_list_from_comma_separated
+from snoindex.config import get_reverse_links
 from snoindex.config import get_sqs_client
 from snoindex.config import get_opensearch_client
 
@@ -25,6 +28,10 @@ def get_invalidation_service_config() -> InvalidationServiceConfig:
         sqs_client=get_sqs_client(
             os.environ.get('LOCALSTACK_ENDPOINT_URL')
         ),
+        reverse_links_path=os.environ.get('REVERSE_LINKS_PATH'),
+        reverse_links_expected_writers=get_list_from_comma_separated(
+            os.environ.get('REVERSE_LINKS_EXPECTED_WRITERS')
+        ),
     )
 
 
@@ -33,6 +40,9 @@ def make_opensearch_from_config(config: InvalidationServiceConfig) -> Opensearch
         props=OpensearchProps(
             client=config.opensearch_client,
             resources_index=config.opensearch_resources_index,
+            related_uuids_search_slices=int(
+                os.environ.get('RELATED_UUIDS_SEARCH_SLICES', 1)
+            ),
         )
     )
 
@@ -51,10 +61,25 @@ def make_invalidation_queue_from_config(config: InvalidationServiceConfig) -> SQ
         props=SQSQueueProps(
             client=config.sqs_client,
             queue_url=config.invalidation_queue_url,
+            max_concurrent_requests=int(
+                os.environ.get('MAX_CONCURRENT_SQS_REQUESTS', 1)
+            ),
         )
     )
 
 
+def build_reverse_links(invalidation_service: InvalidationService) -> None:
+    reverse_links = invalidation_service.props.reverse_links
+    if reverse_links is None or reverse_links.is_complete():
+        return
+    logging.warning('Building reverse links from resources index')
+    reverse_links.add_links(
+        invalidation_service.props.opensearch.get_embedded_and_linked_uuids()
+    )
+    reverse_links.mark_complete()
+    logging.warning('Built reverse links')
+
+
 def wait(invalidation_service: InvalidationService) -> None:
     invalidation_service.props.transaction_queue.wait_for_queue_to_exist()
     invalidation_service.props.invalidation_queue.wait_for_queue_to_exist()
@@ -75,10 +100,25 @@ def make_invalidation_service_from_config(config: InvalidationServiceConfig) ->
         props=InvalidationServiceProps(
             transaction_queue=transaction_queue,
             invalidation_queue=invalidation_queue,
-            opensearch=opensearch
+            opensearch=opensearch,
+            uuids_per_outbound_message=int(
+                os.environ.get('UUIDS_PER_OUTBOUND_MESSAGE', 1)
+            ),
+            messages_to_handle_per_run=int(
+                os.environ.get('MESSAGES_TO_HANDLE_PER_RUN', 1)
+            ),
+            # Should be less than visibility_timeout of transaction_queue.
+            window_seconds=int(
+                os.environ.get('WINDOW_SECONDS', 10)
+            ),
+            reverse_links=get_reverse_links(
+                config.reverse_links_path,
+                expected_writers=config.reverse_links_expected_writers,
+            ),
         )
     )
     wait(invalidation_service)
+    build_reverse_links(invalidation_service)
     return invalidation_service
 
 
@@ -0,0 +1,75 @@
+import queue
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import TypeVar
+
+
+T = TypeVar('T')
+
+
+class _Done:
+    pass
+
+
+class _Error:
+
+    def __init__(self, exception: Exception) -> None:
+        self.exception = exception
+
+
+def _put(results: 'queue.Queue[Any]', value: Any, stop: threading.Event) -> bool:
+    # Blocks while the buffer is full, gives up if the consumer went away.
+    while not stop.is_set():
+        try:
+            results.put(value, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def iterate_concurrently(
+        make_iterables: List[Callable[[], Iterable[T]]],
+        max_workers: int,
+        buffer_size: int = 10000,
+) -> Iterator[T]:
+    # Consumes every iterable on its own thread, at most max_workers at
+    # a time, and yields their items in arrival order through a bounded
+    # buffer. The first exception raised by any iterable is re-raised.
+    results: 'queue.Queue[Any]' = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+
+    def consume(make_iterable: Callable[[], Iterable[T]]) -> None:
+        try:
+            if stop.is_set():
+                return
+            for value in make_iterable():
+                if not _put(results, value, stop):
+                    return
+        except Exception as e:
+            _put(results, _Error(e), stop)
+        finally:
+            _put(results, _Done(), stop)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for make_iterable in make_iterables:
+            executor.submit(consume, make_iterable)
+        remaining = len(make_iterables)
+        try:
+            while remaining:
+                value = results.get()
+                if isinstance(value, _Done):
+                    remaining -= 1
+                    continue
+                if isinstance(value, _Error):
+                    raise value.exception
+                yield value
+        finally:
+            stop.set()
@@ -1,11 +1,18 @@
 import boto3
+import socket
 
+from opensearchpy import AsyncOpenSearch
 from opensearchpy import OpenSearch
 
 from urllib3.util import Retry
 
 from dataclasses import dataclass
+from dataclasses import field
 
+from snoindex.repository.reverse_links import ReverseLinksProps
+from snoindex.repository.reverse_links import ReverseLinks
+
+from typing import List
 from typing import Optional
 from typing import Tuple
 
@@ -26,15 +33,62 @@ def get_sqs_client(localstack_endpoint_url: Optional[str] = None) -> BaseClient:
     )
 
 
-def get_opensearch_client(url: str) -> OpenSearch:
+# With http_compress request bodies are gzipped and gzipped
+# responses are accepted, trading CPU for bytes on the wire.
+def get_opensearch_client(url: str, maxsize: int = 10, http_compress: bool = False) -> OpenSearch:
     return OpenSearch(
         url,
         timeout=30,
         retries=Retry(3),
         retry_on_timeout=True,
+        maxsize=maxsize,
+        http_compress=http_compress,
+    )
+
+
+def get_async_opensearch_client(url: str, maxsize: int = 10, http_compress: bool = False) -> AsyncOpenSearch:
+    return AsyncOpenSearch(
+        url,
+        timeout=30,
+        retry_on_timeout=True,
+        maxsize=maxsize,
+        http_compress=http_compress,
+    )
+
+
+def get_reverse_links(
+        path: Optional[str],
+        writer: Optional[str] = None,
+        expected_writers: Optional[List[str]] = None,
+) -> Optional[ReverseLinks]:
+    if path is None:
+        return None
+    return ReverseLinks(
+        props=ReverseLinksProps(
+            path=path,
+            writer=writer or socket.gethostname(),
+            expected_writers=expected_writers or [],
+        )
     )
 
 
+def get_list_from_comma_separated(value: Optional[str]) -> List[str]:
+    if not value:
+        return []
+    return [
+        item.strip()
+        for item in value.split(',')
+        if item.strip()
+    ]
+
+
+def get_flag(value: Optional[str], default: bool = False) -> bool:
+    # Flags in the environment are turned on with 'true'.
+    if value is None:
+        return default
+    return value == 'true'
+
+
 @dataclass
 class InvalidationServiceConfig:
     transaction_queue_url: str
@@ -42,6 +96,9 @@ class InvalidationServiceConfig:
     opensearch_client: OpenSearch
     opensearch_resources_index: Optional[str]
     sqs_client: BaseClient
+    reverse_links_path: Optional[str] = None
+    # Indexers that must all write to reverse links before they are used.
+    reverse_links_expected_writers: List[str] = field(default_factory=list)
 
 
 @dataclass
@@ -51,6 +108,7 @@ class BulkInvalidationServiceConfig:
     opensearch_client: OpenSearch
     opensearch_resources_index: Optional[str]
     sqs_client: BaseClient
+    acknowledge_in_background: bool = False
 
 
 @dataclass
@@ -61,3 +119,51 @@ class IndexingServiceConfig:
     opensearch_client: OpenSearch
     opensearch_resources_index: Optional[str]
     sqs_client: BaseClient
+    messages_to_handle_per_run: int = 1
+    max_workers: int = 1
+    skip_up_to_date_messages: bool = False
+    # Worth a heartbeat thread every run only when packed messages
+    # can take longer to index than visibility_timeout.
+    extend_visibility_timeout: bool = False
+    reverse_links_path: Optional[str] = None
+    reverse_links_writer: Optional[str] = None
+    opensearch_http_compress: bool = False
+    portal_compress: bool = True
+    raw_items: bool = False
+
+
+@dataclass
+class BulkIndexingServiceConfig:
+    backend_url: str
+    auth: Tuple[str, str]
+    bulk_invalidation_queue_url: str
+    opensearch_client: OpenSearch
+    opensearch_resources_index: Optional[str]
+    sqs_client: BaseClient
+    skip_up_to_date_messages: bool = False
+    reverse_links_path: Optional[str] = None
+    reverse_links_writer: Optional[str] = None
+    opensearch_http_compress: bool = False
+    portal_compress: bool = True
+    raw_items: bool = False
+    bulk_thread_count: int = 1
+    acknowledge_in_background: bool = False
+
+
+@dataclass
+class AsyncIndexingServiceConfig:
+    backend_url: str
+    auth: Tuple[str, str]
+    invalidation_queue_url: str
+    opensearch_client: OpenSearch
+    async_opensearch_client: AsyncOpenSearch
+    opensearch_resources_index: Optional[str]
+    sqs_client: BaseClient
+    messages_to_handle_per_run: int = 100
+    max_concurrent_requests: int = 100
+    skip_up_to_date_messages: bool = False
+    reverse_links_path: Optional[str] = None
+    reverse_links_writer: Optional[str] = None
+    opensearch_http_compress: bool = False
+    portal_compress: bool = True
+    raw_items: bool = False
@@ -0,0 +1,39 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class AdaptiveBatchSizeProps:
+    initial_size: int = 50
+    min_size: int = 10
+    max_size: int = 1000
+    target_seconds: float = 20.0
+
+
+class AdaptiveBatchSize:
+
+    def __init__(self, props: AdaptiveBatchSizeProps) -> None:
+        self.props = props
+        self.size = self._clamp(props.initial_size)
+
+    def _clamp(self, size: int) -> int:
+        return max(
+            self.props.min_size,
+            min(
+                size,
+                self.props.max_size
+            )
+        )
+
+    def update(self, number_of_messages: int, seconds: float, queue_depth: int) -> int:
+        if number_of_messages == 0:
+            return self.size
+        if seconds > self.props.target_seconds:
+            # Shrink in proportion to how far over target the run was.
+            size = int(self.size * self.props.target_seconds / seconds)
+        elif number_of_messages >= self.size and queue_depth >= self.size:
+            # Full and fast run with a backlog still waiting.
+            size = self.size * 2
+        else:
+            size = self.size
+        self.size = self._clamp(size)
+        return self.size
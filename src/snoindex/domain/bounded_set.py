@@ -0,0 +1,28 @@
+from collections import OrderedDict
+
+from typing import Hashable
+
+
+# Remembers only the maxsize most recently added items, so memory
+# stays flat when deduplicating an unbounded stream.
+class BoundedSet:
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._items: 'OrderedDict[Hashable, None]' = OrderedDict()
+
+    def add(self, item: Hashable) -> bool:
+        # Returns False if item was already seen.
+        if item in self._items:
+            self._items.move_to_end(item)
+            return False
+        self._items[item] = None
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        return True
+
+    def __contains__(self, item: Hashable) -> bool:
+        return item in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -6,16 +6,41 @@ from typing import Dict
 
 @dataclass
 class Item:
+    __slots__ = (
+        'data',
+        'version',
+        'uuid',
+        'index',
+    )
     data: Dict[str, Any]
     version: int
     uuid: str
     index: str
 
+    def get_source(self) -> Any:
+        # Document sent to Opensearch.
+        return self.data
+
     def as_bulk_action(self) -> Dict[str, Any]:
+        # Refers to the source instead of copying it.
         return {
             '_index': self.index,
             '_id': self.uuid,
             '_version': self.version,
             '_version_type': 'external_gte',
-            **self.data,
+            '_source': self.get_source(),
         }
+
+
+@dataclass
+class RawItem(Item):
+    # Keeps the document as the JSON text returned by the portal, which
+    # Opensearch clients send as it is. Data only has the fields the
+    # services read.
+    __slots__ = (
+        'source',
+    )
+    source: str
+
+    def get_source(self) -> Any:
+        return self.source
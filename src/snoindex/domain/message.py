@@ -2,27 +2,72 @@ import json
 
 from dataclasses import dataclass
 
+from snoindex.serialization import loads
+
 from typing import Any
 from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Set
+
+
+NOT_PARSED = object()
 
 
 @dataclass
 class InboundMessage:
+    __slots__ = (
+        'message_id',
+        'receipt_handle',
+        'md5_of_body',
+        'body',
+        '_json_body',
+    )
     message_id: str
     receipt_handle: str
     md5_of_body: str
     body: str
 
+    def __post_init__(self) -> None:
+        # Not a field, so it stays out of init, repr and equality.
+        self._json_body: Any = NOT_PARSED
+
     @property
     def json_body(self) -> Any:
-        return json.loads(
-            self.body
+        # Parsed once and shared, treat as read only.
+        if self._json_body is NOT_PARSED:
+            self._json_body = loads(
+                self.body
+            )
+        return self._json_body
+
+    @classmethod
+    def from_json_body(
+            cls,
+            message_id: str,
+            receipt_handle: str,
+            md5_of_body: str,
+            json_body: Dict[str, Any],
+    ) -> 'InboundMessage':
+        # Starts out parsed, so the body is not parsed again.
+        message = cls(
+            message_id=message_id,
+            receipt_handle=receipt_handle,
+            md5_of_body=md5_of_body,
+            body=json.dumps(
+                json_body
+            ),
         )
+        message._json_body = json_body
+        return message
 
 
 @dataclass
 class OutboundMessage:
+    __slots__ = (
+        'unique_id',
+        'body',
+    )
     unique_id: str
     body: Dict[str, Any]
 
@@ -59,3 +104,98 @@ def convert_received_messages(messages: List[Dict[str, Any]]) -> List[InboundMes
         convert_to_inbound_message(message)
         for message in messages
     ]
+
+
+def unpack_message(message: InboundMessage) -> List[InboundMessage]:
+    # A packed message carries many uuids in data.uuids that share its
+    # xid. Every uuid becomes a message with the same message_id and
+    # receipt_handle, and a body of its own built from the already
+    # parsed metadata. Anything else is returned as it is.
+    try:
+        body = message.json_body
+        uuids = body['data']['uuids']
+    except Exception:
+        return [message]
+    if not uuids:
+        return [message]
+    return [
+        InboundMessage.from_json_body(
+            message_id=message.message_id,
+            receipt_handle=message.receipt_handle,
+            md5_of_body=message.md5_of_body,
+            json_body={
+                'metadata': body['metadata'],
+                'data': {
+                    'uuid': uuid,
+                },
+            },
+        )
+        for uuid in uuids
+    ]
+
+
+def unpack_messages(messages: List[InboundMessage]) -> List[InboundMessage]:
+    return [
+        unpacked_message
+        for message in messages
+        for unpacked_message in unpack_message(message)
+    ]
+
+
+def make_repacked_messages(
+        handled_messages: List[InboundMessage],
+        failed_messages: List[InboundMessage],
+) -> List[OutboundMessage]:
+    # Failed uuids of a packed message that also has handled uuids are
+    # packed into a new message, with the message_id of the old one as
+    # unique_id, so the handled uuids are not indexed again. A message
+    # where every uuid failed is left alone and ends up in the DLQ.
+    handled_message_ids = {
+        message.message_id
+        for message in handled_messages
+    }
+    failed_uuids: Dict[str, Dict[str, None]] = {}
+    metadata: Dict[str, Any] = {}
+    for message in failed_messages:
+        if message.message_id not in handled_message_ids:
+            continue
+        failed_uuids.setdefault(
+            message.message_id,
+            {}
+        )[message.json_body['data']['uuid']] = None
+        metadata[message.message_id] = message.json_body['metadata']
+    return [
+        OutboundMessage(
+            unique_id=message_id,
+            body={
+                'metadata': metadata[message_id],
+                'data': {
+                    'uuids': list(uuids),
+                },
+            },
+        )
+        for message_id, uuids in failed_uuids.items()
+    ]
+
+
+def get_messages_to_mark_as_processed(
+        handled_messages: List[InboundMessage],
+        failed_messages: List[InboundMessage],
+        repacked_message_ids: Optional[Set[str]] = None,
+) -> List[InboundMessage]:
+    # A packed message is only processed once none of its uuids failed,
+    # or its failed uuids were repacked, and is deleted from the queue once.
+    failed_message_ids = {
+        message.message_id
+        for message in failed_messages
+    } - (repacked_message_ids or set())
+    seen_message_ids = set()
+    messages = []
+    for message in handled_messages:
+        if message.message_id in failed_message_ids:
+            continue
+        if message.message_id in seen_message_ids:
+            continue
+        seen_message_ids.add(message.message_id)
+        messages.append(message)
+    return messages
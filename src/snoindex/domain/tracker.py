@@ -6,6 +6,14 @@ from typing import List
 
 
 class MessageTracker:
+    __slots__ = (
+        'number_all_messages',
+        'number_handled_messages',
+        'number_failed_messages',
+        'new_messages',
+        'handled_messages',
+        'failed_messages',
+    )
 
     def __init__(self) -> None:
         self.clear_stats()
@@ -0,0 +1,100 @@
+import aiohttp
+import asyncio
+import logging
+
+from typing import Any
+from typing import Optional
+
+from snoindex.domain.item import Item
+
+from snoindex.remote.portal import PortalProps
+from snoindex.remote.portal import RETRY_STATUSES
+from snoindex.remote.portal import get_accept_encoding
+from snoindex.remote.portal import get_backoff_seconds
+from snoindex.remote.portal import make_item_from_raw_item
+from snoindex.remote.portal import make_raw_item_from_source
+
+from snoindex.serialization import loads
+
+
+def is_retryable(error: Exception) -> bool:
+    # Same policy as the retries of the sync Portal session.
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in RETRY_STATUSES
+    return isinstance(
+        error,
+        (
+            aiohttp.ClientConnectionError,
+            asyncio.TimeoutError,
+        )
+    )
+
+
+class AsyncPortal:
+
+    def __init__(self, props: PortalProps) -> None:
+        self.props = props
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Session has to be created inside the running event loop.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                auth=aiohttp.BasicAuth(*self.props.auth),
+                raise_for_status=True,
+                headers={
+                    'Accept-Encoding': get_accept_encoding(self.props),
+                },
+                connector=aiohttp.TCPConnector(
+                    limit=self.props.pool_maxsize,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=self.props.timeout_seconds,
+                ),
+            )
+        return self._session
+
+    def _make_index_data_view_url_from_uuid(self, uuid: str) -> str:
+        return (
+            f'{self.props.backend_url}/{uuid}/{self.props.index_data_view}'
+            '/?datastore=database'
+        )
+
+    async def _get_body(self, url: str) -> bytes:
+        retry = 0
+        while True:
+            try:
+                async with self._get_session().get(url) as response:
+                    return await response.read()
+            except Exception as e:
+                if retry >= self.props.max_retries or not is_retryable(e):
+                    raise
+                retry += 1
+                logging.warning(f'Retrying {url}, attempt {retry}: {e}')
+                await asyncio.sleep(
+                    get_backoff_seconds(self.props, retry)
+                )
+
+    async def get_raw_item_by_uuid(self, uuid: str) -> Any:
+        url = self._make_index_data_view_url_from_uuid(uuid)
+        return loads(await self._get_body(url))
+
+    async def get_raw_source_by_uuid(self, uuid: str) -> str:
+        url = self._make_index_data_view_url_from_uuid(uuid)
+        return (await self._get_body(url)).decode('utf-8')
+
+    async def get_item(self, uuid: str) -> Item:
+        if self.props.raw_items:
+            return make_raw_item_from_source(
+                uuid,
+                await self.get_raw_source_by_uuid(uuid),
+            )
+        raw_item = await self.get_raw_item_by_uuid(uuid)
+        return make_item_from_raw_item(
+            uuid,
+            raw_item,
+        )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
@@ -2,42 +2,159 @@ import logging
 import time
 import requests
 
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+
 from requests import Response
+from requests import Session
+
+from requests.adapters import HTTPAdapter
+
+from urllib3.util import Retry
 
 from dataclasses import dataclass
 
 from snoindex.domain.item import Item
+from snoindex.domain.item import RawItem
+
+from snoindex.serialization import loads
 
 from typing import Any
 from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
 from typing import Tuple
 
 
 INDEX_DATA_VIEW = '@@index-data-external'
 
+# Fields of the document read by the services.
+RAW_ITEM_FIELDS = [
+    'uuid',
+    'item_type',
+    'index_name',
+    'xmin',
+    'embedded_uuids',
+    'linked_uuids',
+]
+
+# Gateway errors are retried, the backend is likely restarting.
+RETRY_STATUSES = (502, 503, 504)
+
 
 def make_remote_request(url: str) -> Response:
     return requests.get(url)
 
 
-def make_authorized_remote_request(url: str, auth: Tuple[str, str]) -> Response:
-    return requests.get(
+def make_authorized_remote_request(
+        url: str,
+        auth: Tuple[str, str],
+        session: Optional[Session] = None,
+        timeout: Optional[float] = None,
+) -> Response:
+    if session is None:
+        return requests.get(
+            url,
+            auth=auth,
+            timeout=timeout,
+        )
+    return session.get(
         url,
         auth=auth,
+        timeout=timeout,
+    )
+
+
+def make_item_from_raw_item(uuid: str, raw_item: Dict[str, Any]) -> Item:
+    return Item(
+        data=raw_item,
+        version=int(raw_item['xmin']),
+        uuid=uuid,
+        index=raw_item['index_name'],
+    )
+
+
+def make_raw_item_from_source(uuid: str, source: str) -> RawItem:
+    raw_item = loads(source)
+    if '\n' in source:
+        # Bulk requests are newline delimited. Newlines can only be
+        # whitespace between JSON tokens, strings escape them.
+        source = source.replace('\n', ' ')
+    return RawItem(
+        data={
+            field: raw_item[field]
+            for field in RAW_ITEM_FIELDS
+            if field in raw_item
+        },
+        version=int(raw_item['xmin']),
+        uuid=uuid,
+        index=raw_item['index_name'],
+        source=source,
     )
 
 
+@dataclass
+class ItemResult:
+    uuid: str
+    item: Optional[Item] = None
+    error: Optional[Exception] = None
+
+
 @dataclass
 class PortalProps:
     backend_url: str
     auth: Tuple[str, str]
     index_data_view: str = INDEX_DATA_VIEW
+    # Connections kept alive to the backend, should be at
+    # least the number of threads sharing the portal.
+    pool_maxsize: int = 10
+    timeout_seconds: float = 60
+    max_retries: int = 3
+    backoff_factor: float = 0.5
+    # Forward the JSON text of items to Opensearch instead of
+    # decoding and encoding the whole document again.
+    raw_items: bool = False
+    # Ask the backend for gzipped responses. Off requests identity
+    # encoding, which saves CPU when the backend is close by.
+    compress: bool = True
+
+
+def get_accept_encoding(props: PortalProps) -> str:
+    if props.compress:
+        return 'gzip'
+    return 'identity'
+
+
+def get_backoff_seconds(props: PortalProps, retry: int) -> float:
+    # Doubles with every retry.
+    return props.backoff_factor * (1 << (retry - 1))
+
+
+def make_session(props: PortalProps) -> Session:
+    session = Session()
+    session.headers['Accept-Encoding'] = get_accept_encoding(props)
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=props.pool_maxsize,
+        max_retries=Retry(
+            total=props.max_retries,
+            backoff_factor=props.backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET']),
+        ),
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 class Portal:
 
     def __init__(self, props: PortalProps) -> None:
         self.props = props
+        self.session = make_session(props)
+        self._executor: Optional[ThreadPoolExecutor] = None
 
     def _make_index_data_view_url_from_uuid(self, uuid: str) -> str:
         return (
@@ -50,17 +167,65 @@ class Portal:
         return make_authorized_remote_request(
             url,
             self.props.auth,
+            session=self.session,
+            timeout=self.props.timeout_seconds,
         ).json()
 
+    def get_raw_source_by_uuid(self, uuid: str) -> str:
+        url = self._make_index_data_view_url_from_uuid(uuid)
+        return make_authorized_remote_request(
+            url,
+            self.props.auth,
+            session=self.session,
+            timeout=self.props.timeout_seconds,
+        ).content.decode('utf-8')
+
     def get_item(self, uuid: str) -> Item:
+        if self.props.raw_items:
+            return make_raw_item_from_source(
+                uuid,
+                self.get_raw_source_by_uuid(uuid),
+            )
         raw_item = self.get_raw_item_by_uuid(uuid)
-        return Item(
-            data=raw_item,
-            version=int(raw_item['xmin']),
-            uuid=uuid,
-            index=raw_item['index_name'],
+        return make_item_from_raw_item(
+            uuid,
+            raw_item,
         )
 
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.props.pool_maxsize
+            )
+        return self._executor
+
+    def _get_item_result(self, uuid: str) -> ItemResult:
+        try:
+            return ItemResult(
+                uuid=uuid,
+                item=self.get_item(uuid),
+            )
+        except Exception as e:
+            return ItemResult(
+                uuid=uuid,
+                error=e,
+            )
+
+    def get_items(self, uuids: List[str]) -> Iterator[ItemResult]:
+        # Yields results as they complete, one request per uuid
+        # in flight for every pooled connection.
+        executor = self._get_executor()
+        futures = [
+            executor.submit(self._get_item_result, uuid)
+            for uuid in uuids
+        ]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
     def wait_for_portal_connection(self) -> None:
         logging.warning('Waiting for portal connection')
         url = self.props.backend_url
@@ -0,0 +1,110 @@
+import logging
+
+from dataclasses import dataclass
+
+from opensearchpy import AsyncOpenSearch
+
+from opensearchpy.exceptions import ConflictError
+
+from snoindex.domain.item import Item
+
+from snoindex.repository.opensearch import AliasCache
+from snoindex.repository.opensearch import cache_indices_from_aliases
+from snoindex.repository.opensearch import get_cached_current_indices
+from snoindex.repository.opensearch import get_delete_by_id_query
+from snoindex.repository.opensearch import get_indexed_versions_chunks
+from snoindex.repository.opensearch import get_indexed_versions_from_response
+from snoindex.repository.opensearch import get_indexed_versions_query
+from snoindex.repository.opensearch import get_old_indices
+
+from typing import Dict
+from typing import List
+from typing import Optional
+
+
+@dataclass
+class AsyncOpensearchProps:
+    client: AsyncOpenSearch
+    resources_index: Optional[str] = None
+    # Zero disables caching of alias to index lookups.
+    alias_cache_ttl_seconds: float = 0
+
+
+class AsyncOpensearch:
+
+    def __init__(self, props: AsyncOpensearchProps):
+        self.props = props
+        self.alias_cache = AliasCache(
+            ttl_seconds=props.alias_cache_ttl_seconds
+        )
+
+    async def get_indexed_versions(self, uuids: List[str]) -> Dict[str, int]:
+        versions: Dict[str, int] = {}
+        for chunk in get_indexed_versions_chunks(uuids):
+            response = await self.props.client.search(
+                index=self.props.resources_index,
+                body=get_indexed_versions_query(chunk),
+                request_timeout=30,
+            )
+            versions.update(
+                get_indexed_versions_from_response(response)
+            )
+        return versions
+
+    async def _index_item(self, item: Item) -> None:
+        await self.props.client.index(
+            index=item.index,
+            body=item.get_source(),
+            id=item.uuid,
+            request_timeout=30,
+            version=item.version,
+            version_type='external_gte',
+        )
+
+    async def index_item(self, item: Item) -> None:
+        try:
+            await self._index_item(item)
+        except ConflictError as e:
+            logging.warning(f'Skipping: {e}')
+
+    async def _get_current_indices_for_alias(self, alias: str, index: str) -> List[str]:
+        indices = get_cached_current_indices(
+            self.alias_cache,
+            alias,
+            index,
+        )
+        if indices is None:
+            indices = cache_indices_from_aliases(
+                self.alias_cache,
+                alias,
+                await self.props.client.indices.get_alias(index=alias),
+            )
+        return indices
+
+    async def _get_old_indices(self, item: Item) -> List[str]:
+        return get_old_indices(
+            await self._get_current_indices_for_alias(
+                item.data['item_type'],
+                item.index,
+            ),
+            item.index,
+        )
+
+    async def maybe_delete_item_from_old_indices(self, item: Item) -> None:
+        old_indices = await self._get_old_indices(
+            item
+        )
+        if old_indices:
+            try:
+                await self.props.client.delete_by_query(
+                    index=old_indices,
+                    body=get_delete_by_id_query(item.uuid),
+                    conflicts='proceed',
+                )
+            except Exception:
+                # Cached indices might have been deleted.
+                self.alias_cache.invalidate(item.data['item_type'])
+                raise
+
+    async def close(self) -> None:
+        await self.props.client.close()
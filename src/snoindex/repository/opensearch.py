@@ -11,13 +11,31 @@ from opensearchpy.exceptions import ConflictError
 
 from opensearch_dsl import Search
 
+from snoindex.concurrency import iterate_concurrently
+
 from snoindex.domain.item import Item
 
 from typing import Any
+from typing import Callable
 from typing import Dict
+from typing import Iterable
 from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Set
+from typing import Tuple
+
+
+# Returned by external_gte when a newer version is already indexed.
+VERSION_CONFLICT_STATUS = 409
+
+NOT_FOUND_STATUS = 404
+
+# Keeps every indexed versions search well under index.max_result_window.
+INDEXED_VERSIONS_CHUNK_SIZE = 1000
+
+# Room for copies of a uuid in old and new indices during a reindex.
+INDEXED_VERSIONS_COPIES_PER_UUID = 3
 
 
 def get_related_uuids_query(updated: List[str], renamed: List[str]) -> Dict[str, Any]:
@@ -42,6 +60,71 @@ def get_related_uuids_query(updated: List[str], renamed: List[str]) -> Dict[str,
     }
 
 
+def get_indexed_versions_query(uuids: List[str]) -> Dict[str, Any]:
+    return {
+        'query': {
+            'ids': {
+                'values': uuids,
+            },
+        },
+        '_source': False,
+        'version': True,
+        'size': len(uuids) * INDEXED_VERSIONS_COPIES_PER_UUID,
+    }
+
+
+def get_indexed_versions_chunks(uuids: List[str]) -> Iterator[List[str]]:
+    for i in range(0, len(uuids), INDEXED_VERSIONS_CHUNK_SIZE):
+        yield uuids[i:i + INDEXED_VERSIONS_CHUNK_SIZE]
+
+
+def get_indexed_versions_from_hits(hits: List[Dict[str, Any]]) -> Dict[str, int]:
+    # A uuid in more than one index (during a reindex) keeps its lowest version.
+    versions: Dict[str, int] = {}
+    for hit in hits:
+        uuid = hit['_id']
+        version = int(hit['_version'])
+        if uuid not in versions or version < versions[uuid]:
+            versions[uuid] = version
+    return versions
+
+
+def get_indexed_versions_from_response(response: Dict[str, Any]) -> Dict[str, int]:
+    # A cut off copy could hide a lower version, so nothing in
+    # the chunk counts as indexed.
+    hits = response['hits']['hits']
+    total = response['hits']['total']
+    if isinstance(total, dict):
+        total = total['value']
+    if total > len(hits):
+        logging.warning(
+            f'Ignoring indexed versions, got {len(hits)} of {total} hits'
+        )
+        return {}
+    return get_indexed_versions_from_hits(
+        hits
+    )
+
+
+def get_failed_uuids_from_bulk_results(results: Iterable[Tuple[bool, Dict[str, Any]]]) -> List[str]:
+    failed_uuids = []
+    for ok, result in results:
+        if ok:
+            continue
+        for op_type, info in result.items():
+            if info.get('status') == VERSION_CONFLICT_STATUS:
+                logging.warning(f'Skipping: {info.get("error")}')
+                continue
+            if op_type == 'delete' and info.get('status') == NOT_FOUND_STATUS:
+                # Item was never in the old index.
+                continue
+            logging.error(
+                f'Failed to {op_type} {info.get("_id")}: {info.get("error")}'
+            )
+            failed_uuids.append(info['_id'])
+    return failed_uuids
+
+
 def get_search(client: OpenSearch, index: Optional[str]) -> Search:
     return Search(
         using=client,
@@ -49,16 +132,93 @@ def get_search(client: OpenSearch, index: Optional[str]) -> Search:
     )
 
 
+class AliasCache:
+
+    def __init__(self, ttl_seconds: float) -> None:
+        self.ttl_seconds = ttl_seconds
+        self._indices: Dict[str, Tuple[float, List[str]]] = {}
+
+    def get(self, alias: str) -> Optional[List[str]]:
+        cached = self._indices.get(alias)
+        if cached is None:
+            return None
+        expires_at, indices = cached
+        if time.monotonic() >= expires_at:
+            return None
+        return indices
+
+    def set(self, alias: str, indices: List[str]) -> None:
+        if self.ttl_seconds > 0:
+            self._indices[alias] = (
+                time.monotonic() + self.ttl_seconds,
+                indices,
+            )
+
+    def invalidate(self, alias: Optional[str] = None) -> None:
+        if alias is None:
+            self._indices.clear()
+        else:
+            self._indices.pop(alias, None)
+
+
+def get_cached_current_indices(alias_cache: AliasCache, alias: str, index: str) -> Optional[List[str]]:
+    # None means the indices have to be looked up again.
+    indices = alias_cache.get(alias)
+    if indices is not None and index not in indices:
+        # Index was created after the lookup was cached.
+        alias_cache.invalidate(alias)
+        return None
+    return indices
+
+
+def cache_indices_from_aliases(alias_cache: AliasCache, alias: str, aliases: Dict[str, Any]) -> List[str]:
+    indices = list(aliases.keys())
+    alias_cache.set(alias, indices)
+    return indices
+
+
+def get_old_indices(indices: List[str], index: str) -> List[str]:
+    return [
+        old_index
+        for old_index in indices
+        if old_index != index
+    ]
+
+
+def get_delete_by_id_query(uuid: str) -> Dict[str, Any]:
+    return {
+        'query': {
+            'ids': {
+                'values': [
+                    uuid,
+                ]
+            }
+        }
+    }
+
+
 @dataclass
 class OpensearchProps:
     client: OpenSearch
     resources_index: Optional[str] = None
+    # Zero disables caching of alias to index lookups.
+    alias_cache_ttl_seconds: float = 0
+    # Sliced scrolls consumed in parallel for related uuid searches.
+    related_uuids_search_slices: int = 1
+    # Bulk requests are capped by number of actions and by size.
+    bulk_chunk_size: int = 500
+    bulk_max_chunk_bytes: int = 10 * 1024 * 1024
+    # More than one sends bulk requests with parallel_bulk.
+    bulk_thread_count: int = 1
 
 
 class Opensearch:
 
     def __init__(self, props: OpensearchProps):
         self.props = props
+        self.alias_cache = AliasCache(
+            ttl_seconds=props.alias_cache_ttl_seconds
+        )
 
     def get_related_uuids_from_updated_and_renamed(
             self,
@@ -76,13 +236,72 @@ class Opensearch:
         ).params(
             request_timeout=300,
         )
+        if self.props.related_uuids_search_slices > 1:
+            yield from self._scan_slices(search)
+            return
         for hit in search.scan():
             yield hit.meta.id
 
+    def _scan_slices(self, search: Search) -> Iterator[str]:
+        number_of_slices = self.props.related_uuids_search_slices
+
+        def scan_slice(slice_id: int) -> Callable[[], Iterator[str]]:
+            def scan() -> Iterator[str]:
+                sliced_search = search.extra(
+                    slice={
+                        'id': slice_id,
+                        'max': number_of_slices,
+                    }
+                )
+                for hit in sliced_search.scan():
+                    yield hit.meta.id
+            return scan
+        return iterate_concurrently(
+            [
+                scan_slice(slice_id)
+                for slice_id in range(number_of_slices)
+            ],
+            max_workers=number_of_slices,
+        )
+
+    def get_embedded_and_linked_uuids(self) -> Iterator[Tuple[str, List[str], List[str]]]:
+        # Used to build reverse links from everything already indexed.
+        search = get_search(
+            self.props.client,
+            self.props.resources_index,
+        ).source(
+            [
+                'embedded_uuids',
+                'linked_uuids',
+            ]
+        ).params(
+            request_timeout=300,
+        )
+        for hit in search.scan():
+            source = hit.to_dict()
+            yield (
+                hit.meta.id,
+                list(source.get('embedded_uuids', [])),
+                list(source.get('linked_uuids', [])),
+            )
+
+    def get_indexed_versions(self, uuids: List[str]) -> Dict[str, int]:
+        versions: Dict[str, int] = {}
+        for chunk in get_indexed_versions_chunks(uuids):
+            response = self.props.client.search(
+                index=self.props.resources_index,
+                body=get_indexed_versions_query(chunk),
+                request_timeout=30,
+            )
+            versions.update(
+                get_indexed_versions_from_response(response)
+            )
+        return versions
+
     def _index_item(self, item: Item) -> None:
         self.props.client.index(
             index=item.index,
-            body=item.data,
+            body=item.get_source(),
             id=item.uuid,
             request_timeout=30,
             version=item.version,
@@ -95,41 +314,116 @@ class Opensearch:
         except ConflictError as e:
             logging.warning(f'Skipping: {e}')
 
+    def _get_current_indices_for_alias(self, alias: str, index: str) -> List[str]:
+        indices = get_cached_current_indices(
+            self.alias_cache,
+            alias,
+            index,
+        )
+        if indices is None:
+            indices = cache_indices_from_aliases(
+                self.alias_cache,
+                alias,
+                self.props.client.indices.get_alias(index=alias),
+            )
+        return indices
+
     def _get_old_indices(self, item: Item) -> List[str]:
-        index_alias = item.data['item_type']
-        return [
-            index
-            for index in self.props.client.indices.get_alias(index=index_alias).keys()
-            if index != item.index
-        ]
+        return get_old_indices(
+            self._get_current_indices_for_alias(
+                item.data['item_type'],
+                item.index,
+            ),
+            item.index,
+        )
 
     def maybe_delete_item_from_old_indices(self, item: Item) -> None:
         old_indices = self._get_old_indices(
             item
         )
         if old_indices:
-            self.props.client.delete_by_query(
-                index=old_indices,
-                body={
-                    'query': {
-                        'ids': {
-                            'values': [
-                                item.uuid,
-                            ]
-                        }
+            try:
+                self.props.client.delete_by_query(
+                    index=old_indices,
+                    body=get_delete_by_id_query(item.uuid),
+                    conflicts='proceed',
+                )
+            except Exception:
+                # Cached indices might have been deleted.
+                self.alias_cache.invalidate(item.data['item_type'])
+                raise
+
+    def _get_bulk_actions(self, items: Iterable[Item], failed_uuids: List[str]) -> Iterator[Dict[str, Any]]:
+        # Deletes items from old indices in the same bulk request,
+        # looking up every alias once per call. Items whose alias
+        # lookup fails are left out and added to failed_uuids.
+        indices_by_alias: Dict[str, List[str]] = {}
+        failed_aliases: Set[str] = set()
+        for item in items:
+            index_alias = item.data['item_type']
+            if index_alias in failed_aliases:
+                failed_uuids.append(item.uuid)
+                continue
+            indices = indices_by_alias.get(index_alias)
+            if indices is None or item.index not in indices:
+                try:
+                    indices = self._get_current_indices_for_alias(
+                        index_alias,
+                        item.index,
+                    )
+                except Exception as e:
+                    logging.error(
+                        f'Failed to get indices for {index_alias}: {e}'
+                    )
+                    failed_aliases.add(index_alias)
+                    failed_uuids.append(item.uuid)
+                    continue
+                indices_by_alias[index_alias] = indices
+            for index in indices:
+                if index != item.index:
+                    yield {
+                        '_op_type': 'delete',
+                        '_index': index,
+                        '_id': item.uuid,
                     }
-                },
-                conflicts='proceed',
-            )
+            yield item.as_bulk_action()
 
-    def bulk_index_items(self, items: List[Item]) -> None:
-        helpers.bulk(
+    def _bulk(self, actions: Iterable[Dict[str, Any]]) -> Iterable[Tuple[bool, Dict[str, Any]]]:
+        if self.props.bulk_thread_count > 1:
+            return helpers.parallel_bulk(
+                self.props.client,
+                actions,
+                thread_count=self.props.bulk_thread_count,
+                chunk_size=self.props.bulk_chunk_size,
+                max_chunk_bytes=self.props.bulk_max_chunk_bytes,
+                raise_on_error=False,
+                raise_on_exception=False,
+            )
+        return helpers.streaming_bulk(
             self.props.client,
-            (
-                item.as_bulk_action()
-                for item in items
-            ),
+            actions,
+            chunk_size=self.props.bulk_chunk_size,
+            max_chunk_bytes=self.props.bulk_max_chunk_bytes,
+            raise_on_error=False,
+            raise_on_exception=False,
+            yield_ok=False,
+        )
+
+    def bulk_index_items(self, items: Iterable[Item]) -> List[str]:
+        # Returns uuids of items that failed to index. Version
+        # conflicts mean a newer version exists and count as indexed.
+        # Items are consumed lazily, one chunk at a time.
+        failed_uuids: List[str] = []
+        results = self._bulk(
+            self._get_bulk_actions(
+                items,
+                failed_uuids,
+            )
         )
+        # Reading all results first consumes every item.
+        return get_failed_uuids_from_bulk_results(
+            results
+        ) + failed_uuids
 
     def refresh_resources_index(self) -> None:
         if self.props.resources_index is not None:
@@ -1 +1,4 @@
 AWS_SQS_MAX_NUMBER = 10
+
+# Limit for a single message and for all messages in a batch.
+AWS_SQS_MAX_PAYLOAD_BYTES = 262144
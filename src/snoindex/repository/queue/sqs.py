@@ -1,16 +1,30 @@
 import logging
+import threading
 import time
 
 from botocore.client import BaseClient
 
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
 from dataclasses import dataclass
 
+from types import TracebackType
+
 from typing import Any
+from typing import Callable
+from typing import Dict
 from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Type
 
 from snoindex.repository.queue.constants import AWS_SQS_MAX_NUMBER
+from snoindex.repository.queue.constants import AWS_SQS_MAX_PAYLOAD_BYTES
+
+from snoindex.concurrency import iterate_concurrently
 
 from snoindex.domain.message import convert_received_messages
 from snoindex.domain.message import InboundMessage
@@ -22,35 +36,248 @@ def batch(items: List[Any], batchsize: int = AWS_SQS_MAX_NUMBER) -> Iterable[Lis
         yield items[i:i + batchsize]
 
 
+def batch_by_size(
+        entries: List[Dict[str, Any]],
+        max_number: int = AWS_SQS_MAX_NUMBER,
+        max_bytes: int = AWS_SQS_MAX_PAYLOAD_BYTES,
+) -> Iterable[List[Dict[str, Any]]]:
+    # Batches are limited by count and by total payload size.
+    entries_batch: List[Dict[str, Any]] = []
+    batch_bytes = 0
+    for entry in entries:
+        entry_bytes = len(entry['MessageBody'].encode('utf-8'))
+        if entries_batch and (
+                len(entries_batch) >= max_number
+                or batch_bytes + entry_bytes > max_bytes
+        ):
+            yield entries_batch
+            entries_batch = []
+            batch_bytes = 0
+        entries_batch.append(entry)
+        batch_bytes += entry_bytes
+    if entries_batch:
+        yield entries_batch
+
+
+class FailedEntriesError(Exception):
+    pass
+
+
+class ReceiveQuota:
+    # Shared by concurrent receivers so together they never
+    # ask for more than the desired number of messages.
+
+    def __init__(self, number_of_messages: int) -> None:
+        self._lock = threading.Lock()
+        self._left = number_of_messages
+
+    def reserve(self, number_of_messages: int) -> int:
+        with self._lock:
+            reserved = max(min(number_of_messages, self._left), 0)
+            self._left -= reserved
+            return reserved
+
+    def release(self, number_of_messages: int) -> None:
+        with self._lock:
+            self._left += number_of_messages
+
+
+class Lease:
+    # Extends the visibility timeout of messages on a background
+    # thread until stopped, so long running work is not redelivered.
+    # Messages can be added while it runs, as they are received.
+
+    def __init__(self, queue: 'SQSQueue', messages: Optional[List[InboundMessage]] = None) -> None:
+        self.queue = queue
+        self._lock = threading.Lock()
+        self._messages: Dict[str, InboundMessage] = {}
+        self.heartbeat_seconds = (
+            queue.props.lease_heartbeat_seconds
+            if queue.props.lease_heartbeat_seconds is not None
+            else queue.props.visibility_timeout / 3
+        )
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.add(messages or [])
+
+    @property
+    def messages(self) -> List[InboundMessage]:
+        with self._lock:
+            return list(self._messages.values())
+
+    def add(self, messages: List[InboundMessage]) -> None:
+        # Just received messages are invisible for a full
+        # visibility_timeout, the next heartbeat comes sooner.
+        with self._lock:
+            for message in messages:
+                self._messages.setdefault(message.message_id, message)
+
+    def extend(self) -> None:
+        messages = self.messages
+        if not messages:
+            return
+        try:
+            self.queue.change_visibility_timeout(
+                messages,
+                self.queue.props.visibility_timeout,
+            )
+        except Exception as e:
+            logging.error(
+                f'Failed to extend lease of {len(messages)} messages: {e}'
+            )
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.heartbeat_seconds):
+            self.extend()
+
+    def start(self) -> 'Lease':
+        if self._thread is None:
+            # Messages received earlier could be close to becoming
+            # visible again, so they are extended before waiting.
+            self.extend()
+            self._thread = threading.Thread(
+                target=self._run,
+                daemon=True,
+            )
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> 'Lease':
+        return self.start()
+
+    def __exit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc_value: Optional[BaseException],
+            traceback: Optional[TracebackType],
+    ) -> None:
+        self.stop()
+
+
 @dataclass
 class SQSQueueProps:
     client: BaseClient
     queue_url: str
     wait_time_seconds: int = 20
     visibility_timeout: int = 60
+    # Long polls in flight at the same time in get_messages.
+    max_concurrent_receives: int = 1
+    # Batch requests in flight at the same time.
+    max_concurrent_requests: int = 1
+    # Failed entries of a batch request are retried with
+    # exponential backoff before giving up.
+    max_retries: int = 3
+    retry_backoff_seconds: float = 0.5
+    # Returns from mark_as_processed right away and deletes messages
+    # in order on a background thread. Failed deletes are logged and
+    # the messages come back after visibility_timeout.
+    acknowledge_in_background: bool = False
+    # How often leased messages get a new visibility_timeout,
+    # defaults to a third of it.
+    lease_heartbeat_seconds: Optional[float] = None
 
 
 class SQSQueue:
 
     def __init__(self, *args: Any, props: SQSQueueProps, **kwargs: Any) -> None:
         self.props = props
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._background_executor: Optional[ThreadPoolExecutor] = None
+        self._background_acknowledgements: List['Future[None]'] = []
 
-    def _send_messages(self, messages: List[OutboundMessage]) -> None:
-        self.props.client.send_message_batch(
-            QueueUrl=self.props.queue_url,
-            Entries=[
-                {
-                    'Id': message.unique_id,
-                    'MessageBody': message.str_body,
-                }
-                for message in messages
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.props.max_concurrent_requests
+            )
+        return self._executor
+
+    def _call_with_retries(
+            self,
+            call: Callable[[List[Dict[str, Any]]], Any],
+            entries: List[Dict[str, Any]],
+    ) -> None:
+        # Retries only the failed entries. Sender faults will not
+        # succeed on retry and are raised right away.
+        attempt = 0
+        while True:
+            failed = call(entries).get('Failed', [])
+            if not failed:
+                return
+            sender_faults = [
+                entry
+                for entry in failed
+                if entry.get('SenderFault')
             ]
+            if sender_faults or attempt >= self.props.max_retries:
+                raise FailedEntriesError(
+                    f'{len(failed)} failed entries in {self.props.queue_url}: {failed}'
+                )
+            attempt += 1
+            logging.warning(
+                f'Retrying {len(failed)} failed entries, attempt {attempt}'
+            )
+            time.sleep(
+                self.props.retry_backoff_seconds * 2 ** (attempt - 1)
+            )
+            failed_ids = {
+                entry['Id']
+                for entry in failed
+            }
+            entries = [
+                entry
+                for entry in entries
+                if entry['Id'] in failed_ids
+            ]
+
+    def _run_batches(self, run: Callable[[List[Any]], None], batches: List[List[Any]]) -> None:
+        if self.props.max_concurrent_requests <= 1 or len(batches) <= 1:
+            for items in batches:
+                run(items)
+            return
+        executor = self._get_executor()
+        futures = [
+            executor.submit(run, items)
+            for items in batches
+        ]
+        wait(futures)
+        for future in futures:
+            future.result()
+
+    def _send_message_batch(self, entries: List[Dict[str, Any]]) -> Any:
+        return self.props.client.send_message_batch(
+            QueueUrl=self.props.queue_url,
+            Entries=entries,
+        )
+
+    def _send_messages(self, entries: List[Dict[str, Any]]) -> None:
+        self._call_with_retries(
+            self._send_message_batch,
+            entries,
         )
 
     def send_messages(self, messages: List[OutboundMessage]) -> None:
-        batched_messages = batch(messages, batchsize=AWS_SQS_MAX_NUMBER)
-        for message_batch in batched_messages:
-            self._send_messages(message_batch)
+        if not messages:
+            return
+        entries = [
+            {
+                'Id': message.unique_id,
+                'MessageBody': message.str_body,
+            }
+            for message in messages
+        ]
+        self._run_batches(
+            self._send_messages,
+            list(
+                batch_by_size(entries)
+            ),
+        )
 
     def _get_messages(
             self,
@@ -69,7 +296,28 @@ class SQSQueue:
             self,
             desired_number_of_messages: int = 50,
             timeout_seconds: Optional[int] = None,
+            lease: Optional[Lease] = None,
     ) -> Iterable[InboundMessage]:
+        # Messages are added to the lease as soon as they are received,
+        # pulling a large batch can take longer than visibility_timeout.
+        if self.props.max_concurrent_receives > 1:
+            return self._get_messages_concurrently(
+                desired_number_of_messages,
+                timeout_seconds,
+                lease,
+            )
+        return self._get_messages_serially(
+            desired_number_of_messages,
+            timeout_seconds,
+            lease,
+        )
+
+    def _get_messages_serially(
+            self,
+            desired_number_of_messages: int,
+            timeout_seconds: Optional[int],
+            lease: Optional[Lease] = None,
+    ) -> Iterator[InboundMessage]:
         start_time = time.monotonic()
         number_of_received_messages = 0
         while True:
@@ -93,26 +341,178 @@ class SQSQueue:
             )
             if not messages:
                 break
+            if lease is not None:
+                lease.add(messages)
             number_of_received_messages += len(messages)
             for message in messages:
                 yield message
 
+    def _receive(
+            self,
+            quota: ReceiveQuota,
+            start_time: float,
+            timeout_seconds: Optional[int],
+            lease: Optional[Lease] = None,
+    ) -> Iterator[InboundMessage]:
+        # Stops like the serial loop, on timeout, once the quota is
+        # used up, or when a long poll comes back empty.
+        while True:
+            time_so_far = time.monotonic() - start_time
+            if timeout_seconds is not None and time_so_far >= timeout_seconds:
+                logging.info(
+                    f'Reached timeout in getting messages from queue: {time_so_far}'
+                )
+                break
+            max_number_of_messages = quota.reserve(AWS_SQS_MAX_NUMBER)
+            if max_number_of_messages <= 0:
+                break
+            messages = self._get_messages(
+                max_number_of_messages=max_number_of_messages
+            )
+            quota.release(max_number_of_messages - len(messages))
+            if not messages:
+                break
+            if lease is not None:
+                lease.add(messages)
+            yield from messages
+
+    def _get_messages_concurrently(
+            self,
+            desired_number_of_messages: int,
+            timeout_seconds: Optional[int],
+            lease: Optional[Lease] = None,
+    ) -> Iterator[InboundMessage]:
+        start_time = time.monotonic()
+        quota = ReceiveQuota(desired_number_of_messages)
+        number_of_receivers = min(
+            self.props.max_concurrent_receives,
+            -(-desired_number_of_messages // AWS_SQS_MAX_NUMBER),
+        )
+        if number_of_receivers <= 0:
+            return iter([])
+        return iterate_concurrently(
+            [
+                lambda: self._receive(
+                    quota,
+                    start_time,
+                    timeout_seconds,
+                    lease,
+                )
+                for _ in range(number_of_receivers)
+            ],
+            max_workers=number_of_receivers,
+            buffer_size=AWS_SQS_MAX_NUMBER * number_of_receivers,
+        )
+
+    def _delete_message_batch(self, entries: List[Dict[str, Any]]) -> Any:
+        return self.props.client.delete_message_batch(
+            QueueUrl=self.props.queue_url,
+            Entries=entries,
+        )
+
     def _mark_as_processed(self, messages: List[InboundMessage]) -> None:
-        self.props.client.delete_message_batch(
+        self._call_with_retries(
+            self._delete_message_batch,
+            [
+                {
+                    'Id': message.message_id,
+                    'ReceiptHandle': message.receipt_handle,
+                }
+                for message in messages
+            ]
+        )
+
+    def _mark_all_as_processed(self, messages: List[InboundMessage]) -> None:
+        start_time = time.monotonic()
+        self._run_batches(
+            self._mark_as_processed,
+            list(
+                batch(messages, batchsize=AWS_SQS_MAX_NUMBER)
+            ),
+        )
+        seconds = time.monotonic() - start_time
+        logging.info(
+            f'Deleted {len(messages)} messages in {seconds:.2f}s'
+        )
+
+    def _change_message_visibility_batch(self, entries: List[Dict[str, Any]]) -> Any:
+        return self.props.client.change_message_visibility_batch(
             QueueUrl=self.props.queue_url,
-            Entries=[
+            Entries=entries,
+        )
+
+    def _change_visibility_timeout(self, messages: List[InboundMessage], visibility_timeout: int) -> None:
+        self._call_with_retries(
+            self._change_message_visibility_batch,
+            [
                 {
                     'Id': message.message_id,
                     'ReceiptHandle': message.receipt_handle,
+                    'VisibilityTimeout': visibility_timeout,
                 }
                 for message in messages
             ]
         )
 
+    def change_visibility_timeout(self, messages: List[InboundMessage], visibility_timeout: int) -> None:
+        self._run_batches(
+            lambda messages_batch: self._change_visibility_timeout(
+                messages_batch,
+                visibility_timeout,
+            ),
+            list(
+                batch(messages, batchsize=AWS_SQS_MAX_NUMBER)
+            ),
+        )
+
+    def lease(self, messages: Optional[List[InboundMessage]] = None) -> Lease:
+        # Use as a context manager around receiving and handling
+        # of messages, adding them as they are received.
+        return Lease(
+            queue=self,
+            messages=messages,
+        )
+
+    def _get_background_executor(self) -> ThreadPoolExecutor:
+        if self._background_executor is None:
+            self._background_executor = ThreadPoolExecutor(
+                max_workers=1
+            )
+        return self._background_executor
+
+    def _log_background_acknowledgement_error(self, future: 'Future[None]') -> None:
+        exception = future.exception()
+        if exception is not None:
+            logging.error(
+                f'Failed to delete messages from {self.props.queue_url}: {exception}'
+            )
+
+    def mark_as_processed_in_background(self, messages: List[InboundMessage]) -> 'Future[None]':
+        future = self._get_background_executor().submit(
+            self._mark_all_as_processed,
+            list(messages),
+        )
+        future.add_done_callback(
+            self._log_background_acknowledgement_error
+        )
+        self._background_acknowledgements = [
+            acknowledgement
+            for acknowledgement in self._background_acknowledgements
+            if not acknowledgement.done()
+        ] + [future]
+        return future
+
+    def wait_for_background_acknowledgements(self) -> None:
+        wait(self._background_acknowledgements)
+        self._background_acknowledgements = []
+
     def mark_as_processed(self, messages: List[InboundMessage]) -> None:
-        batched_messages = batch(messages, batchsize=AWS_SQS_MAX_NUMBER)
-        for message_batch in batched_messages:
-            self._mark_as_processed(message_batch)
+        if not messages:
+            return
+        if self.props.acknowledge_in_background:
+            self.mark_as_processed_in_background(messages)
+            return
+        self._mark_all_as_processed(messages)
 
     def info(self) -> Any:
         return self.props.client.get_queue_attributes(
@@ -167,3 +567,4 @@ class SQSQueue:
             )
             if messages:
                 self.mark_as_processed(messages)
+                self.wait_for_background_acknowledgements()
@@ -0,0 +1,247 @@
+import socket
+import sqlite3
+import threading
+import time
+
+from dataclasses import dataclass
+from dataclasses import field
+
+from snoindex.domain.item import Item
+
+from typing import Any
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+
+EMBEDDED = 'embedded'
+
+LINKED = 'linked'
+
+# Stays below the default SQLITE_MAX_VARIABLE_NUMBER of older SQLite builds.
+MAX_VARIABLES_PER_QUERY = 900
+
+ADD_LINKS_CHUNK_SIZE = 1000
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS links (
+        kind TEXT NOT NULL,
+        target TEXT NOT NULL,
+        source TEXT NOT NULL,
+        PRIMARY KEY (kind, target, source)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS links_source ON links (source)
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS versions (
+        uuid TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    ) WITHOUT ROWID
+    ''',
+]
+
+
+def get_links_from_item(item: Item) -> List[Tuple[str, str, str]]:
+    links = []
+    for target in item.data.get('embedded_uuids', []):
+        links.append((EMBEDDED, target, item.uuid))
+    for target in item.data.get('linked_uuids', []):
+        links.append((LINKED, target, item.uuid))
+    return links
+
+
+def get_writer_heartbeat_key(writer: str) -> str:
+    return f'writer_heartbeat:{writer}'
+
+
+def batch(items: List[Any], batchsize: int) -> Iterable[List[Any]]:
+    for i in range(0, len(items), batchsize):
+        yield items[i:i + batchsize]
+
+
+@dataclass
+class ReverseLinksProps:
+    # SQLite database file, shared by indexing and invalidation
+    # services running on the same host.
+    path: str
+    # Indexers record a heartbeat every run. Without a recent one
+    # nothing keeps the links up to date, so lookups are not trusted.
+    max_writer_heartbeat_age_seconds: float = 300
+    # Heartbeats of this indexer are recorded under this name, which
+    # should be unique among indexers writing to the store.
+    writer: str = field(default_factory=socket.gethostname)
+    # Every indexer that must be writing before lookups are trusted.
+    # An indexer writing somewhere else would leave links of its items
+    # out of date. Empty never trusts lookups.
+    expected_writers: List[str] = field(default_factory=list)
+
+
+class ReverseLinks:
+    # Maps every uuid to the items that embed or link it, so
+    # invalidation can skip the embedded_uuids and linked_uuids
+    # searches in Opensearch. Only answers lookups once marked
+    # complete and while every expected indexer is writing to it,
+    # until then callers should fall back to Opensearch.
+
+    def __init__(self, props: ReverseLinksProps) -> None:
+        self.props = props
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            props.path,
+            timeout=30,
+            check_same_thread=False,
+        )
+        with self._lock, self._connection:
+            # Lets readers in other processes see committed writes.
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                self._connection.execute(statement)
+
+    def update_items(self, items: List[Item]) -> None:
+        # Replaces links of every item unless a newer version
+        # was already recorded, like external_gte.
+        with self._lock, self._connection:
+            for item in items:
+                row = self._connection.execute(
+                    'SELECT version FROM versions WHERE uuid = ?',
+                    (item.uuid,),
+                ).fetchone()
+                if row is not None and row[0] > item.version:
+                    continue
+                self._connection.execute(
+                    'DELETE FROM links WHERE source = ?',
+                    (item.uuid,),
+                )
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO links VALUES (?, ?, ?)',
+                    get_links_from_item(item),
+                )
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO versions VALUES (?, ?)',
+                    (item.uuid, item.version),
+                )
+
+    def update_item(self, item: Item) -> None:
+        self.update_items([item])
+
+    def _add_links(self, links: List[Tuple[str, List[str], List[str]]]) -> None:
+        with self._lock, self._connection:
+            for uuid, embedded_uuids, linked_uuids in links:
+                self._connection.executemany(
+                    'INSERT OR IGNORE INTO links VALUES (?, ?, ?)',
+                    [
+                        (EMBEDDED, target, uuid)
+                        for target in embedded_uuids
+                    ] + [
+                        (LINKED, target, uuid)
+                        for target in linked_uuids
+                    ],
+                )
+
+    def add_links(self, links: Iterable[Tuple[str, List[str], List[str]]]) -> None:
+        # Takes (uuid, embedded_uuids, linked_uuids) from an existing
+        # index. Only adds, so links written by a running indexer
+        # are never lost, at worst something is invalidated twice.
+        # Commits in chunks to not block the indexer for long.
+        chunk = []
+        for link in links:
+            chunk.append(link)
+            if len(chunk) >= ADD_LINKS_CHUNK_SIZE:
+                self._add_links(chunk)
+                chunk = []
+        if chunk:
+            self._add_links(chunk)
+
+    def _get_sources(self, kind: str, targets: List[str]) -> List[str]:
+        sources: List[str] = []
+        for targets_batch in batch(targets, MAX_VARIABLES_PER_QUERY):
+            placeholders = ', '.join('?' * len(targets_batch))
+            with self._lock:
+                rows = self._connection.execute(
+                    f'SELECT DISTINCT source FROM links '
+                    f'WHERE kind = ? AND target IN ({placeholders})',
+                    [kind] + targets_batch,
+                ).fetchall()
+            sources.extend(
+                row[0]
+                for row in rows
+            )
+        return sources
+
+    def get_related_uuids_from_updated_and_renamed(
+            self,
+            updated: List[str],
+            renamed: List[str],
+    ) -> Iterator[str]:
+        seen = set()
+        for uuid in (
+                self._get_sources(EMBEDDED, updated)
+                + self._get_sources(LINKED, renamed)
+        ):
+            if uuid not in seen:
+                seen.add(uuid)
+                yield uuid
+
+    def is_complete(self) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM meta WHERE key = 'complete'"
+            ).fetchone()
+        return row is not None and row[0] == 'true'
+
+    def mark_complete(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('complete', 'true')"
+            )
+
+    def record_writer_heartbeat(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                (
+                    get_writer_heartbeat_key(self.props.writer),
+                    str(time.time()),
+                ),
+            )
+
+    def has_active_writers(self) -> bool:
+        if not self.props.expected_writers:
+            return False
+        keys = [
+            get_writer_heartbeat_key(writer)
+            for writer in self.props.expected_writers
+        ]
+        placeholders = ', '.join('?' * len(keys))
+        with self._lock:
+            heartbeats = dict(
+                self._connection.execute(
+                    f'SELECT key, value FROM meta WHERE key IN ({placeholders})',
+                    keys,
+                ).fetchall()
+            )
+        now = time.time()
+        return all(
+            key in heartbeats
+            and now - float(heartbeats[key]) <= self.props.max_writer_heartbeat_age_seconds
+            for key in keys
+        )
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            for table in ['links', 'versions', 'meta']:
+                self._connection.execute(f'DELETE FROM {table}')
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
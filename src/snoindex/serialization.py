@@ -0,0 +1,15 @@
+import json
+
+from typing import Any
+from typing import Callable
+from typing import Union
+
+
+# Uses orjson to parse JSON when it is installed.
+loads: Callable[[Union[str, bytes]], Any] = json.loads
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    pass
@@ -0,0 +1,265 @@
+import asyncio
+import logging
+
+from dataclasses import dataclass
+
+from snoindex.domain.message import InboundMessage
+from snoindex.domain.message import unpack_messages
+
+from snoindex.domain.tracker import MessageTracker
+
+from snoindex.repository.queue.sqs import Lease
+from snoindex.repository.queue.sqs import SQSQueue
+
+from snoindex.repository.async_opensearch import AsyncOpensearch
+
+from snoindex.repository.reverse_links import ReverseLinks
+
+from snoindex.remote.async_portal import AsyncPortal
+
+from snoindex.services.indexing import deduplicate_messages
+from snoindex.services.indexing import get_uuid_and_version_from_message
+from snoindex.services.indexing import mark_messages_as_processed
+from snoindex.services.indexing import record_reverse_links_heartbeat
+from snoindex.services.indexing import try_to_split_up_to_date_messages
+
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+@dataclass
+class AsyncIndexingServiceProps:
+    invalidation_queue: SQSQueue
+    portal: AsyncPortal
+    opensearch: AsyncOpensearch
+    messages_to_handle_per_run: int = 100
+    # Bounds on requests in flight for each stage.
+    max_concurrent_fetches: int = 100
+    max_concurrent_writes: int = 50
+    # Check indexed versions before fetching from portal. Leave off
+    # while migrating to new indices, old copies would count as indexed.
+    skip_up_to_date_messages: bool = False
+    # Kept up to date with links of every indexed item.
+    reverse_links: Optional[ReverseLinks] = None
+    # Keeps messages invisible from when they are received until they
+    # are marked as processed, batches are prefetched while the one
+    # before is handled and can outlast visibility_timeout.
+    extend_visibility_timeout: bool = False
+
+
+class AsyncIndexingService:
+
+    def __init__(self, props: AsyncIndexingServiceProps) -> None:
+        self.props = props
+        self.tracker = MessageTracker()
+
+    async def split_up_to_date_messages(
+            self,
+            messages: List[InboundMessage],
+    ) -> Tuple[List[InboundMessage], List[InboundMessage]]:
+        if not self.props.skip_up_to_date_messages:
+            return (messages, [])
+        loop = asyncio.get_running_loop()
+
+        def get_indexed_versions(uuids: List[str]) -> Dict[str, int]:
+            # Runs the search on the loop from the executor thread.
+            return asyncio.run_coroutine_threadsafe(
+                self.props.opensearch.get_indexed_versions(uuids),
+                loop,
+            ).result()
+        return await loop.run_in_executor(
+            None,
+            try_to_split_up_to_date_messages,
+            messages,
+            get_indexed_versions,
+            self.props.skip_up_to_date_messages,
+        )
+
+    async def handle_message(
+            self,
+            message: InboundMessage,
+            fetch_semaphore: asyncio.Semaphore,
+            write_semaphore: asyncio.Semaphore,
+    ) -> None:
+        uuid, _ = get_uuid_and_version_from_message(message)
+        async with fetch_semaphore:
+            item = await self.props.portal.get_item(uuid)
+        async with write_semaphore:
+            await self.props.opensearch.maybe_delete_item_from_old_indices(item)
+            await self.props.opensearch.index_item(item)
+        if self.props.reverse_links is not None:
+            # SQLite is blocking, writes run in the default executor.
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None,
+                self.props.reverse_links.update_item,
+                item,
+            )
+        self.tracker.add_handled_messages([message])
+
+    async def _try_to_handle_message(
+            self,
+            message: InboundMessage,
+            fetch_semaphore: asyncio.Semaphore,
+            write_semaphore: asyncio.Semaphore,
+    ) -> None:
+        try:
+            await self.handle_message(
+                message,
+                fetch_semaphore,
+                write_semaphore,
+            )
+        except Exception as e:
+            logging.error(e)
+            self.tracker.add_failed_messages(
+                [
+                    message
+                ]
+            )
+
+    async def try_to_handle_messages(self) -> None:
+        messages, superseded = deduplicate_messages(
+            self.tracker.new_messages
+        )
+        messages, up_to_date = await self.split_up_to_date_messages(
+            messages
+        )
+        # Indexing the latest message covers the ones it supersedes.
+        self.tracker.add_handled_messages(
+            superseded + up_to_date
+        )
+        # Semaphores are bound to the running loop.
+        fetch_semaphore = asyncio.Semaphore(self.props.max_concurrent_fetches)
+        write_semaphore = asyncio.Semaphore(self.props.max_concurrent_writes)
+        await asyncio.gather(
+            *(
+                self._try_to_handle_message(
+                    message,
+                    fetch_semaphore,
+                    write_semaphore,
+                )
+                for message in messages
+            )
+        )
+
+    def start_lease(self) -> Optional[Lease]:
+        if not self.props.extend_visibility_timeout:
+            return None
+        return self.props.invalidation_queue.lease().start()
+
+    async def stop_lease(self, lease: Optional[Lease]) -> None:
+        if lease is None:
+            return
+        # Joins the heartbeat thread, which can be mid request.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None,
+            lease.stop,
+        )
+
+    def _get_messages(self, lease: Optional[Lease] = None) -> List[InboundMessage]:
+        return unpack_messages(
+            list(
+                self.props.invalidation_queue.get_messages(
+                    desired_number_of_messages=self.props.messages_to_handle_per_run,
+                    lease=lease,
+                )
+            )
+        )
+
+    async def receive_messages(self, lease: Optional[Lease] = None) -> List[InboundMessage]:
+        # SQS client is blocking so long polls run in the default executor.
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None,
+            self._get_messages,
+            lease,
+        )
+
+    async def get_new_messages_from_queue(self, lease: Optional[Lease] = None) -> None:
+        self.tracker.add_new_messages(
+            await self.receive_messages(lease)
+        )
+
+    async def mark_handled_messages_as_processed(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None,
+            mark_messages_as_processed,
+            self.props.invalidation_queue,
+            self.tracker.handled_messages,
+            self.tracker.failed_messages,
+        )
+
+    def _should_log_stats(self) -> bool:
+        return (
+            self.tracker.number_all_messages != 0
+            and self.tracker.number_all_messages % 100 == 0
+        )
+
+    def log_stats(self) -> None:
+        if self._should_log_stats():
+            logging.warning(
+                f'{self.__class__.__name__}: {self.tracker.stats()}'
+            )
+
+    def clear(self) -> None:
+        self.tracker.clear()
+
+    async def record_reverse_links_heartbeat(self) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None,
+            record_reverse_links_heartbeat,
+            self.props.reverse_links,
+        )
+
+    async def _handle_new_messages(self, lease: Optional[Lease] = None) -> None:
+        await self.record_reverse_links_heartbeat()
+        try:
+            await self.try_to_handle_messages()
+        finally:
+            await self.stop_lease(lease)
+        await self.mark_handled_messages_as_processed()
+        self.log_stats()
+        self.clear()
+
+    async def run_once(self) -> None:
+        lease = self.start_lease()
+        try:
+            await self.get_new_messages_from_queue(lease)
+        except Exception:
+            await self.stop_lease(lease)
+            raise
+        await self._handle_new_messages(lease)
+
+    async def _poll(self) -> None:
+        # Long poll for the next batch while the current one is handled,
+        # each batch has its own lease from receive until processed.
+        next_lease = self.start_lease()
+        next_messages = asyncio.ensure_future(
+            self.receive_messages(next_lease)
+        )
+        lease = None
+        try:
+            while True:
+                self.tracker.add_new_messages(
+                    await next_messages
+                )
+                lease = next_lease
+                next_lease = self.start_lease()
+                next_messages = asyncio.ensure_future(
+                    self.receive_messages(next_lease)
+                )
+                await self._handle_new_messages(lease)
+        finally:
+            next_messages.cancel()
+            await self.stop_lease(lease)
+            await self.stop_lease(next_lease)
+            await self.props.portal.close()
+            await self.props.opensearch.close()
+
+    def poll(self) -> None:
+        asyncio.run(self._poll())
@@ -1,18 +1,42 @@
 import logging
+import time
+
+from collections import defaultdict
+
+from contextlib import nullcontext
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 
 from dataclasses import dataclass
 
+from snoindex.domain.batch import AdaptiveBatchSize
+
+from snoindex.domain.item import Item
+
 from snoindex.domain.message import InboundMessage
+from snoindex.domain.message import get_messages_to_mark_as_processed
+from snoindex.domain.message import make_repacked_messages
+from snoindex.domain.message import unpack_messages
 
 from snoindex.domain.tracker import MessageTracker
 
+from snoindex.repository.queue.sqs import Lease
 from snoindex.repository.queue.sqs import SQSQueue
 
 from snoindex.repository.opensearch import Opensearch
 
+from snoindex.repository.reverse_links import ReverseLinks
+
 from snoindex.remote.portal import Portal
 
+from typing import Callable
+from typing import ContextManager
+from typing import Dict
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Set
 from typing import Tuple
 
 
@@ -22,12 +46,161 @@ def get_uuid_and_version_from_message(message: InboundMessage) -> Tuple[str, int
     return (uuid, version)
 
 
+def deduplicate_messages(messages: List[InboundMessage]) -> Tuple[List[InboundMessage], List[InboundMessage]]:
+    # Keeps the message with the highest xid for every uuid and returns
+    # it separately from the messages it supersedes. Unparsable messages
+    # are kept so they fail normally.
+    latest: Dict[str, Tuple[int, InboundMessage]] = {}
+    unparsable: List[InboundMessage] = []
+    superseded: List[InboundMessage] = []
+    for message in messages:
+        try:
+            uuid, version = get_uuid_and_version_from_message(message)
+        except Exception:
+            unparsable.append(message)
+            continue
+        if uuid not in latest:
+            latest[uuid] = (version, message)
+        elif version > latest[uuid][0]:
+            superseded.append(latest[uuid][1])
+            latest[uuid] = (version, message)
+        else:
+            superseded.append(message)
+    kept = [
+        message
+        for _, message in latest.values()
+    ]
+    return (kept + unparsable, superseded)
+
+
+def split_up_to_date_messages(
+        messages: List[InboundMessage],
+        indexed_versions: Dict[str, int],
+) -> Tuple[List[InboundMessage], List[InboundMessage]]:
+    # Indexed version is the snapshot xmin at render time. Only a greater
+    # xmin guarantees the transaction had committed before the render.
+    stale: List[InboundMessage] = []
+    up_to_date: List[InboundMessage] = []
+    for message in messages:
+        try:
+            uuid, version = get_uuid_and_version_from_message(message)
+        except Exception:
+            stale.append(message)
+            continue
+        if uuid in indexed_versions and indexed_versions[uuid] > version:
+            up_to_date.append(message)
+        else:
+            stale.append(message)
+    return (stale, up_to_date)
+
+
+def get_uuids_from_messages(messages: List[InboundMessage]) -> List[str]:
+    uuids = []
+    for message in messages:
+        try:
+            uuid, _ = get_uuid_and_version_from_message(message)
+        except Exception:
+            continue
+        uuids.append(uuid)
+    return uuids
+
+
+def try_to_split_up_to_date_messages(
+        messages: List[InboundMessage],
+        get_indexed_versions: Callable[[List[str]], Dict[str, int]],
+        skip_up_to_date_messages: bool,
+) -> Tuple[List[InboundMessage], List[InboundMessage]]:
+    # Everything is indexed when turned off or when
+    # indexed versions are unavailable.
+    if not skip_up_to_date_messages or not messages:
+        return (messages, [])
+    try:
+        indexed_versions = get_indexed_versions(
+            get_uuids_from_messages(messages)
+        )
+    except Exception as e:
+        logging.error(e)
+        return (messages, [])
+    return split_up_to_date_messages(
+        messages,
+        indexed_versions,
+    )
+
+
+def record_reverse_links_heartbeat(reverse_links: Optional[ReverseLinks]) -> None:
+    # Tells invalidation that reverse links are still kept up to date.
+    if reverse_links is None:
+        return
+    try:
+        reverse_links.record_writer_heartbeat()
+    except Exception as e:
+        logging.error(e)
+
+
+def repack_failed_uuids(
+        queue: SQSQueue,
+        handled_messages: List[InboundMessage],
+        failed_messages: List[InboundMessage],
+) -> Set[str]:
+    # Returns message_ids of packed messages whose failed uuids
+    # were sent again on their own.
+    messages = make_repacked_messages(
+        handled_messages,
+        failed_messages,
+    )
+    if not messages:
+        return set()
+    try:
+        queue.send_messages(messages)
+    except Exception as e:
+        # Partly failed messages stay and come back whole.
+        logging.error(e)
+        return set()
+    return {
+        message.unique_id
+        for message in messages
+    }
+
+
+def mark_messages_as_processed(
+        queue: SQSQueue,
+        handled_messages: List[InboundMessage],
+        failed_messages: List[InboundMessage],
+) -> None:
+    # Messages that fail to delete come back and are indexed again.
+    try:
+        queue.mark_as_processed(
+            get_messages_to_mark_as_processed(
+                handled_messages,
+                failed_messages,
+                repack_failed_uuids(
+                    queue,
+                    handled_messages,
+                    failed_messages,
+                ),
+            )
+        )
+    except Exception as e:
+        logging.error(e)
+
+
 @dataclass
 class IndexingServiceProps:
     invalidation_queue: SQSQueue
     portal: Portal
     opensearch: Opensearch
     messages_to_handle_per_run: int = 1
+    # Number of messages fetched and indexed at the same time.
+    max_workers: int = 1
+    # Check indexed versions before fetching from portal. Leave off
+    # while migrating to new indices, old copies would count as indexed.
+    skip_up_to_date_messages: bool = False
+    # Kept up to date with links of every indexed item.
+    reverse_links: Optional[ReverseLinks] = None
+    # Keeps messages invisible from when they are received until they
+    # are marked as processed, a packed message can take longer to
+    # index than visibility_timeout.
+    extend_visibility_timeout: bool = False
 
 
 class IndexingService:
@@ -35,16 +208,26 @@ class IndexingService:
     def __init__(self, props: IndexingServiceProps) -> None:
         self.props = props
         self.tracker = MessageTracker()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        if self.props.max_workers > 1:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.props.max_workers
+            )
 
-    def handle_message(self, message: InboundMessage) -> None:
+    def index_message(self, message: InboundMessage) -> None:
         uuid, _ = get_uuid_and_version_from_message(message)
         item = self.props.portal.get_item(uuid)
         self.props.opensearch.maybe_delete_item_from_old_indices(item)
         self.props.opensearch.index_item(item)
+        if self.props.reverse_links is not None:
+            self.props.reverse_links.update_item(item)
+
+    def handle_message(self, message: InboundMessage) -> None:
+        self.index_message(message)
         self.tracker.add_handled_messages([message])
 
-    def try_to_handle_messages(self) -> None:
-        for message in self.tracker.new_messages:
+    def _try_to_handle_messages_serially(self, messages: List[InboundMessage]) -> None:
+        for message in messages:
             try:
                 self.handle_message(message)
             except Exception as e:
@@ -55,16 +238,78 @@ class IndexingService:
                     ]
                 )
 
+    def _try_to_handle_messages_concurrently(
+            self,
+            messages: List[InboundMessage],
+            executor: ThreadPoolExecutor,
+    ) -> None:
+        # Workers only do network I/O, results are recorded
+        # in the tracker from this thread.
+        futures = {
+            executor.submit(self.index_message, message): message
+            for message in messages
+        }
+        for future in as_completed(futures):
+            message = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(e)
+                self.tracker.add_failed_messages(
+                    [
+                        message
+                    ]
+                )
+                continue
+            self.tracker.add_handled_messages(
+                [
+                    message
+                ]
+            )
+
+    def try_to_handle_messages(self) -> None:
+        messages, superseded = deduplicate_messages(
+            self.tracker.new_messages
+        )
+        messages, up_to_date = try_to_split_up_to_date_messages(
+            messages,
+            self.props.opensearch.get_indexed_versions,
+            self.props.skip_up_to_date_messages,
+        )
+        # Indexing the latest message covers the ones it supersedes.
+        self.tracker.add_handled_messages(
+            superseded + up_to_date
+        )
+        if self.executor is not None:
+            self._try_to_handle_messages_concurrently(
+                messages,
+                self.executor,
+            )
+        else:
+            self._try_to_handle_messages_serially(
+                messages
+            )
+
     def mark_handled_messages_as_processed(self) -> None:
-        self.props.invalidation_queue.mark_as_processed(
-            self.tracker.handled_messages
+        mark_messages_as_processed(
+            self.props.invalidation_queue,
+            self.tracker.handled_messages,
+            self.tracker.failed_messages,
         )
 
-    def get_new_messages_from_queue(self) -> None:
+    def lease_new_messages(self) -> ContextManager[Optional[Lease]]:
+        if not self.props.extend_visibility_timeout:
+            return nullcontext()
+        return self.props.invalidation_queue.lease()
+
+    def get_new_messages_from_queue(self, lease: Optional[Lease] = None) -> None:
         self.tracker.add_new_messages(
-            list(
-                self.props.invalidation_queue.get_messages(
-                    desired_number_of_messages=self.props.messages_to_handle_per_run
+            unpack_messages(
+                list(
+                    self.props.invalidation_queue.get_messages(
+                        desired_number_of_messages=self.props.messages_to_handle_per_run,
+                        lease=lease,
+                    )
                 )
             )
         )
@@ -85,8 +330,10 @@ class IndexingService:
         self.tracker.clear()
 
     def run_once(self) -> None:
-        self.get_new_messages_from_queue()
-        self.try_to_handle_messages()
+        record_reverse_links_heartbeat(self.props.reverse_links)
+        with self.lease_new_messages() as lease:
+            self.get_new_messages_from_queue(lease)
+            self.try_to_handle_messages()
         self.mark_handled_messages_as_processed()
         self.log_stats()
         self.clear()
@@ -102,6 +349,17 @@ class BulkIndexingServiceProps:
     portal: Portal
     opensearch: Opensearch
     messages_to_handle_per_run: int = 50
+    # Overrides messages_to_handle_per_run when set.
+    batch_size: Optional[AdaptiveBatchSize] = None
+    # Check indexed versions before fetching from portal. Leave off
+    # while migrating to new indices, old copies would count as indexed.
+    skip_up_to_date_messages: bool = False
+    # Kept up to date with links of every indexed item.
+    reverse_links: Optional[ReverseLinks] = None
+    # Keeps messages invisible from when they are received until they
+    # are marked as processed, a packed message can take longer to
+    # index than visibility_timeout.
+    extend_visibility_timeout: bool = False
 
 
 class BulkIndexingService:
@@ -109,21 +367,76 @@ class BulkIndexingService:
     def __init__(self, props: BulkIndexingServiceProps) -> None:
         self.props = props
         self.tracker = MessageTracker()
+        # Packed messages unpack into many, batch_size counts
+        # messages received from the queue.
+        self.number_of_received_messages = 0
 
     def handle_messages(self, messages: List[InboundMessage]) -> None:
-        items = []
-        for message in messages:
-            uuid, _ = get_uuid_and_version_from_message(
-                message
-            )
-            items.append(
-                self.props.portal.get_item(uuid)
+        latest_messages, superseded = deduplicate_messages(
+            messages
+        )
+        latest_messages, up_to_date = try_to_split_up_to_date_messages(
+            latest_messages,
+            self.props.opensearch.get_indexed_versions,
+            self.props.skip_up_to_date_messages,
+        )
+        # Indexing the latest message covers the ones it supersedes.
+        handled: List[InboundMessage] = superseded + up_to_date
+        failed: List[InboundMessage] = []
+        messages_by_uuid: Dict[str, List[InboundMessage]] = defaultdict(list)
+        for message in latest_messages:
+            try:
+                uuid, _ = get_uuid_and_version_from_message(
+                    message
+                )
+            except Exception as e:
+                logging.error(e)
+                failed.append(message)
+                continue
+            messages_by_uuid[uuid].append(message)
+        fetched_uuids: List[str] = []
+        # Only kept when reverse links need the item data.
+        fetched_items: List[Item] = []
+
+        def get_items() -> Iterator[Item]:
+            # Items go to Opensearch as they arrive from the portal.
+            for result in self.props.portal.get_items(list(messages_by_uuid)):
+                if result.item is None:
+                    logging.error(
+                        f'Failed to get {result.uuid}: {result.error}'
+                    )
+                    failed.extend(messages_by_uuid[result.uuid])
+                    continue
+                fetched_uuids.append(result.item.uuid)
+                if self.props.reverse_links is not None:
+                    fetched_items.append(result.item)
+                yield result.item
+        failed_uuids = set(
+            self.props.opensearch.bulk_index_items(
+                get_items()
             )
-        self.props.opensearch.bulk_index_items(
-            items
         )
+        if self.props.reverse_links is not None:
+            indexed_items = [
+                item
+                for item in fetched_items
+                if item.uuid not in failed_uuids
+            ]
+            if indexed_items:
+                self.props.reverse_links.update_items(
+                    indexed_items
+                )
+        for uuid in fetched_uuids:
+            if uuid in failed_uuids:
+                failed.extend(messages_by_uuid[uuid])
+            else:
+                handled.extend(messages_by_uuid[uuid])
+        # Only failed messages are left on the queue to be retried.
         self.tracker.add_handled_messages(
-            messages
+            handled
+        )
+        self.tracker.add_failed_messages(
+            failed
         )
 
     def try_to_handle_messages(self) -> None:
@@ -138,19 +451,61 @@ class BulkIndexingService:
             )
 
     def mark_handled_messages_as_processed(self) -> None:
-        self.props.bulk_invalidation_queue.mark_as_processed(
-            self.tracker.handled_messages
+        mark_messages_as_processed(
+            self.props.bulk_invalidation_queue,
+            self.tracker.handled_messages,
+            self.tracker.failed_messages,
         )
 
-    def get_new_messages_from_queue(self) -> None:
+    def _get_messages_to_handle_per_run(self) -> int:
+        if self.props.batch_size is not None:
+            return self.props.batch_size.size
+        return self.props.messages_to_handle_per_run
+
+    def lease_new_messages(self) -> ContextManager[Optional[Lease]]:
+        if not self.props.extend_visibility_timeout:
+            return nullcontext()
+        return self.props.bulk_invalidation_queue.lease()
+
+    def get_new_messages_from_queue(self, lease: Optional[Lease] = None) -> None:
+        messages = list(
+            self.props.bulk_invalidation_queue.get_messages(
+                desired_number_of_messages=self._get_messages_to_handle_per_run(),
+                lease=lease,
+            )
+        )
+        self.number_of_received_messages = len(messages)
         self.tracker.add_new_messages(
-            list(
-                self.props.bulk_invalidation_queue.get_messages(
-                    desired_number_of_messages=self.props.messages_to_handle_per_run
-                )
+            unpack_messages(
+                messages
             )
         )
 
+    def update_batch_size(self, seconds: float) -> None:
+        if self.props.batch_size is None:
+            return
+        old_size = self.props.batch_size.size
+        try:
+            queue_depth = int(
+                self.props.bulk_invalidation_queue.info()[
+                    'ApproximateNumberOfMessages'
+                ]
+            )
+        except Exception as e:
+            # Keeps the current size, a missed update is harmless.
+            logging.error(e)
+            return
+        new_size = self.props.batch_size.update(
+            number_of_messages=self.number_of_received_messages,
+            seconds=seconds,
+            queue_depth=queue_depth,
+        )
+        if new_size != old_size:
+            logging.warning(
+                f'{self.__class__.__name__}: Batch size {old_size} -> {new_size} '
+                f'(took {seconds:.2f}s, queue depth {queue_depth})'
+            )
+
     def _should_log_stats(self) -> bool:
         return (
             self.tracker.number_all_messages != 0
@@ -165,10 +520,15 @@ class BulkIndexingService:
 
     def clear(self) -> None:
         self.tracker.clear()
+        self.number_of_received_messages = 0
 
     def run_once(self) -> None:
-        self.get_new_messages_from_queue()
-        self.try_to_handle_messages()
+        record_reverse_links_heartbeat(self.props.reverse_links)
+        with self.lease_new_messages() as lease:
+            self.get_new_messages_from_queue(lease)
+            start_time = time.monotonic()
+            self.try_to_handle_messages()
+        self.update_batch_size(time.monotonic() - start_time)
         self.mark_handled_messages_as_processed()
         self.log_stats()
         self.clear()
@@ -1,19 +1,37 @@
 import logging
+import time
+
+from contextlib import nullcontext
 
 from dataclasses import dataclass
 
+from functools import partial
+
+from snoindex.concurrency import iterate_concurrently
+
+from snoindex.domain.bounded_set import BoundedSet
+
 from snoindex.domain.message import InboundMessage
 from snoindex.domain.message import OutboundMessage
 
 from snoindex.domain.tracker import MessageTracker
 
+from snoindex.repository.queue.constants import AWS_SQS_MAX_PAYLOAD_BYTES
+
+from snoindex.repository.queue.sqs import Lease
 from snoindex.repository.queue.sqs import SQSQueue
 
 from snoindex.repository.opensearch import Opensearch
 
+from snoindex.repository.reverse_links import ReverseLinks
+
 from typing import Any
+from typing import Callable
+from typing import ContextManager
 from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Optional
 from typing import Set
 from typing import Tuple
 from typing import cast
@@ -24,6 +42,17 @@ def batch(items: List[Any], batchsize: int) -> Iterable[List[Any]]:
         yield items[i:i + batchsize]
 
 
+def chunked(items: Iterable[Any], chunksize: int) -> Iterator[List[Any]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def get_updated_uuids_from_transaction(message: InboundMessage) -> List[str]:
     return cast(
         List[str],
@@ -49,6 +78,50 @@ def get_all_uuids_from_transaction(message: InboundMessage) -> List[str]:
     return list(uuids)
 
 
+def get_uuids_from_transactions(messages: List[InboundMessage]) -> Tuple[Set[str], Set[str], Set[str]]:
+    all_uuids: Set[str] = set()
+    all_updated_uuids: Set[str] = set()
+    all_renamed_uuids: Set[str] = set()
+    for message in messages:
+        all_uuids.update(
+            get_all_uuids_from_transaction(message)
+        )
+        all_updated_uuids.update(
+            get_updated_uuids_from_transaction(message)
+        )
+        all_renamed_uuids.update(
+            get_renamed_uuids_from_transaction(message)
+        )
+    return (
+        all_uuids,
+        all_updated_uuids,
+        all_renamed_uuids,
+    )
+
+
+def get_new_uuids(uuids: Iterable[str], exclude: Set[str], dedupe_window: int) -> Iterator[str]:
+    # Only remembers the dedupe_window most recent uuids so memory
+    # stays flat. A uuid that falls out of the window can be yielded
+    # again, which only costs an extra invalidation.
+    seen = BoundedSet(
+        maxsize=dedupe_window
+    )
+    for uuid in uuids:
+        if uuid in exclude:
+            continue
+        if seen.add(uuid):
+            yield uuid
+
+
+def get_latest_transaction(messages: List[InboundMessage]) -> InboundMessage:
+    # Outbound messages for many transactions must carry the highest
+    # xid, otherwise indexing could count a stale item as up to date.
+    return max(
+        messages,
+        key=lambda message: int(message.json_body['metadata']['xid'])
+    )
+
+
 def make_unique_id(uuid: str, xid: str) -> str:
     return f'{uuid}-{xid}'
 
@@ -71,12 +144,148 @@ def make_outbound_message(message: InboundMessage, uuid: str) -> OutboundMessage
     return outbound_message
 
 
+# Leaves room for metadata in a packed message.
+MAX_PACKED_UUIDS_BYTES = AWS_SQS_MAX_PAYLOAD_BYTES - 1024
+
+
+def make_packed_outbound_message(message: InboundMessage, uuids: List[str]) -> OutboundMessage:
+    xid = message.json_body['metadata']['xid']
+    body = {
+        'metadata': {
+            'xid': xid,
+            'tid': message.json_body['metadata']['tid'],
+        },
+        'data': {
+            'uuids': uuids,
+        }
+    }
+    outbound_message = OutboundMessage(
+        unique_id=make_unique_id(uuids[0], xid),
+        body=body,
+    )
+    return outbound_message
+
+
+def pack_uuids(
+        uuids: Iterable[str],
+        uuids_per_message: int,
+        max_bytes: int = MAX_PACKED_UUIDS_BYTES,
+) -> Iterator[List[str]]:
+    packed: List[str] = []
+    packed_bytes = 0
+    for uuid in uuids:
+        # Quotes, comma and space around every uuid in JSON.
+        uuid_bytes = len(uuid.encode('utf-8')) + 4
+        if packed and (
+                len(packed) >= uuids_per_message
+                or packed_bytes + uuid_bytes > max_bytes
+        ):
+            yield packed
+            packed = []
+            packed_bytes = 0
+        packed.append(uuid)
+        packed_bytes += uuid_bytes
+    if packed:
+        yield packed
+
+
+def make_outbound_messages(
+        message: InboundMessage,
+        uuids: Iterable[str],
+        uuids_per_message: int = 1,
+) -> List[OutboundMessage]:
+    # More than one uuid per message uses the packed format,
+    # indexing services must understand it before turning this on.
+    if uuids_per_message <= 1:
+        return [
+            make_outbound_message(
+                message,
+                uuid,
+            )
+            for uuid in uuids
+        ]
+    return [
+        make_packed_outbound_message(
+            message,
+            packed_uuids,
+        )
+        for packed_uuids in pack_uuids(uuids, uuids_per_message)
+    ]
+
+
+def fan_out_window(
+        messages: List[InboundMessage],
+        invalidation_queue: SQSQueue,
+        search_related_uuids: Callable[[Set[str], Set[str]], Iterable[str]],
+        uuids_per_outbound_message: int,
+        outbound_messages_batch_size: int,
+        related_uuids_dedupe_window: int,
+) -> Tuple[int, int]:
+    # Sends uuids modified by a window of transactions first, then
+    # related uuids in chunks as they are found, all with the highest
+    # xid of the window. Returns the number of primary and related
+    # uuids sent.
+    start_time = time.monotonic()
+    all_uuids, all_updated_uuids, all_renamed_uuids = get_uuids_from_transactions(
+        messages
+    )
+    latest_message = get_latest_transaction(messages)
+    invalidation_queue.send_messages(
+        make_outbound_messages(
+            latest_message,
+            all_uuids,
+            uuids_per_outbound_message,
+        )
+    )
+    related_uuids = get_new_uuids(
+        search_related_uuids(
+            all_updated_uuids,
+            all_renamed_uuids,
+        ),
+        all_uuids,
+        related_uuids_dedupe_window,
+    )
+    number_of_related_uuids = 0
+    for related_uuids_chunk in chunked(related_uuids, outbound_messages_batch_size):
+        invalidation_queue.send_messages(
+            make_outbound_messages(
+                latest_message,
+                related_uuids_chunk,
+                uuids_per_outbound_message,
+            )
+        )
+        number_of_related_uuids += len(related_uuids_chunk)
+    # Once per window, fanouts send related uuids in many chunks.
+    number_of_uuids = len(all_uuids) + number_of_related_uuids
+    seconds = time.monotonic() - start_time
+    logging.warning(
+        f'Sent {number_of_uuids} uuids in {seconds:.2f}s '
+        f'({number_of_uuids / max(seconds, 1e-6):.0f}/s)'
+    )
+    return (
+        len(all_uuids),
+        number_of_related_uuids,
+    )
+
+
 @dataclass
 class InvalidationServiceProps:
     transaction_queue: SQSQueue
     invalidation_queue: SQSQueue
     opensearch: Opensearch
+    # More than one handles the messages as a window, with merged
+    # updated and renamed uuids and one related uuid search.
     messages_to_handle_per_run: int = 1
+    # Stops filling a window after this long.
+    window_seconds: Optional[int] = None
+    # Related uuids are sent as soon as this many are found.
+    outbound_messages_batch_size: int = 1000
+    # Number of recently sent related uuids remembered for deduplication.
+    related_uuids_dedupe_window: int = 100000
+    # Packs this many uuids into every outbound message.
+    uuids_per_outbound_message: int = 1
+    # Answers related uuid lookups locally once complete.
+    reverse_links: Optional[ReverseLinks] = None
 
 
 class InvalidationService:
@@ -86,39 +295,55 @@ class InvalidationService:
         self.tracker = MessageTracker()
 
     def invalidate_all_uuids_from_transaction(self, message: InboundMessage) -> None:
-        outbound_messages: List[OutboundMessage] = []
         uuids = get_all_uuids_from_transaction(message)
-        for uuid in uuids:
-            outbound_messages.append(
-                make_outbound_message(
-                    message,
-                    uuid,
-                )
-            )
         self.props.invalidation_queue.send_messages(
-            outbound_messages
+            make_outbound_messages(
+                message,
+                uuids,
+                self.props.uuids_per_outbound_message,
+            )
+        )
+
+    def get_related_uuids_from_updated_and_renamed(
+            self,
+            updated: List[str],
+            renamed: List[str],
+    ) -> Iterable[str]:
+        reverse_links = self.props.reverse_links
+        if reverse_links is not None:
+            try:
+                if reverse_links.is_complete() and reverse_links.has_active_writers():
+                    return list(
+                        reverse_links.get_related_uuids_from_updated_and_renamed(
+                            updated,
+                            renamed,
+                        )
+                    )
+            except Exception as e:
+                logging.error(e)
+        return self.props.opensearch.get_related_uuids_from_updated_and_renamed(
+            updated,
+            renamed
         )
 
     def invalidate_all_related_uuids(self, message: InboundMessage) -> None:
-        outbound_messages = []
         already_invalidated_uuids = get_all_uuids_from_transaction(message)
         updated = get_updated_uuids_from_transaction(message)
         renamed = get_renamed_uuids_from_transaction(message)
-        related_uuids = self.props.opensearch.get_related_uuids_from_updated_and_renamed(
+        related_uuids = self.get_related_uuids_from_updated_and_renamed(
             updated,
             renamed
         )
-        for uuid in related_uuids:
-            if uuid in already_invalidated_uuids:
-                continue
-            outbound_messages.append(
-                make_outbound_message(
-                    message,
-                    uuid,
-                )
-            )
         self.props.invalidation_queue.send_messages(
-            outbound_messages
+            make_outbound_messages(
+                message,
+                (
+                    uuid
+                    for uuid in related_uuids
+                    if uuid not in already_invalidated_uuids
+                ),
+                self.props.uuids_per_outbound_message,
+            )
         )
 
     def handle_message(self, message: InboundMessage) -> None:
@@ -126,7 +351,43 @@ class InvalidationService:
         self.invalidate_all_related_uuids(message)
         self.tracker.add_handled_messages([message])
 
+    def _search_related_uuids(
+            self,
+            all_updated_uuids: Set[str],
+            all_renamed_uuids: Set[str],
+    ) -> Iterable[str]:
+        return self.get_related_uuids_from_updated_and_renamed(
+            list(all_updated_uuids),
+            list(all_renamed_uuids),
+        )
+
+    def handle_messages(self, messages: List[InboundMessage]) -> None:
+        fan_out_window(
+            messages,
+            self.props.invalidation_queue,
+            self._search_related_uuids,
+            self.props.uuids_per_outbound_message,
+            self.props.outbound_messages_batch_size,
+            self.props.related_uuids_dedupe_window,
+        )
+        self.tracker.add_handled_messages(messages)
+
+    def _try_to_handle_messages_as_window(self) -> None:
+        messages = self.tracker.new_messages
+        if not messages:
+            return
+        try:
+            self.handle_messages(messages)
+        except Exception as e:
+            logging.error(e)
+            self.tracker.add_failed_messages(
+                messages
+            )
+
     def try_to_handle_messages(self) -> None:
+        if self.props.messages_to_handle_per_run > 1:
+            self._try_to_handle_messages_as_window()
+            return
         for message in self.tracker.new_messages:
             try:
                 self.handle_message(message)
@@ -139,15 +400,20 @@ class InvalidationService:
                 )
 
     def mark_handled_messages_as_processed(self) -> None:
-        self.props.transaction_queue.mark_as_processed(
-            self.tracker.handled_messages
-        )
+        # Messages that fail to delete come back and are invalidated again.
+        try:
+            self.props.transaction_queue.mark_as_processed(
+                self.tracker.handled_messages
+            )
+        except Exception as e:
+            logging.error(e)
 
     def get_new_messages_from_queue(self) -> None:
         self.tracker.add_new_messages(
             list(
                 self.props.transaction_queue.get_messages(
-                    desired_number_of_messages=self.props.messages_to_handle_per_run
+                    desired_number_of_messages=self.props.messages_to_handle_per_run,
+                    timeout_seconds=self.props.window_seconds,
                 )
             )
         )
@@ -187,6 +453,17 @@ class BulkInvalidationServiceProps:
     messages_to_handle_per_run: int = 5000
     related_uuids_search_batch_size: int = 1000
     get_messages_timeout_seconds: int = 900
+    # Related uuids are sent as soon as this many are found.
+    outbound_messages_batch_size: int = 1000
+    # Number of recently sent related uuids remembered for deduplication.
+    related_uuids_dedupe_window: int = 100000
+    # Batches of related uuids searched at the same time.
+    max_concurrent_related_uuids_searches: int = 1
+    # Packs this many uuids into every outbound message.
+    uuids_per_outbound_message: int = 1
+    # Keeps transactions invisible while their fanout runs, instead
+    # of relying on visibility_timeout outlasting the run.
+    extend_visibility_timeout: bool = False
 
 
 class BulkInvalidationService:
@@ -196,93 +473,88 @@ class BulkInvalidationService:
         self.tracker = MessageTracker()
 
     def parse_uuids_from_messages(self, messages: List[InboundMessage]) -> Tuple[Set[str], Set[str], Set[str]]:
-        all_uuids_from_transactions = set()
-        all_updated_uuids_from_transactions = set()
-        all_renamed_uuids_from_transactions = set()
-        for message in messages:
-            all_uuids = get_all_uuids_from_transaction(message)
-            all_uuids_from_transactions.update(all_uuids)
-            updated_uuids = get_updated_uuids_from_transaction(message)
-            all_updated_uuids_from_transactions.update(updated_uuids)
-            renamed_uuids = get_renamed_uuids_from_transaction(message)
-            all_renamed_uuids_from_transactions.update(renamed_uuids)
-        return (
-            all_uuids_from_transactions,
-            all_updated_uuids_from_transactions,
-            all_renamed_uuids_from_transactions,
+        return get_uuids_from_transactions(
+            messages
         )
 
-    def get_related_uuids(
+    def _make_related_uuids_searches(
             self,
-            all_uuids: Set[str],
             all_updated_uuids: Set[str],
-            all_renamed_uuids: Set[str]
-    ) -> Set[str]:
+            all_renamed_uuids: Set[str],
+    ) -> List[Callable[[], Iterable[str]]]:
         updated: List[str] = list(all_updated_uuids)
         renamed: List[str] = list(all_renamed_uuids)
-        related_uuids: Set[str] = set()
+        searches: List[Callable[[], Iterable[str]]] = []
         # Do this in batches to not overload Opensearch.
         for batch_updated in batch(updated, batchsize=self.props.related_uuids_search_batch_size):
-            related_uuids.update(
-                self.props.opensearch.get_related_uuids_from_updated_and_renamed(
+            searches.append(
+                partial(
+                    self.props.opensearch.get_related_uuids_from_updated_and_renamed,
                     updated=batch_updated,
                     renamed=[],
                 )
             )
         for batch_renamed in batch(renamed, batchsize=self.props.related_uuids_search_batch_size):
-            related_uuids.update(
-                self.props.opensearch.get_related_uuids_from_updated_and_renamed(
+            searches.append(
+                partial(
+                    self.props.opensearch.get_related_uuids_from_updated_and_renamed,
                     updated=[],
                     renamed=batch_renamed,
                 )
             )
-        return related_uuids - all_uuids
-
-    def make_outbound_messages(self, uuids: Set[str], message: InboundMessage) -> List[OutboundMessage]:
-        outbound = []
-        for uuid in uuids:
-            outbound.append(
-                make_outbound_message(
-                    message,
-                    uuid
-                )
-            )
-        return outbound
+        return searches
 
-    def handle_messages(self, messages: List[InboundMessage]) -> None:
-        # Split uuids into directly modified, updated, and renamed.
-        all_uuids, all_updated_uuids, all_renamed_uuids = self.parse_uuids_from_messages(
-            messages
-        )
-        # Objects that were directly modified will be sent to indexing queue first.
-        primary_outbound = self.make_outbound_messages(
-            all_uuids,
-            messages[0],
-        )
-        logging.warning(
-            f'{self.__class__.__name__}: Primary outbound = {len(primary_outbound)}'
-        )
-        # Search for all objects that are invalidated because of the directly modified objects.
-        related_uuids = self.get_related_uuids(
-            all_uuids,
+    def _search_related_uuids(
+            self,
+            all_updated_uuids: Set[str],
+            all_renamed_uuids: Set[str],
+    ) -> Iterator[str]:
+        searches = self._make_related_uuids_searches(
             all_updated_uuids,
             all_renamed_uuids,
         )
-        # Objects that are invalidated because of another object will be sent to indexing queue second.
-        related_outbound = self.make_outbound_messages(
-            related_uuids,
-            messages[0],
+        if self.props.max_concurrent_related_uuids_searches > 1:
+            # Every search can itself use several sliced scrolls.
+            yield from iterate_concurrently(
+                searches,
+                max_workers=self.props.max_concurrent_related_uuids_searches,
+            )
+            return
+        for search in searches:
+            yield from search()
+
+    def iter_related_uuids(
+            self,
+            all_uuids: Set[str],
+            all_updated_uuids: Set[str],
+            all_renamed_uuids: Set[str]
+    ) -> Iterator[str]:
+        # Streams related uuids as search hits arrive.
+        return get_new_uuids(
+            self._search_related_uuids(
+                all_updated_uuids,
+                all_renamed_uuids,
+            ),
+            all_uuids,
+            self.props.related_uuids_dedupe_window,
         )
-        logging.warning(
-            f'{self.__class__.__name__}: Related outbound = {len(related_outbound)}'
+
+    def handle_messages(self, messages: List[InboundMessage]) -> None:
+        # Directly modified objects are sent to indexing queue first, then
+        # objects invalidated because of them as they are found.
+        number_of_primary_outbound, number_of_related_outbound = fan_out_window(
+            messages,
+            self.props.invalidation_queue,
+            self._search_related_uuids,
+            self.props.uuids_per_outbound_message,
+            self.props.outbound_messages_batch_size,
+            self.props.related_uuids_dedupe_window,
         )
-        # Send directly modified objects to invalidation queue.
-        self.props.invalidation_queue.send_messages(
-            primary_outbound
+        logging.warning(
+            f'{self.__class__.__name__}: Primary outbound = {number_of_primary_outbound}'
         )
-        # Send invalidated but not directly modified objects to invalidation queue.
-        self.props.invalidation_queue.send_messages(
-            related_outbound
+        logging.warning(
+            f'{self.__class__.__name__}: Related outbound = {number_of_related_outbound}'
         )
         # Record handled messages.
         self.tracker.add_handled_messages(messages)
@@ -300,17 +572,22 @@ class BulkInvalidationService:
             )
 
     def mark_handled_messages_as_processed(self) -> None:
-        self.props.transaction_queue.mark_as_processed(
-            self.tracker.handled_messages
-        )
+        # Messages that fail to delete come back and are invalidated again.
+        try:
+            self.props.transaction_queue.mark_as_processed(
+                self.tracker.handled_messages
+            )
+        except Exception as e:
+            logging.error(e)
 
-    def get_new_messages_from_queue(self) -> None:
+    def get_new_messages_from_queue(self, lease: Optional[Lease] = None) -> None:
         self.tracker.add_new_messages(
             list(
                 self.props.transaction_queue.get_messages(
                     desired_number_of_messages=self.props.messages_to_handle_per_run,
                     # Give up pulling messages before visibility_timeout resets.
                     timeout_seconds=self.props.get_messages_timeout_seconds,
+                    lease=lease,
                 )
             )
         )
@@ -330,9 +607,15 @@ class BulkInvalidationService:
     def clear(self) -> None:
         self.tracker.clear()
 
+    def lease_new_messages(self) -> ContextManager[Optional[Lease]]:
+        if not self.props.extend_visibility_timeout:
+            return nullcontext()
+        return self.props.transaction_queue.lease()
+
     def run_once(self) -> None:
-        self.get_new_messages_from_queue()
-        self.try_to_handle_messages()
+        with self.lease_new_messages() as lease:
+            self.get_new_messages_from_queue(lease)
+            self.try_to_handle_messages()
         self.mark_handled_messages_as_processed()
         self.log_stats()
         self.clear()
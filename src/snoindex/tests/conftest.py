@@ -600,6 +600,56 @@ def mock_invalidation_message():
     )
 
 
+@pytest.fixture
+def make_invalidation_message():
+    import json
+    from snoindex.domain.message import InboundMessage
+
+    def make(uuid, message_id=None, xid=1234):
+        return InboundMessage(
+            message_id=message_id or uuid,
+            receipt_handle='xyz',
+            md5_of_body='abc',
+            body=json.dumps(
+                {
+                    'metadata': {
+                        'xid': xid,
+                        'tid': 'abcd',
+                    },
+                    'data': {
+                        'uuid': uuid,
+                    }
+                }
+            )
+        )
+    return make
+
+
+@pytest.fixture
+def make_packed_message():
+    import json
+    from snoindex.domain.message import InboundMessage
+
+    def make(message_id, uuids, xid=123):
+        return InboundMessage(
+            message_id=message_id,
+            receipt_handle=f'{message_id}-receipt',
+            md5_of_body='abc',
+            body=json.dumps(
+                {
+                    'metadata': {
+                        'xid': xid,
+                        'tid': 'abcd',
+                    },
+                    'data': {
+                        'uuids': uuids,
+                    }
+                }
+            )
+        )
+    return make
+
+
 @pytest.fixture(scope='function')
 def mock_invalidation_message_outbound():
     from snoindex.domain.message import OutboundMessage
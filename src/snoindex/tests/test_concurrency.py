@@ -0,0 +1,54 @@
+import pytest
+
+
+def test_concurrency_iterate_concurrently():
+    from snoindex.concurrency import iterate_concurrently
+    make_iterables = [
+        lambda start=start: range(start, start + 100)
+        for start in range(0, 1000, 100)
+    ]
+    actual = list(
+        iterate_concurrently(
+            make_iterables,
+            max_workers=3,
+            buffer_size=5,
+        )
+    )
+    assert len(actual) == 1000
+    assert sorted(actual) == list(range(1000))
+    assert list(iterate_concurrently([], max_workers=1)) == []
+
+
+def test_concurrency_iterate_concurrently_raises():
+    from snoindex.concurrency import iterate_concurrently
+
+    def fail():
+        yield 1
+        raise ValueError('something went wrong')
+    with pytest.raises(ValueError):
+        list(
+            iterate_concurrently(
+                [
+                    lambda: range(10000),
+                    fail,
+                ],
+                max_workers=2,
+                buffer_size=5,
+            )
+        )
+
+
+def test_concurrency_iterate_concurrently_stops_early():
+    import itertools
+    from snoindex.concurrency import iterate_concurrently
+    values = iterate_concurrently(
+        [
+            lambda: itertools.count(),
+            lambda: itertools.count(),
+        ],
+        max_workers=2,
+        buffer_size=5,
+    )
+    assert len(list(itertools.islice(values, 20))) == 20
+    # Closing the generator stops the producer threads.
+    values.close()
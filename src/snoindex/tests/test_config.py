@@ -13,6 +13,16 @@ def test_config_get_opensearch_client():
     from snoindex.config import get_opensearch_client
     client = get_opensearch_client('http://opensearch')
     assert isinstance(client, OpenSearch)
+    connection = client.transport.connection_pool.connections[0]
+    assert not connection.http_compress
+
+
+def test_config_get_opensearch_client_http_compress():
+    from snoindex.config import get_opensearch_client
+    client = get_opensearch_client('http://opensearch', http_compress=True)
+    connection = client.transport.connection_pool.connections[0]
+    assert connection.http_compress
+    assert connection.headers['accept-encoding'] == 'gzip,deflate'
 
 
 def test_config_invalidation_service_config(opensearch_client):
@@ -42,3 +52,77 @@ def test_config_indexing_service_config(opensearch_client):
     )
     assert config.backend_url == 'some-url'
     assert isinstance(config, IndexingServiceConfig)
+
+
+def test_config_bulk_indexing_service_config(opensearch_client):
+    from snoindex.config import BulkIndexingServiceConfig
+    from snoindex.config import get_sqs_client
+    config = BulkIndexingServiceConfig(
+        backend_url='some-url',
+        auth=('some', 'auth'),
+        bulk_invalidation_queue_url='some-queue-url',
+        opensearch_client=opensearch_client,
+        opensearch_resources_index='some-index',
+        sqs_client=get_sqs_client('http://localstackendpoint:4566')
+    )
+    assert config.bulk_invalidation_queue_url == 'some-queue-url'
+    assert isinstance(config, BulkIndexingServiceConfig)
+
+
+def test_config_get_async_opensearch_client():
+    from opensearchpy import AsyncOpenSearch
+    from snoindex.config import get_async_opensearch_client
+    client = get_async_opensearch_client('http://opensearch')
+    assert isinstance(client, AsyncOpenSearch)
+
+
+def test_config_get_reverse_links(tmp_path):
+    import socket
+    from snoindex.config import get_reverse_links
+    assert get_reverse_links(None) is None
+    reverse_links = get_reverse_links(
+        str(tmp_path / 'reverse_links.sqlite'),
+        expected_writers=['indexer-a'],
+    )
+    assert reverse_links.props.writer == socket.gethostname()
+    assert reverse_links.props.expected_writers == ['indexer-a']
+    reverse_links.close()
+
+
+def test_config_get_list_from_comma_separated():
+    from snoindex.config import get_list_from_comma_separated
+    assert get_list_from_comma_separated(None) == []
+    assert get_list_from_comma_separated('') == []
+    assert get_list_from_comma_separated('a, b,,c') == ['a', 'b', 'c']
+
+
+def test_config_get_flag():
+    from snoindex.config import get_flag
+    assert not get_flag(None)
+    assert get_flag(None, default=True)
+    assert get_flag('true')
+    assert not get_flag('false', default=True)
+
+
+def test_config_get_bulk_indexing_service_config_from_environ(monkeypatch):
+    from snoindex.commands.run_bulk_indexing_service import get_bulk_indexing_service_config
+    for key, value in {
+            'BACKEND_URL': 'some-url',
+            'BACKEND_KEY': 'some',
+            'BACKEND_SECRET_KEY': 'auth',
+            'BULK_INVALIDATION_QUEUE_URL': 'some-queue-url',
+            'OPENSEARCH_URL': 'http://opensearch',
+            'LOCALSTACK_ENDPOINT_URL': 'http://localstackendpoint:4566',
+            'OPENSEARCH_HTTP_COMPRESS': 'true',
+            'PORTAL_COMPRESS': 'false',
+            'BULK_THREAD_COUNT': '4',
+    }.items():
+        monkeypatch.setenv(key, value)
+    config = get_bulk_indexing_service_config()
+    assert config.opensearch_http_compress
+    connection = config.opensearch_client.transport.connection_pool.connections[0]
+    assert connection.http_compress
+    assert not config.portal_compress
+    assert not config.raw_items
+    assert config.bulk_thread_count == 4
+    assert not config.acknowledge_in_background
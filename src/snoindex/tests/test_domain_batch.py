@@ -0,0 +1,49 @@
+import pytest
+
+
+def test_domain_batch_adaptive_batch_size_init():
+    from snoindex.domain.batch import AdaptiveBatchSize
+    from snoindex.domain.batch import AdaptiveBatchSizeProps
+    batch_size = AdaptiveBatchSize(
+        props=AdaptiveBatchSizeProps(
+            initial_size=50,
+            min_size=10,
+            max_size=200,
+        )
+    )
+    assert isinstance(batch_size, AdaptiveBatchSize)
+    assert batch_size.size == 50
+    batch_size = AdaptiveBatchSize(
+        props=AdaptiveBatchSizeProps(
+            initial_size=500,
+            min_size=10,
+            max_size=200,
+        )
+    )
+    assert batch_size.size == 200
+
+
+def test_domain_batch_adaptive_batch_size_update():
+    from snoindex.domain.batch import AdaptiveBatchSize
+    from snoindex.domain.batch import AdaptiveBatchSizeProps
+    batch_size = AdaptiveBatchSize(
+        props=AdaptiveBatchSizeProps(
+            initial_size=50,
+            min_size=10,
+            max_size=200,
+            target_seconds=10,
+        )
+    )
+    # Nothing received.
+    assert batch_size.update(0, 0.1, 1000) == 50
+    # Fast full run with backlog grows.
+    assert batch_size.update(50, 1, 1000) == 100
+    assert batch_size.update(100, 1, 1000) == 200
+    assert batch_size.update(200, 1, 1000) == 200
+    # Fast run without backlog keeps size.
+    assert batch_size.update(200, 1, 5) == 200
+    # Partial run keeps size.
+    assert batch_size.update(20, 1, 1000) == 200
+    # Slow run shrinks proportionally.
+    assert batch_size.update(200, 20, 1000) == 100
+    assert batch_size.update(100, 1000, 1000) == 10
@@ -0,0 +1,27 @@
+import pytest
+
+
+def test_domain_bounded_set_init():
+    from snoindex.domain.bounded_set import BoundedSet
+    bounded_set = BoundedSet(maxsize=3)
+    assert isinstance(bounded_set, BoundedSet)
+    assert len(bounded_set) == 0
+
+
+def test_domain_bounded_set_add():
+    from snoindex.domain.bounded_set import BoundedSet
+    bounded_set = BoundedSet(maxsize=3)
+    assert bounded_set.add('a')
+    assert bounded_set.add('b')
+    assert not bounded_set.add('a')
+    assert bounded_set.add('c')
+    assert len(bounded_set) == 3
+    # Least recently added is forgotten.
+    assert bounded_set.add('d')
+    assert len(bounded_set) == 3
+    assert 'b' not in bounded_set
+    assert 'a' in bounded_set
+    assert 'c' in bounded_set
+    assert 'd' in bounded_set
+    assert bounded_set.add('b')
+    assert 'a' not in bounded_set
@@ -30,7 +30,20 @@ def test_domain_item_item_as_bulk_action():
         '_version': 123,
         '_version_type':
         'external_gte',
-        'some': 'data'
+        '_source': {'some': 'data'},
     }
     actual = item.as_bulk_action()
     assert actual == expected
+    # Data is not copied.
+    assert actual['_source'] is item.data
+
+
+def test_domain_item_item_has_slots():
+    from snoindex.domain.item import Item
+    item = Item(
+        data={'some': 'data'},
+        version=123,
+        uuid='xyz123',
+        index='item-index-123'
+    )
+    assert not hasattr(item, '__dict__')
@@ -45,6 +45,32 @@ def test_domain_message_outbound_message():
     )
 
 
+def test_domain_message_inbound_message_json_body_is_parsed_once(mocker):
+    import json
+    from snoindex.domain.message import InboundMessage
+    loads = mocker.patch(
+        'snoindex.domain.message.loads',
+        side_effect=json.loads,
+    )
+    message = InboundMessage(
+        message_id='abc',
+        receipt_handle='def',
+        md5_of_body='ghi',
+        body='{"data": {"uuid": "xyz"}}',
+    )
+    assert message.json_body == {'data': {'uuid': 'xyz'}}
+    assert message.json_body is message.json_body
+    loads.assert_called_once_with('{"data": {"uuid": "xyz"}}')
+    # Not part of equality or repr.
+    assert message == InboundMessage(
+        message_id='abc',
+        receipt_handle='def',
+        md5_of_body='ghi',
+        body='{"data": {"uuid": "xyz"}}',
+    )
+    assert '_json_body' not in repr(message)
+
+
 def test_domain_message_map_fields():
     from snoindex.domain.message import map_fields
     value = {
@@ -88,3 +114,120 @@ def test_domain_message_convert_received_messages():
     messages = [value for i in range(3)]
     converted_messages = convert_received_messages(messages)
     assert len(converted_messages) == 3
+
+
+def test_domain_message_unpack_message(make_packed_message):
+    import json
+    from snoindex.domain.message import InboundMessage
+    from snoindex.domain.message import unpack_message
+    packed = make_packed_message('xyz', ['a', 'b'])
+    messages = unpack_message(packed)
+    assert len(messages) == 2
+    assert [message.json_body for message in messages] == [
+        {
+            'metadata': {'xid': 123, 'tid': 'abcd'},
+            'data': {'uuid': 'a'},
+        },
+        {
+            'metadata': {'xid': 123, 'tid': 'abcd'},
+            'data': {'uuid': 'b'},
+        },
+    ]
+    assert all(message.message_id == 'xyz' for message in messages)
+    assert all(message.receipt_handle == 'xyz-receipt' for message in messages)
+    # Built from the parsed packed body, each with a body of its own.
+    assert [json.loads(message.body) for message in messages] == [
+        message.json_body
+        for message in messages
+    ]
+    assert messages[0].json_body['metadata'] is packed.json_body['metadata']
+    assert messages[0] != messages[1]
+    assert messages[0] != packed
+    # Unpacked and malformed messages are left alone.
+    unpacked = InboundMessage(
+        message_id='abc',
+        receipt_handle='abc-receipt',
+        md5_of_body='abc',
+        body='{"data": {"uuid": "a"}}',
+    )
+    assert unpack_message(unpacked) == [unpacked]
+    malformed = InboundMessage(
+        message_id='abc',
+        receipt_handle='abc-receipt',
+        md5_of_body='abc',
+        body='not json',
+    )
+    assert unpack_message(malformed) == [malformed]
+
+
+def test_domain_message_unpack_messages(make_packed_message):
+    from snoindex.domain.message import unpack_messages
+    messages = unpack_messages(
+        [
+            make_packed_message('xyz', ['a', 'b']),
+            make_packed_message('abc', ['c']),
+        ]
+    )
+    message_ids = [
+        message.message_id
+        for message in messages
+    ]
+    assert message_ids == ['xyz', 'xyz', 'abc']
+
+
+def test_domain_message_get_messages_to_mark_as_processed(make_packed_message):
+    from snoindex.domain.message import get_messages_to_mark_as_processed
+    from snoindex.domain.message import unpack_message
+    a1, a2 = unpack_message(make_packed_message('a', ['a1', 'a2']))
+    b1, b2 = unpack_message(make_packed_message('b', ['b1', 'b2']))
+    c1, = unpack_message(make_packed_message('c', ['c1']))
+    actual = get_messages_to_mark_as_processed(
+        handled_messages=[a1, a2, b1, c1],
+        failed_messages=[b2],
+    )
+    assert actual == [a1, c1]
+    assert [message.json_body['data']['uuid'] for message in actual] == [
+        'a1',
+        'c1',
+    ]
+
+
+def test_domain_message_make_repacked_messages(make_packed_message):
+    from snoindex.domain.message import get_messages_to_mark_as_processed
+    from snoindex.domain.message import make_repacked_messages
+    from snoindex.domain.message import unpack_message
+    a1, a2, a3 = unpack_message(make_packed_message('a', ['a1', 'a2', 'a3']))
+    b1, b2 = unpack_message(make_packed_message('b', ['b1', 'b2']))
+    repacked_messages = make_repacked_messages(
+        handled_messages=[a1],
+        failed_messages=[a2, a3, a3, b1, b2],
+    )
+    # Only partly failed messages are repacked, all failed stay on the queue.
+    assert [message.unique_id for message in repacked_messages] == ['a']
+    assert repacked_messages[0].body == {
+        'metadata': {'xid': 123, 'tid': 'abcd'},
+        'data': {'uuids': ['a2', 'a3']},
+    }
+    actual = get_messages_to_mark_as_processed(
+        handled_messages=[a1],
+        failed_messages=[a2, a3, b1, b2],
+        repacked_message_ids={'a'},
+    )
+    assert [message.json_body['data']['uuid'] for message in actual] == ['a1']
+
+
+def test_domain_message_messages_have_slots():
+    from snoindex.domain.message import InboundMessage
+    from snoindex.domain.message import OutboundMessage
+    inbound_message = InboundMessage(
+        message_id='abc',
+        receipt_handle='def',
+        md5_of_body='ghi',
+        body='{}',
+    )
+    outbound_message = OutboundMessage(
+        unique_id='abc',
+        body={},
+    )
+    assert not hasattr(inbound_message, '__dict__')
+    assert not hasattr(outbound_message, '__dict__')
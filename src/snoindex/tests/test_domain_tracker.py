@@ -124,3 +124,9 @@ def test_domain_tracker_message_tracker_stats(inbound_message):
         'handled': 7,
         'failed': 6
     }
+
+
+def test_domain_tracker_message_tracker_has_slots():
+    from snoindex.domain.tracker import MessageTracker
+    tracker = MessageTracker()
+    assert not hasattr(tracker, '__dict__')
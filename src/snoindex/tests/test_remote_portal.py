@@ -34,6 +34,46 @@ def test_remote_portal_portal_get_raw_item_by_uuid(portal_props, raw_index_data_
     assert actual == raw_index_data_view
 
 
+def test_remote_portal_make_session(portal_props):
+    from requests import Session
+    from snoindex.remote.portal import make_session
+    portal_props.pool_maxsize = 25
+    portal_props.max_retries = 5
+    session = make_session(portal_props)
+    assert isinstance(session, Session)
+    adapter = session.get_adapter('https://testing.domain/')
+    assert adapter._pool_maxsize == 25
+    assert adapter.max_retries.total == 5
+    assert session.get_adapter('http://testing.domain/') is adapter
+    assert session.headers['Accept-Encoding'] == 'gzip'
+
+
+def test_remote_portal_make_session_without_compression(portal_props):
+    from snoindex.remote.portal import make_session
+    portal_props.compress = False
+    session = make_session(portal_props)
+    assert session.headers['Accept-Encoding'] == 'identity'
+
+
+def test_remote_portal_portal_get_raw_item_by_uuid_uses_shared_session(portal_props, raw_index_data_view, mocker):
+    from snoindex.remote.portal import Portal
+    return_data = mocker.Mock()
+    return_data.json = lambda: raw_index_data_view
+    request = mocker.patch(
+        'snoindex.remote.portal.make_authorized_remote_request',
+        return_value=return_data
+    )
+    portal = Portal(
+        props=portal_props
+    )
+    portal.get_raw_item_by_uuid('abc123')
+    portal.get_raw_item_by_uuid('xyz345')
+    assert request.call_count == 2
+    for call in request.call_args_list:
+        assert call[1]['session'] is portal.session
+        assert call[1]['timeout'] == portal_props.timeout_seconds
+
+
 def test_remote_portal_portal_get_item(portal_props, raw_index_data_view, mocker):
     from snoindex.remote.portal import Portal
     from snoindex.domain.item import Item
@@ -54,6 +94,144 @@ def test_remote_portal_portal_get_item(portal_props, raw_index_data_view, mocker
     assert item.data == raw_index_data_view
 
 
+def test_remote_portal_make_raw_item_from_source(raw_index_data_view):
+    import json
+    from snoindex.domain.item import RawItem
+    from snoindex.remote.portal import make_raw_item_from_source
+    source = json.dumps(raw_index_data_view, indent=2)
+    item = make_raw_item_from_source('abc123', source)
+    assert isinstance(item, RawItem)
+    assert item.version == 4444
+    assert item.uuid == 'abc123'
+    assert item.index == 'snowball_abcv1'
+    assert item.data == {
+        'uuid': raw_index_data_view['uuid'],
+        'item_type': 'snowball',
+        'index_name': 'snowball_abcv1',
+        'xmin': raw_index_data_view['xmin'],
+        'embedded_uuids': raw_index_data_view['embedded_uuids'],
+        'linked_uuids': raw_index_data_view['linked_uuids'],
+    }
+    # Fits on one line of a bulk request.
+    assert '\n' not in item.source
+    assert json.loads(item.source) == raw_index_data_view
+    assert item.get_source() is item.source
+    assert item.as_bulk_action()['_source'] is item.source
+
+
+def test_remote_portal_portal_get_item_with_raw_items(portal_props, raw_index_data_view, mocker):
+    import json
+    from snoindex.remote.portal import Portal
+    from snoindex.domain.item import RawItem
+    return_data = mocker.Mock()
+    return_data.content = json.dumps(raw_index_data_view).encode('utf-8')
+    mocker.patch(
+        'snoindex.remote.portal.make_authorized_remote_request',
+        return_value=return_data
+    )
+    portal_props.raw_items = True
+    portal = Portal(
+        props=portal_props
+    )
+    item = portal.get_item('abc123')
+    assert isinstance(item, RawItem)
+    assert item.version == 4444
+    assert item.source == return_data.content.decode('utf-8')
+
+
+def test_remote_portal_get_backoff_seconds(portal_props):
+    from snoindex.remote.portal import get_backoff_seconds
+    portal_props.backoff_factor = 0.5
+    assert [
+        get_backoff_seconds(portal_props, retry)
+        for retry in range(1, 4)
+    ] == [0.5, 1.0, 2.0]
+
+
+def test_remote_portal_async_portal_get_raw_item_by_uuid_retries(portal_props, raw_index_data_view, mocker):
+    import aiohttp
+    import asyncio
+    import json
+    from unittest.mock import AsyncMock
+    from snoindex.remote.async_portal import AsyncPortal
+    sleep = mocker.patch(
+        'snoindex.remote.async_portal.asyncio.sleep',
+        AsyncMock(),
+    )
+    session = mocker.MagicMock()
+    response = session.get.return_value.__aenter__.return_value
+    response.read = AsyncMock(
+        return_value=json.dumps(raw_index_data_view).encode('utf-8')
+    )
+    unavailable = aiohttp.ClientResponseError(
+        request_info=mocker.Mock(),
+        history=(),
+        status=503,
+    )
+    session.get.side_effect = [
+        unavailable,
+        aiohttp.ClientConnectionError(),
+        session.get.return_value,
+    ]
+    portal_props.max_retries = 2
+    portal = AsyncPortal(
+        props=portal_props
+    )
+    mocker.patch.object(portal, '_get_session', return_value=session)
+    actual = asyncio.run(portal.get_raw_item_by_uuid('abc123'))
+    assert actual == raw_index_data_view
+    assert [call[0][0] for call in sleep.call_args_list] == [0.5, 1.0]
+    # Gives up after max_retries.
+    session.get.side_effect = [unavailable] * 3
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(portal.get_raw_item_by_uuid('abc123'))
+    assert session.get.call_count == 6
+    # Client errors are not retried.
+    session.get.side_effect = [
+        aiohttp.ClientResponseError(
+            request_info=mocker.Mock(),
+            history=(),
+            status=404,
+        )
+    ]
+    with pytest.raises(aiohttp.ClientResponseError):
+        asyncio.run(portal.get_raw_item_by_uuid('abc123'))
+    assert session.get.call_count == 7
+
+
+def test_remote_portal_portal_get_items(portal_props, raw_index_data_view, mocker):
+    from snoindex.remote.portal import Portal
+    from snoindex.remote.portal import ItemResult
+
+    def request(url, *args, **kwargs):
+        if 'bad-uuid' in url:
+            raise Exception('something went wrong')
+        return_data = mocker.Mock()
+        return_data.json = lambda: raw_index_data_view
+        return return_data
+    mocker.patch(
+        'snoindex.remote.portal.make_authorized_remote_request',
+        side_effect=request,
+    )
+    portal = Portal(
+        props=portal_props
+    )
+    uuids = [f'uuid-{i}' for i in range(20)] + ['bad-uuid']
+    results = list(portal.get_items(uuids))
+    assert all(isinstance(result, ItemResult) for result in results)
+    assert sorted(result.uuid for result in results) == sorted(uuids)
+    results_by_uuid = {
+        result.uuid: result
+        for result in results
+    }
+    assert results_by_uuid['bad-uuid'].item is None
+    assert str(results_by_uuid['bad-uuid'].error) == 'something went wrong'
+    assert results_by_uuid['uuid-3'].error is None
+    assert results_by_uuid['uuid-3'].item.uuid == 'uuid-3'
+    assert results_by_uuid['uuid-3'].item.version == 4444
+    assert list(portal.get_items([])) == []
+
+
 def raise_until_two(*args, **kwargs):
     from requests.exceptions import ConnectionError
     raise_until_two.called += 1
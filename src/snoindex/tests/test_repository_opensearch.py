@@ -29,6 +29,82 @@ def test_repository_opensearch_get_related_uuids_query():
     assert actual == expected
 
 
+def test_repository_opensearch_get_indexed_versions_query():
+    from snoindex.repository.opensearch import get_indexed_versions_query
+    actual = get_indexed_versions_query(['abc', 'def'])
+    expected = {
+        'query': {
+            'ids': {
+                'values': ['abc', 'def'],
+            },
+        },
+        '_source': False,
+        'version': True,
+        # Copies in old and new indices during a reindex fit.
+        'size': 6,
+    }
+    assert actual == expected
+
+
+def test_repository_opensearch_opensearch_get_indexed_versions_in_chunks(mocker):
+    from snoindex.repository.opensearch import Opensearch
+    from snoindex.repository.opensearch import OpensearchProps
+    client = mocker.Mock()
+
+    def search(index, body, request_timeout):
+        uuids = body['query']['ids']['values']
+        assert len(uuids) <= 1000
+        assert body['size'] <= 10000
+        hits = [
+            {'_index': 'snowball_v1', '_id': uuid, '_version': 10}
+            for uuid in uuids
+        ]
+        if 'cut-off' in uuids:
+            return {'hits': {'total': {'value': len(hits) + 1}, 'hits': hits}}
+        return {'hits': {'total': {'value': len(hits)}, 'hits': hits}}
+    client.search.side_effect = search
+    opensearch = Opensearch(
+        props=OpensearchProps(
+            client=client,
+        )
+    )
+    assert opensearch.get_indexed_versions([]) == {}
+    client.search.assert_not_called()
+    uuids = [f'uuid-{i}' for i in range(2500)]
+    actual = opensearch.get_indexed_versions(uuids)
+    assert client.search.call_count == 3
+    assert len(actual) == 2500
+    # Chunks with more hits than fit are ignored, not trusted.
+    actual = opensearch.get_indexed_versions(uuids + ['cut-off'])
+    assert 'cut-off' not in actual
+    assert len(actual) == 2000
+
+
+def test_repository_opensearch_get_indexed_versions_from_hits():
+    from snoindex.repository.opensearch import get_indexed_versions_from_hits
+    hits = [
+        {'_index': 'snowball_v1', '_id': 'abc', '_version': 10},
+        {'_index': 'snowball_v2', '_id': 'abc', '_version': 5},
+        {'_index': 'snowball_v2', '_id': 'def', '_version': 7},
+    ]
+    assert get_indexed_versions_from_hits(hits) == {'abc': 5, 'def': 7}
+    assert get_indexed_versions_from_hits([]) == {}
+
+
+def test_repository_opensearch_get_failed_uuids_from_bulk_results():
+    from snoindex.repository.opensearch import get_failed_uuids_from_bulk_results
+    results = [
+        (True, {'index': {'_id': 'abc', 'status': 201}}),
+        (False, {'index': {'_id': 'def', 'status': 409, 'error': 'conflict'}}),
+        (False, {'index': {'_id': 'ghi', 'status': 400, 'error': 'mapper'}}),
+        (False, {'index': {'_id': 'jkl', 'status': 'N/A', 'error': 'timeout'}}),
+        (False, {'delete': {'_id': 'mno', 'status': 404}}),
+        (False, {'delete': {'_id': 'pqr', 'status': 500, 'error': 'failed'}}),
+    ]
+    actual = get_failed_uuids_from_bulk_results(results)
+    assert actual == ['ghi', 'jkl', 'pqr']
+
+
 def test_repository_opensearch_get_search(opensearch_client):
     from opensearch_dsl import Search
     from snoindex.repository.opensearch import get_search
@@ -37,6 +113,254 @@ def test_repository_opensearch_get_search(opensearch_client):
     assert search._index == ['index1']
 
 
+def test_repository_opensearch_alias_cache(mocker):
+    from snoindex.repository.opensearch import AliasCache
+    monotonic = mocker.patch(
+        'snoindex.repository.opensearch.time.monotonic',
+        return_value=100,
+    )
+    cache = AliasCache(ttl_seconds=10)
+    assert cache.get('snowball') is None
+    cache.set('snowball', ['snowball_v1'])
+    assert cache.get('snowball') == ['snowball_v1']
+    monotonic.return_value = 109
+    assert cache.get('snowball') == ['snowball_v1']
+    monotonic.return_value = 110
+    assert cache.get('snowball') is None
+    cache.set('snowball', ['snowball_v1'])
+    cache.set('snowflake', ['snowflake_v1'])
+    cache.invalidate('snowball')
+    assert cache.get('snowball') is None
+    assert cache.get('snowflake') == ['snowflake_v1']
+    cache.invalidate()
+    assert cache.get('snowflake') is None
+    disabled = AliasCache(ttl_seconds=0)
+    disabled.set('snowball', ['snowball_v1'])
+    assert disabled.get('snowball') is None
+
+
+def test_repository_opensearch_opensearch_maybe_delete_item_from_old_indices_cached(mocker):
+    from snoindex.domain.item import Item
+    from snoindex.repository.opensearch import Opensearch
+    from snoindex.repository.opensearch import OpensearchProps
+    client = mocker.Mock()
+    client.indices.get_alias.return_value = {'snowball_v1': {}}
+    os = Opensearch(
+        props=OpensearchProps(
+            client=client,
+            alias_cache_ttl_seconds=60,
+        )
+    )
+    item = Item(
+        data={'item_type': 'snowball'},
+        version=1,
+        uuid='abc',
+        index='snowball_v1',
+    )
+    for i in range(3):
+        os.maybe_delete_item_from_old_indices(item)
+    assert client.indices.get_alias.call_count == 1
+    client.delete_by_query.assert_not_called()
+    # New index appears, cached lookup is refreshed.
+    client.indices.get_alias.return_value = {
+        'snowball_v1': {},
+        'snowball_v2': {},
+    }
+    item.index = 'snowball_v2'
+    os.maybe_delete_item_from_old_indices(item)
+    assert client.indices.get_alias.call_count == 2
+    assert client.delete_by_query.call_args[1]['index'] == ['snowball_v1']
+    os.maybe_delete_item_from_old_indices(item)
+    assert client.indices.get_alias.call_count == 2
+    # Errors drop the cached lookup.
+    client.delete_by_query.side_effect = Exception('index_not_found')
+    with pytest.raises(Exception):
+        os.maybe_delete_item_from_old_indices(item)
+    assert os.alias_cache.get('snowball') is None
+
+
+def test_repository_opensearch_get_cached_current_indices():
+    from snoindex.repository.opensearch import AliasCache
+    from snoindex.repository.opensearch import cache_indices_from_aliases
+    from snoindex.repository.opensearch import get_cached_current_indices
+    from snoindex.repository.opensearch import get_old_indices
+    cache = AliasCache(ttl_seconds=60)
+    assert get_cached_current_indices(cache, 'snowball', 'snowball_v1') is None
+    indices = cache_indices_from_aliases(
+        cache,
+        'snowball',
+        {'snowball_v1': {}},
+    )
+    assert indices == ['snowball_v1']
+    indices = get_cached_current_indices(cache, 'snowball', 'snowball_v1')
+    assert indices == ['snowball_v1']
+    # Lookups cached before the index existed are dropped.
+    assert get_cached_current_indices(cache, 'snowball', 'snowball_v2') is None
+    assert cache.get('snowball') is None
+    old_indices = get_old_indices(
+        ['snowball_v1', 'snowball_v2'],
+        'snowball_v2',
+    )
+    assert old_indices == ['snowball_v1']
+
+
+def test_repository_opensearch_async_opensearch_maybe_delete_item_from_old_indices_cached(mocker):
+    import asyncio
+    from unittest.mock import AsyncMock
+    from snoindex.domain.item import Item
+    from snoindex.repository.async_opensearch import AsyncOpensearch
+    from snoindex.repository.async_opensearch import AsyncOpensearchProps
+    client = mocker.Mock()
+    client.indices.get_alias = AsyncMock(
+        return_value={'snowball_v1': {}, 'snowball_v2': {}}
+    )
+    client.delete_by_query = AsyncMock()
+    os = AsyncOpensearch(
+        props=AsyncOpensearchProps(
+            client=client,
+            alias_cache_ttl_seconds=60,
+        )
+    )
+    item = Item(
+        data={'item_type': 'snowball'},
+        version=1,
+        uuid='abc',
+        index='snowball_v2',
+    )
+    for i in range(2):
+        asyncio.run(os.maybe_delete_item_from_old_indices(item))
+    assert client.indices.get_alias.call_count == 1
+    assert client.delete_by_query.call_args[1]['index'] == ['snowball_v1']
+    assert client.delete_by_query.call_args[1]['body'] == {
+        'query': {'ids': {'values': ['abc']}}
+    }
+    # Errors drop the cached lookup.
+    client.delete_by_query.side_effect = Exception('index_not_found')
+    with pytest.raises(Exception):
+        asyncio.run(os.maybe_delete_item_from_old_indices(item))
+    assert os.alias_cache.get('snowball') is None
+
+
+def test_repository_opensearch_opensearch_get_bulk_actions(mocker):
+    from snoindex.domain.item import Item
+    from snoindex.repository.opensearch import Opensearch
+    from snoindex.repository.opensearch import OpensearchProps
+    client = mocker.Mock()
+    indices = {
+        'snowball': {'snowball_v1': {}, 'snowball_v2': {}},
+        'snowflake': {'snowflake_v1': {}},
+    }
+    client.indices.get_alias.side_effect = lambda index: indices[index]
+    os = Opensearch(
+        props=OpensearchProps(
+            client=client,
+        )
+    )
+    items = [
+        Item(
+            data={'item_type': item_type},
+            version=1,
+            uuid=uuid,
+            index=index,
+        )
+        for item_type, uuid, index in [
+            ('snowball', 'a', 'snowball_v2'),
+            ('snowflake', 'b', 'snowflake_v1'),
+            ('snowball', 'c', 'snowball_v2'),
+        ]
+    ]
+    failed_uuids = []
+    actions = list(os._get_bulk_actions(items, failed_uuids))
+    assert failed_uuids == []
+    assert client.indices.get_alias.call_count == 2
+    assert [
+        (action.get('_op_type', 'index'), action['_index'], action['_id'])
+        for action in actions
+    ] == [
+        ('delete', 'snowball_v1', 'a'),
+        ('index', 'snowball_v2', 'a'),
+        ('index', 'snowflake_v1', 'b'),
+        ('delete', 'snowball_v1', 'c'),
+        ('index', 'snowball_v2', 'c'),
+    ]
+
+
+def test_repository_opensearch_opensearch_bulk_index_items_isolates_alias_errors(mocker):
+    from opensearchpy.exceptions import NotFoundError
+    from snoindex.domain.item import Item
+    from snoindex.repository.opensearch import Opensearch
+    from snoindex.repository.opensearch import OpensearchProps
+
+    def get_alias(index):
+        if index == 'no_alias':
+            raise NotFoundError(404, 'aliases_not_found_exception')
+        return {'snowball_v1': {}}
+    client = mocker.Mock()
+    client.indices.get_alias.side_effect = get_alias
+    sent_actions = []
+
+    def streaming_bulk(client, actions, **kwargs):
+        sent_actions.extend(actions)
+        return iter([])
+    mocker.patch(
+        'snoindex.repository.opensearch.helpers.streaming_bulk',
+        streaming_bulk,
+    )
+    os = Opensearch(
+        props=OpensearchProps(
+            client=client,
+        )
+    )
+    items = [
+        Item(
+            data={'item_type': item_type},
+            version=1,
+            uuid=uuid,
+            index=index,
+        )
+        for item_type, uuid, index in [
+            ('snowball', 'a', 'snowball_v1'),
+            ('no_alias', 'b', 'no_alias_v1'),
+            ('snowball', 'c', 'snowball_v1'),
+            ('no_alias', 'd', 'no_alias_v1'),
+        ]
+    ]
+    assert os.bulk_index_items(items) == ['b', 'd']
+    assert [action['_id'] for action in sent_actions] == ['a', 'c']
+    # Failed alias is looked up once per call.
+    assert client.indices.get_alias.call_count == 2
+
+
+def test_repository_opensearch_opensearch_bulk_index_items_chunking(mocker):
+    from snoindex.repository.opensearch import Opensearch
+    from snoindex.repository.opensearch import OpensearchProps
+    streaming_bulk = mocker.patch(
+        'snoindex.repository.opensearch.helpers.streaming_bulk',
+        return_value=iter([]),
+    )
+    parallel_bulk = mocker.patch(
+        'snoindex.repository.opensearch.helpers.parallel_bulk',
+        return_value=iter([]),
+    )
+    os = Opensearch(
+        props=OpensearchProps(
+            client=mocker.Mock(),
+            bulk_chunk_size=100,
+            bulk_max_chunk_bytes=1024,
+        )
+    )
+    assert os.bulk_index_items(iter([])) == []
+    assert streaming_bulk.call_args[1]['chunk_size'] == 100
+    assert streaming_bulk.call_args[1]['max_chunk_bytes'] == 1024
+    parallel_bulk.assert_not_called()
+    os.props.bulk_thread_count = 4
+    assert os.bulk_index_items(iter([])) == []
+    assert parallel_bulk.call_args[1]['thread_count'] == 4
+    assert parallel_bulk.call_args[1]['chunk_size'] == 100
+    assert parallel_bulk.call_args[1]['max_chunk_bytes'] == 1024
+    assert streaming_bulk.call_count == 1
+
+
 def test_repository_opensearch_opensearch_init(opensearch_props):
     from snoindex.repository.opensearch import Opensearch
     os = Opensearch(
@@ -45,6 +369,35 @@ def test_repository_opensearch_opensearch_init(opensearch_props):
     assert isinstance(os, Opensearch)
 
 
+def test_repository_opensearch_opensearch_scan_slices(mocker):
+    from snoindex.repository.opensearch import Opensearch
+    from snoindex.repository.opensearch import OpensearchProps
+
+    def make_sliced_search(slice):
+        sliced_search = mocker.Mock()
+        sliced_search.scan.return_value = [
+            mocker.Mock(meta=mocker.Mock(id=f'{slice["id"]}-{i}'))
+            for i in range(3)
+        ]
+        assert slice['max'] == 4
+        return sliced_search
+    search = mocker.Mock()
+    search.extra.side_effect = make_sliced_search
+    os = Opensearch(
+        props=OpensearchProps(
+            client=mocker.Mock(),
+            related_uuids_search_slices=4,
+        )
+    )
+    actual = list(os._scan_slices(search))
+    assert search.extra.call_count == 4
+    assert sorted(actual) == sorted(
+        f'{slice_id}-{i}'
+        for slice_id in range(4)
+        for i in range(3)
+    )
+
+
 @pytest.mark.integration
 def test_repository_opensearch_opensearch_get_related_uuids_from_updated_and_renamed(opensearch_props, mocked_portal, generic_mapping, index_name_with_hash):
     from snoindex.repository.opensearch import Opensearch
@@ -86,6 +439,21 @@ def test_repository_opensearch_opensearch_get_related_uuids_from_updated_and_ren
     assert 'xyz345' in related_uuids
 
 
+@pytest.mark.integration
+def test_repository_opensearch_opensearch_get_related_uuids_from_updated_and_renamed_sliced(opensearch_repository, mocked_portal):
+    for i in range(10):
+        item = mocked_portal.get_item(f'xyz{i}')
+        opensearch_repository.index_item(item)
+    opensearch_repository.props.related_uuids_search_slices = 3
+    related_uuids = list(
+        opensearch_repository.get_related_uuids_from_updated_and_renamed(
+            updated=['09d05b87-4d30-4dfb-b243-3327005095f2'],
+            renamed=[],
+        )
+    )
+    assert sorted(related_uuids) == sorted(f'xyz{i}' for i in range(10))
+
+
 @pytest.mark.integration
 def test_repository_opensearch_opensearch_index_item(opensearch_repository, mocked_portal, get_all_results):
     item = mocked_portal.get_item('xyz123')
@@ -109,6 +477,18 @@ def test_repository_opensearch_opensearch_index_item(opensearch_repository, mock
         assert hit['_version'] == 5555
 
 
+@pytest.mark.integration
+def test_repository_opensearch_opensearch_get_indexed_versions(opensearch_repository, mocked_portal):
+    assert opensearch_repository.get_indexed_versions([]) == {}
+    item = mocked_portal.get_item('xyz123')
+    opensearch_repository.index_item(item)
+    opensearch_repository.refresh_resources_index()
+    actual = opensearch_repository.get_indexed_versions(
+        ['xyz123', 'not-indexed']
+    )
+    assert actual == {'xyz123': 4444}
+
+
 @pytest.mark.integration
 def test_repository_opensearch_opensearch_bulk_index_items(opensearch_repository, mocked_portal, get_all_results):
     item1 = mocked_portal.get_item('xyz123')
@@ -128,6 +508,118 @@ def test_repository_opensearch_opensearch_bulk_index_items(opensearch_repository
     assert len(results) == 2
 
 
+@pytest.mark.integration
+def test_repository_opensearch_opensearch_bulk_index_items_streams_in_parallel(opensearch_repository, mocked_portal, get_all_results):
+    item1 = mocked_portal.get_item('xyz123')
+    item2 = mocked_portal.get_item('xyz345')
+    opensearch_repository.props.bulk_thread_count = 2
+    opensearch_repository.props.bulk_chunk_size = 1
+    failed_uuids = opensearch_repository.bulk_index_items(
+        iter(
+            [
+                item1,
+                item2,
+            ]
+        )
+    )
+    assert failed_uuids == []
+    opensearch_repository.refresh_resources_index()
+    results = list(
+        get_all_results(
+            opensearch_repository.props.client
+        )['hits']['hits']
+    )
+    assert len(results) == 2
+
+
+@pytest.mark.integration
+def test_repository_opensearch_opensearch_bulk_index_raw_items(opensearch_repository, raw_index_data_view, get_all_results):
+    import json
+    from snoindex.remote.portal import make_raw_item_from_source
+    item = make_raw_item_from_source(
+        'xyz123',
+        json.dumps(raw_index_data_view, indent=2),
+    )
+    failed_uuids = opensearch_repository.bulk_index_items([item])
+    assert failed_uuids == []
+    opensearch_repository.refresh_resources_index()
+    results = list(
+        get_all_results(
+            opensearch_repository.props.client
+        )['hits']['hits']
+    )
+    assert len(results) == 1
+    assert results[0]['_source'] == raw_index_data_view
+
+
+@pytest.mark.integration
+def test_repository_opensearch_opensearch_bulk_index_items_returns_failed_uuids(opensearch_repository, mocked_portal, get_all_results):
+    item1 = mocked_portal.get_item('xyz123')
+    item2 = mocked_portal.get_item('xyz345')
+    failed_uuids = opensearch_repository.bulk_index_items(
+        [
+            item1,
+            item2,
+        ]
+    )
+    assert failed_uuids == []
+    # Lower version is a version conflict and counts as indexed.
+    item1.version = 3333
+    # Unparsable document fails on its own.
+    item2.version = 5555
+    item2.data = {**item2.data, 'xmin': 'not-an-integer'}
+    failed_uuids = opensearch_repository.bulk_index_items(
+        [
+            item1,
+            item2,
+        ]
+    )
+    assert failed_uuids == ['xyz345']
+
+
+@pytest.mark.integration
+def test_repository_opensearch_opensearch_bulk_index_items_deletes_from_old_indices(
+        opensearch_repository,
+        mocked_portal,
+        generic_mapping,
+        get_all_results,
+):
+    opensearch_repository.props.client.indices.create(
+        index='snowball_old',
+        body=generic_mapping,
+    )
+    item = mocked_portal.get_item('xyz123')
+    item.index = 'snowball_old'
+    opensearch_repository.index_item(item)
+    opensearch_repository.refresh_resources_index()
+    results = list(
+        get_all_results(
+            opensearch_repository.props.client
+        )['hits']['hits']
+    )
+    assert [result['_index'] for result in results] == ['snowball_old']
+    item1 = mocked_portal.get_item('xyz123')
+    item2 = mocked_portal.get_item('xyz345')
+    failed_uuids = opensearch_repository.bulk_index_items(
+        [
+            item1,
+            item2,
+        ]
+    )
+    assert failed_uuids == []
+    opensearch_repository.refresh_resources_index()
+    results = list(
+        get_all_results(
+            opensearch_repository.props.client
+        )['hits']['hits']
+    )
+    assert len(results) == 2
+    assert all(
+        result['_index'] == 'snowball_abcv1'
+        for result in results
+    )
+
+
 @pytest.mark.integration
 def test_repository_opensearch_opensearch_referesh_resources_index(opensearch_repository, mocked_portal, get_all_results):
     item1 = mocked_portal.get_item('xyz123')
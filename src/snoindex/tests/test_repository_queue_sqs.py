@@ -14,6 +14,27 @@ def test_repository_queue_sqs_batch():
     assert actual == expected
 
 
+def test_repository_queue_sqs_batch_by_size():
+    from snoindex.repository.queue.sqs import batch_by_size
+    entries = [
+        {
+            'Id': str(i),
+            'MessageBody': 'x' * size,
+        }
+        for i, size in enumerate([40, 40, 30, 90, 10, 10, 10])
+    ]
+    actual = [
+        [entry['Id'] for entry in entries_batch]
+        for entries_batch in batch_by_size(entries, max_number=3, max_bytes=100)
+    ]
+    assert actual == [
+        ['0', '1'],
+        ['2'],
+        ['3', '4'],
+        ['5', '6'],
+    ]
+
+
 def test_repository_queue_sqs_sqsqueue_init():
     from snoindex.repository.queue.sqs import SQSQueueProps
     from snoindex.repository.queue.sqs import SQSQueue
@@ -35,6 +56,420 @@ def test_repository_queue_sqs_sqsqueue_init():
     assert isinstance(queue, SQSQueue)
 
 
+def make_outbound_messages(number_of_messages):
+    from snoindex.domain.message import OutboundMessage
+    return [
+        OutboundMessage(
+            unique_id=f'message-{i}',
+            body={'i': i},
+        )
+        for i in range(number_of_messages)
+    ]
+
+
+def test_repository_queue_sqs_send_messages_concurrently(mocker):
+    from snoindex.repository.queue.sqs import SQSQueueProps
+    from snoindex.repository.queue.sqs import SQSQueue
+    client = mocker.Mock()
+    client.send_message_batch.return_value = {'Successful': []}
+    queue = SQSQueue(
+        props=SQSQueueProps(
+            client=client,
+            queue_url='some-url',
+            max_concurrent_requests=4,
+        )
+    )
+    queue.send_messages(make_outbound_messages(95))
+    assert client.send_message_batch.call_count == 10
+    sent_ids = sorted(
+        entry['Id']
+        for call in client.send_message_batch.call_args_list
+        for entry in call[1]['Entries']
+    )
+    assert sent_ids == sorted(f'message-{i}' for i in range(95))
+
+
+def test_repository_queue_sqs_send_messages_retries_failed_entries(mocker):
+    from snoindex.repository.queue.sqs import SQSQueueProps
+    from snoindex.repository.queue.sqs import SQSQueue
+    client = mocker.Mock()
+    client.send_message_batch.side_effect = [
+        {
+            'Failed': [
+                {'Id': 'message-1', 'SenderFault': False, 'Code': 'InternalError'},
+            ]
+        },
+        {
+            'Successful': [
+                {'Id': 'message-1'},
+            ]
+        },
+    ]
+    queue = SQSQueue(
+        props=SQSQueueProps(
+            client=client,
+            queue_url='some-url',
+            retry_backoff_seconds=0,
+        )
+    )
+    queue.send_messages(make_outbound_messages(3))
+    assert client.send_message_batch.call_count == 2
+    retried = client.send_message_batch.call_args_list[1][1]['Entries']
+    assert [entry['Id'] for entry in retried] == ['message-1']
+
+
+def test_repository_queue_sqs_send_messages_raises_on_failed_entries(mocker):
+    from snoindex.repository.queue.sqs import FailedEntriesError
+    from snoindex.repository.queue.sqs import SQSQueueProps
+    from snoindex.repository.queue.sqs import SQSQueue
+    client = mocker.Mock()
+    client.send_message_batch.return_value = {
+        'Failed': [
+            {'Id': 'message-1', 'SenderFault': False, 'Code': 'InternalError'},
+        ]
+    }
+    queue = SQSQueue(
+        props=SQSQueueProps(
+            client=client,
+            queue_url='some-url',
+            max_retries=2,
+            retry_backoff_seconds=0,
+        )
+    )
+    with pytest.raises(FailedEntriesError):
+        queue.send_messages(make_outbound_messages(3))
+    assert client.send_message_batch.call_count == 3
+    # Sender faults are not retried.
+    client.send_message_batch.reset_mock()
+    client.send_message_batch.return_value = {
+        'Failed': [
+            {'Id': 'message-1', 'SenderFault': True, 'Code': 'InvalidValue'},
+        ]
+    }
+    with pytest.raises(FailedEntriesError):
+        queue.send_messages(make_outbound_messages(3))
+    assert client.send_message_batch.call_count == 1
+
+
+def test_repository_queue_sqs_receive_quota():
+    from snoindex.repository.queue.sqs import ReceiveQuota
+    quota = ReceiveQuota(25)
+    assert quota.reserve(10) == 10
+    assert quota.reserve(10) == 10
+    assert quota.reserve(10) == 5
+    assert quota.reserve(10) == 0
+    quota.release(3)
+    assert quota.reserve(10) == 3
+
+
+def test_repository_queue_sqs_get_messages_concurrently(mocker):
+    import threading
+    from snoindex.repository.queue.sqs import SQSQueueProps
+    from snoindex.repository.queue.sqs import SQSQueue
+    lock = threading.Lock()
+    counter = iter(range(1000))
+
+    def receive_message(**kwargs):
+        with lock:
+            return {
+                'Messages': [
+                    {
+                        'MessageId': str(next(counter)),
+                        'ReceiptHandle': 'abc',
+                        'MD5OfBody': 'ccc',
+                        'Body': '{}',
+                    }
+                    for _ in range(kwargs['MaxNumberOfMessages'])
+                ]
+            }
+    client = mocker.Mock()
+    client.receive_message.side_effect = receive_message
+    queue = SQSQueue(
+        props=SQSQueueProps(
+            client=client,
+            queue_url='some-url',
+            max_concurrent_receives=4,
+        )
+    )
+    messages = list(queue.get_messages(desired_number_of_messages=95))
+    assert len(messages) == 95
+    assert len({message.message_id for message in messages}) == 95
+    assert client.receive_message.call_count == 10
+    requested = sorted(
+        call[1]['MaxNumberOfMessages']
+        for call in client.receive_message.call_args_list
+    )
+    assert requested == [5] + [10] * 9
+    # Receivers stop when the queue is empty.
+    client.receive_message.reset_mock()
+    client.receive_message.side_effect = None
+    client.receive_message.return_value = {}
+    assert list(queue.get_messages(desired_number_of_messages=95)) == []
+    assert client.receive_message.call_count == 4
+
+
+def test_repository_queue_sqs_get_messages_with_lease(mocker):
+    import threading
+    from snoindex.repository.queue.sqs import SQSQueueProps
+    from snoindex.repository.queue.sqs import SQSQueue
+    lock = threading.Lock()
+    counter = iter(range(1000))
+
+    def receive_message(**kwargs):
+        with lock:
+            return {
+                'Messages': [
+                    {
+                        'MessageId': str(next(counter)),
+                        'ReceiptHandle': 'abc',
+                        'MD5OfBody': 'ccc',
+                        'Body': '{}',
+                    }
+                    for _ in range(kwargs['MaxNumberOfMessages'])
+                ]
+            }
+    client = mocker.Mock()
+    client.receive_message.side_effect = receive_message
+    for max_concurrent_receives in [1, 4]:
+        queue = SQSQueue(
+            props=SQSQueueProps(
+                client=client,
+                queue_url='some-url',
+                max_concurrent_receives=max_concurrent_receives,
+                lease_heartbeat_seconds=1000,
+            )
+        )
+        lease = queue.lease()
+        messages = list(
+            queue.get_messages(
+                desired_number_of_messages=25,
+                lease=lease,
+            )
+        )
+        assert len(messages) == 25
+        # Every received message is leased.
+        assert {
+            message.message_id
+            for message in lease.messages
+        } == {
+            message.message_id
+            for message in messages
+        }
+
+
+def make_inbound_messages(number_of_messages):
+    from snoindex.domain.message import InboundMessage
+    return [
+        InboundMessage(
+            message_id=f'message-{i}',
+            receipt_handle=f'receipt-{i}',
+            md5_of_body='abc',
+            body='{}',
+        )
+        for i in range(number_of_messages)
+    ]
+
+
+def test_repository_queue_sqs_mark_as_processed_concurrently(mocker):
+    import threading
+    from snoindex.repository.queue.sqs import SQSQueueProps
+    from snoindex.repository.queue.sqs import SQSQueue
+    client = mocker.Mock()
+    lock = threading.Lock()
+    failed_once = []
+
+    def delete_message_batch(**kwargs):
+        with lock:
+            if not failed_once:
+                failed_once.append(kwargs['Entries'][0])
+                return {
+                    'Failed': [
+                        {
+                            'Id': kwargs['Entries'][0]['Id'],
+                            'SenderFault': False,
+                        },
+                    ]
+                }
+        return {}
+    client.delete_message_batch.side_effect = delete_message_batch
+    queue = SQSQueue(
+        props=SQSQueueProps(
+            client=client,
+            queue_url='some-url',
+            max_concurrent_requests=4,
+            retry_backoff_seconds=0,
+        )
+    )
+    queue.mark_as_processed(make_inbound_messages(35))
+    # Four batches and one retry of the failed entry.
+    assert client.delete_message_batch.call_count == 5
+    deleted = [
+        entry['ReceiptHandle']
+        for call in client.delete_message_batch.call_args_list
+        for entry in call[1]['Entries']
+    ]
+    assert sorted(deleted) == sorted(
+        [f'receipt-{i}' for i in range(35)]
+        + [failed_once[0]['ReceiptHandle']]
+    )
+
+
+def test_repository_queue_sqs_mark_as_processed_in_background(mocker):
+    import threading
+    from snoindex.repository.queue.sqs import SQSQueueProps
+    from snoindex.repository.queue.sqs import SQSQueue
+    client = mocker.Mock()
+    release = threading.Event()
+
+    def delete_message_batch(**kwargs):
+        release.wait(5)
+        return {}
+    client.delete_message_batch.side_effect = delete_message_batch
+    queue = SQSQueue(
+        props=SQSQueueProps(
+            client=client,
+            queue_url='some-url',
+            acknowledge_in_background=True,
+        )
+    )
+    # Returns before the deletes finish.
+    queue.mark_as_processed(make_inbound_messages(15))
+    release.set()
+    queue.wait_for_background_acknowledgements()
+    assert client.delete_message_batch.call_count == 2
+    # Errors are logged instead of raised.
+    client.delete_message_batch.side_effect = Exception('throttled')
+    future = queue.mark_as_processed_in_background(make_inbound_messages(1))
+    queue.wait_for_background_acknowledgements()
+    assert isinstance(future.exception(), Exception)
+
+
+def test_repository_queue_sqs_change_visibility_timeout(mocker):
+    from snoindex.repository.queue.sqs import SQSQueueProps
+    from snoindex.repository.queue.sqs import SQSQueue
+    client = mocker.Mock()
+    client.change_message_visibility_batch.return_value = {}
+    queue = SQSQueue(
+        props=SQSQueueProps(
+            client=client,
+            queue_url='some-url',
+        )
+    )
+    queue.change_visibility_timeout(make_inbound_messages(12), 300)
+    assert client.change_message_visibility_batch.call_count == 2
+    entry = client.change_message_visibility_batch.call_args_list[0][1]['Entries'][0]
+    assert entry == {
+        'Id': 'message-0',
+        'ReceiptHandle': 'receipt-0',
+        'VisibilityTimeout': 300,
+    }
+
+
+def test_repository_queue_sqs_lease(mocker):
+    import threading
+    import time
+    from snoindex.repository.queue.sqs import SQSQueueProps
+    from snoindex.repository.queue.sqs import SQSQueue
+    client = mocker.Mock()
+    heartbeats = threading.Semaphore(0)
+
+    def change_message_visibility_batch(**kwargs):
+        heartbeats.release()
+        return {}
+    client.change_message_visibility_batch.side_effect = change_message_visibility_batch
+    queue = SQSQueue(
+        props=SQSQueueProps(
+            client=client,
+            queue_url='some-url',
+            visibility_timeout=120,
+            lease_heartbeat_seconds=0.01,
+        )
+    )
+    messages = make_inbound_messages(3)
+    with queue.lease(messages + messages[:1]):
+        assert heartbeats.acquire(timeout=5)
+        assert heartbeats.acquire(timeout=5)
+    number_of_heartbeats = client.change_message_visibility_batch.call_count
+    assert number_of_heartbeats >= 2
+    entries = client.change_message_visibility_batch.call_args[1]['Entries']
+    # Duplicate message ids are sent once.
+    assert [entry['Id'] for entry in entries] == [
+        'message-0',
+        'message-1',
+        'message-2',
+    ]
+    assert entries[0]['VisibilityTimeout'] == 120
+    # Stopped with the context manager.
+    time.sleep(0.05)
+    assert client.change_message_visibility_batch.call_count == number_of_heartbeats
+    # Failed heartbeats are logged, not raised.
+    client.change_message_visibility_batch.side_effect = Exception('throttled')
+    queue.lease(messages).extend()
+
+
+def test_repository_queue_sqs_lease_extends_on_start(mocker):
+    from snoindex.repository.queue.sqs import SQSQueueProps
+    from snoindex.repository.queue.sqs import SQSQueue
+    client = mocker.Mock()
+    client.change_message_visibility_batch.return_value = {}
+    queue = SQSQueue(
+        props=SQSQueueProps(
+            client=client,
+            queue_url='some-url',
+            visibility_timeout=120,
+            lease_heartbeat_seconds=1000,
+        )
+    )
+    messages = make_inbound_messages(2)
+    # Extended right away, not after the first heartbeat.
+    with queue.lease(messages):
+        assert client.change_message_visibility_batch.call_count == 1
+    entries = client.change_message_visibility_batch.call_args[1]['Entries']
+    assert [entry['Id'] for entry in entries] == [
+        'message-0',
+        'message-1',
+    ]
+    # Empty leases make no calls.
+    with queue.lease():
+        pass
+    assert client.change_message_visibility_batch.call_count == 1
+
+
+def test_repository_queue_sqs_lease_add(mocker):
+    import threading
+    from snoindex.repository.queue.sqs import SQSQueueProps
+    from snoindex.repository.queue.sqs import SQSQueue
+    client = mocker.Mock()
+    heartbeats = threading.Semaphore(0)
+
+    def change_message_visibility_batch(**kwargs):
+        heartbeats.release()
+        return {}
+    client.change_message_visibility_batch.side_effect = change_message_visibility_batch
+    queue = SQSQueue(
+        props=SQSQueueProps(
+            client=client,
+            queue_url='some-url',
+            lease_heartbeat_seconds=0.01,
+        )
+    )
+    messages = make_inbound_messages(3)
+    with queue.lease() as lease:
+        lease.add(messages[:1])
+        lease.add(messages)
+        assert len(lease.messages) == 3
+        # A heartbeat can land between the two adds, wait for the next.
+        assert heartbeats.acquire(timeout=5)
+        assert heartbeats.acquire(timeout=5)
+    entries = client.change_message_visibility_batch.call_args[1]['Entries']
+    # Messages added while running are extended too.
+    assert [entry['Id'] for entry in entries] == [
+        'message-0',
+        'message-1',
+        'message-2',
+    ]
+
+
 @pytest.mark.integration
 def test_repository_queue_sqs_send_messages(queue_for_testing):
     from snoindex.domain.message import OutboundMessage
@@ -0,0 +1,138 @@
+import pytest
+
+
+def make_item(uuid, version, embedded_uuids, linked_uuids):
+    from snoindex.domain.item import Item
+    return Item(
+        data={
+            'embedded_uuids': embedded_uuids,
+            'linked_uuids': linked_uuids,
+        },
+        version=version,
+        uuid=uuid,
+        index='snowball_123',
+    )
+
+
+@pytest.fixture
+def reverse_links(tmp_path):
+    from snoindex.repository.reverse_links import ReverseLinksProps
+    from snoindex.repository.reverse_links import ReverseLinks
+    reverse_links = ReverseLinks(
+        props=ReverseLinksProps(
+            path=str(tmp_path / 'reverse_links.sqlite'),
+        )
+    )
+    yield reverse_links
+    reverse_links.close()
+
+
+def test_repository_reverse_links_get_links_from_item():
+    from snoindex.repository.reverse_links import get_links_from_item
+    item = make_item('a', 1, ['a', 'b'], ['c'])
+    assert get_links_from_item(item) == [
+        ('embedded', 'a', 'a'),
+        ('embedded', 'b', 'a'),
+        ('linked', 'c', 'a'),
+    ]
+
+
+def test_repository_reverse_links_update_items(reverse_links):
+    reverse_links.update_items(
+        [
+            make_item('a', 1, ['a', 'b'], ['b']),
+            make_item('c', 1, ['c', 'b'], []),
+        ]
+    )
+    related_uuids = reverse_links.get_related_uuids_from_updated_and_renamed(
+        updated=['b'],
+        renamed=[],
+    )
+    assert sorted(related_uuids) == ['a', 'c']
+    related_uuids = reverse_links.get_related_uuids_from_updated_and_renamed(
+        updated=[],
+        renamed=['b'],
+    )
+    assert list(related_uuids) == ['a']
+    # Links are replaced by newer versions.
+    reverse_links.update_item(make_item('a', 2, ['a'], []))
+    related_uuids = reverse_links.get_related_uuids_from_updated_and_renamed(
+        updated=['b'],
+        renamed=['b'],
+    )
+    assert list(related_uuids) == ['c']
+    # But not by older ones.
+    reverse_links.update_item(make_item('a', 1, ['a', 'b'], ['b']))
+    related_uuids = reverse_links.get_related_uuids_from_updated_and_renamed(
+        updated=['b'],
+        renamed=['b'],
+    )
+    assert list(related_uuids) == ['c']
+
+
+def test_repository_reverse_links_get_related_uuids_many_targets(reverse_links):
+    targets = [f'target-{i}' for i in range(2000)]
+    reverse_links.update_item(make_item('a', 1, targets[-1:], []))
+    related_uuids = reverse_links.get_related_uuids_from_updated_and_renamed(
+        updated=targets,
+        renamed=targets,
+    )
+    assert list(related_uuids) == ['a']
+
+
+def test_repository_reverse_links_add_links_and_mark_complete(reverse_links):
+    reverse_links.update_item(make_item('a', 1, ['x'], []))
+    assert not reverse_links.is_complete()
+    reverse_links.add_links(
+        iter(
+            [
+                ('a', ['y'], []),
+                ('b', ['x'], ['y']),
+            ]
+        )
+    )
+    reverse_links.mark_complete()
+    assert reverse_links.is_complete()
+    related_uuids = reverse_links.get_related_uuids_from_updated_and_renamed(
+        updated=['x', 'y'],
+        renamed=[],
+    )
+    assert sorted(related_uuids) == ['a', 'b']
+    reverse_links.clear()
+    assert not reverse_links.is_complete()
+
+
+def test_repository_reverse_links_has_active_writers(tmp_path, mocker):
+    from snoindex.repository.reverse_links import ReverseLinksProps
+    from snoindex.repository.reverse_links import ReverseLinks
+    path = str(tmp_path / 'reverse_links.sqlite')
+    indexer_a, indexer_b, invalidation = [
+        ReverseLinks(
+            props=ReverseLinksProps(
+                path=path,
+                writer=writer,
+                expected_writers=['indexer-a', 'indexer-b'],
+            )
+        )
+        for writer in ['indexer-a', 'indexer-b', 'invalidation']
+    ]
+    assert not invalidation.has_active_writers()
+    # One indexer is not enough while another one is expected.
+    indexer_a.record_writer_heartbeat()
+    assert not invalidation.has_active_writers()
+    indexer_b.record_writer_heartbeat()
+    assert invalidation.has_active_writers()
+    # Stale once an indexer did not write for longer than the max age.
+    time = mocker.patch('snoindex.repository.reverse_links.time.time')
+    time.return_value = 10 ** 12
+    indexer_a.record_writer_heartbeat()
+    assert not invalidation.has_active_writers()
+    for reverse_links in [indexer_a, indexer_b, invalidation]:
+        reverse_links.close()
+
+
+def test_repository_reverse_links_has_active_writers_opt_in(reverse_links):
+    reverse_links.record_writer_heartbeat()
+    assert not reverse_links.has_active_writers()
+    reverse_links.props.expected_writers = [reverse_links.props.writer]
+    assert reverse_links.has_active_writers()
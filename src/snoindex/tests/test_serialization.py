@@ -0,0 +1,4 @@
+def test_serialization_loads():
+    from snoindex.serialization import loads
+    assert loads('{"a": [1, "b", null]}') == {'a': [1, 'b', None]}
+    assert loads(b'{"a": 1}') == {'a': 1}
@@ -0,0 +1,219 @@
+import pytest
+
+
+def make_async_indexing_service(mocker, raw_index_data_view, **kwargs):
+    from unittest.mock import AsyncMock
+    from snoindex.services.async_indexing import AsyncIndexingService
+    from snoindex.services.async_indexing import AsyncIndexingServiceProps
+    from snoindex.remote.portal import make_item_from_raw_item
+
+    async def get_item(uuid):
+        if uuid == 'bad-uuid':
+            raise Exception('something went wrong')
+        return make_item_from_raw_item(uuid, raw_index_data_view)
+    portal = mocker.Mock()
+    portal.get_item = get_item
+    opensearch = mocker.Mock()
+    opensearch.maybe_delete_item_from_old_indices = AsyncMock()
+    opensearch.index_item = AsyncMock()
+    return AsyncIndexingService(
+        props=AsyncIndexingServiceProps(
+            invalidation_queue=mocker.Mock(),
+            portal=portal,
+            opensearch=opensearch,
+            **kwargs
+        )
+    )
+
+
+def test_services_async_indexing_async_indexing_service_try_to_handle_messages(
+        raw_index_data_view,
+        make_invalidation_message,
+        mocker,
+):
+    import asyncio
+    async_indexing_service = make_async_indexing_service(
+        mocker,
+        raw_index_data_view,
+        max_concurrent_fetches=2,
+        max_concurrent_writes=1,
+    )
+    bad_message = make_invalidation_message('bad-uuid')
+    async_indexing_service.tracker.add_new_messages(
+        [
+            make_invalidation_message(f'uuid-{i}')
+            for i in range(10)
+        ] + [bad_message]
+    )
+    asyncio.run(
+        async_indexing_service.try_to_handle_messages()
+    )
+    assert async_indexing_service.tracker.number_handled_messages == 10
+    assert async_indexing_service.tracker.failed_messages == [bad_message]
+    assert async_indexing_service.props.opensearch.index_item.await_count == 10
+
+
+def test_services_async_indexing_async_indexing_service_run_once(
+        raw_index_data_view,
+        make_invalidation_message,
+        mocker,
+):
+    import asyncio
+    async_indexing_service = make_async_indexing_service(
+        mocker,
+        raw_index_data_view,
+    )
+    messages = [
+        make_invalidation_message(f'uuid-{i}')
+        for i in range(3)
+    ]
+    queue = async_indexing_service.props.invalidation_queue
+    queue.get_messages.return_value = iter(messages)
+    asyncio.run(
+        async_indexing_service.run_once()
+    )
+    queue.mark_as_processed.assert_called_once_with(messages)
+    assert async_indexing_service.tracker.new_messages == []
+    assert async_indexing_service.tracker.stats() == {
+        'all': 3,
+        'handled': 3,
+        'failed': 0,
+    }
+    # Failed deletes are logged, the messages come back later.
+    from snoindex.repository.queue.sqs import FailedEntriesError
+    queue.mark_as_processed.side_effect = FailedEntriesError(
+        'ReceiptHandleIsInvalid'
+    )
+    queue.get_messages.return_value = iter(messages)
+    asyncio.run(
+        async_indexing_service.run_once()
+    )
+    assert queue.mark_as_processed.call_count == 2
+
+
+def test_services_async_indexing_async_indexing_service_updates_reverse_links(
+        raw_index_data_view,
+        make_invalidation_message,
+        mocker,
+):
+    import asyncio
+    reverse_links = mocker.Mock()
+    async_indexing_service = make_async_indexing_service(
+        mocker,
+        raw_index_data_view,
+        reverse_links=reverse_links,
+    )
+    queue = async_indexing_service.props.invalidation_queue
+    queue.get_messages.return_value = iter(
+        [
+            make_invalidation_message('uuid-a'),
+            make_invalidation_message('bad-uuid'),
+        ]
+    )
+    asyncio.run(
+        async_indexing_service.run_once()
+    )
+    reverse_links.record_writer_heartbeat.assert_called_once()
+    items = [
+        call[0][0]
+        for call in reverse_links.update_item.call_args_list
+    ]
+    assert [item.uuid for item in items] == ['uuid-a']
+
+
+def test_services_async_indexing_async_indexing_service_leases_messages(
+        raw_index_data_view,
+        make_invalidation_message,
+        mocker,
+):
+    import asyncio
+    from unittest.mock import AsyncMock
+    async_indexing_service = make_async_indexing_service(
+        mocker,
+        raw_index_data_view,
+        extend_visibility_timeout=True,
+    )
+    async_indexing_service.props.portal.close = AsyncMock()
+    async_indexing_service.props.opensearch.close = AsyncMock()
+    batches = [
+        [make_invalidation_message('uuid-a')],
+        [make_invalidation_message('uuid-b')],
+    ]
+    queue = async_indexing_service.props.invalidation_queue
+    events = []
+    received_with_leases = []
+
+    def get_messages(**kwargs):
+        received_with_leases.append(kwargs['lease'])
+        if not batches:
+            raise Exception('stop polling')
+        return iter(batches.pop(0))
+    queue.get_messages.side_effect = get_messages
+    leases = []
+
+    def lease():
+        new_lease = mocker.Mock()
+        new_lease.start.return_value = new_lease
+        new_lease.stop.side_effect = lambda i=len(leases): events.append(
+            ('stop', i)
+        )
+        leases.append(new_lease)
+        return new_lease
+    queue.lease.side_effect = lease
+    queue.mark_as_processed.side_effect = lambda messages: events.append(
+        ('processed', messages[0].json_body['data']['uuid'])
+    )
+    with pytest.raises(Exception, match='stop polling'):
+        asyncio.run(
+            async_indexing_service._poll()
+        )
+    # Every batch, prefetched or not, is received with its own lease.
+    assert received_with_leases == leases
+    # Leases stop before their messages are marked as processed.
+    assert events.index(('processed', 'uuid-a')) > events.index(('stop', 0))
+    assert events.index(('processed', 'uuid-b')) > events.index(('stop', 1))
+    assert len(leases) == 3
+    assert {event for event in events if event[0] == 'stop'} == {
+        ('stop', 0),
+        ('stop', 1),
+        ('stop', 2),
+    }
+
+
+def test_services_async_indexing_async_indexing_service_skip_up_to_date_messages(
+        raw_index_data_view,
+        make_invalidation_message,
+        mocker,
+):
+    import asyncio
+    from unittest.mock import AsyncMock
+    async_indexing_service = make_async_indexing_service(
+        mocker,
+        raw_index_data_view,
+        skip_up_to_date_messages=True,
+    )
+    opensearch = async_indexing_service.props.opensearch
+    opensearch.get_indexed_versions = AsyncMock(
+        return_value={'uuid-a': 20}
+    )
+    messages = [
+        make_invalidation_message('uuid-a', message_id='a', xid=10),
+        make_invalidation_message('uuid-b', message_id='b', xid=10),
+    ]
+    async_indexing_service.tracker.add_new_messages(messages)
+    asyncio.run(
+        async_indexing_service.try_to_handle_messages()
+    )
+    opensearch.get_indexed_versions.assert_awaited_once_with(
+        ['uuid-a', 'uuid-b']
+    )
+    assert opensearch.index_item.await_count == 1
+    assert async_indexing_service.tracker.number_handled_messages == 2
+    async_indexing_service.clear()
+    # Falls back to indexing everything when the check fails.
+    opensearch.get_indexed_versions.side_effect = Exception('unavailable')
+    async_indexing_service.tracker.add_new_messages(messages)
+    asyncio.run(
+        async_indexing_service.try_to_handle_messages()
+    )
+    assert opensearch.index_item.await_count == 3
@@ -60,10 +60,12 @@ def test_services_bulk_invalidation_bulk_invalidation_service_get_related_uuids(
             mock_transaction_message,
         ]
     )
-    related_uuids = bulk_invalidation_service.get_related_uuids(
-        all_uuids,
-        all_updated_uuids,
-        all_renamed_uuids,
+    related_uuids = set(
+        bulk_invalidation_service.iter_related_uuids(
+            all_uuids,
+            all_updated_uuids,
+            all_renamed_uuids,
+        )
     )
     assert related_uuids == {'4cead359-10e9-49a8-9d20-f05b2499b919'}
     bulk_uuids = set([
@@ -82,14 +84,132 @@ def test_services_bulk_invalidation_bulk_invalidation_service_get_related_uuids(
         'b0b9c607-f8b4-4f02-93f4-9895b461334b',
         'dfc72c8c-d45c-4acd-979b-49fc93cf3c62',
     ])
-    related_uuids = bulk_invalidation_service.get_related_uuids(
-        bulk_uuids,
-        bulk_uuids,
-        bulk_uuids,
+    related_uuids = set(
+        bulk_invalidation_service.iter_related_uuids(
+            bulk_uuids,
+            bulk_uuids,
+            bulk_uuids,
+        )
     )
     assert related_uuids == {'4cead359-10e9-49a8-9d20-f05b2499b919'}
 
 
+def test_services_bulk_invalidation_bulk_invalidation_service_handle_messages_streams_related_uuids(
+        mock_transaction_message,
+        mocker,
+):
+    from snoindex.services.invalidation import BulkInvalidationServiceProps
+    from snoindex.services.invalidation import BulkInvalidationService
+
+    def get_related_uuids_from_updated_and_renamed(updated, renamed):
+        yield '09d05b87-4d30-4dfb-b243-3327005095f2'
+        for i in range(5):
+            yield f'related-{i}'
+    opensearch = mocker.Mock()
+    opensearch.get_related_uuids_from_updated_and_renamed.side_effect = (
+        get_related_uuids_from_updated_and_renamed
+    )
+    invalidation_queue = mocker.Mock()
+    bulk_invalidation_service = BulkInvalidationService(
+        props=BulkInvalidationServiceProps(
+            transaction_queue=mocker.Mock(),
+            invalidation_queue=invalidation_queue,
+            opensearch=opensearch,
+            outbound_messages_batch_size=2,
+            related_uuids_dedupe_window=10,
+        )
+    )
+    bulk_invalidation_service.handle_messages([mock_transaction_message])
+    sent = [
+        [
+            message.body['data']['uuid']
+            for message in call[0][0]
+        ]
+        for call in invalidation_queue.send_messages.call_args_list
+    ]
+    # Primary first, then related in chunks, deduplicated across
+    # the updated and renamed searches and excluding primary uuids.
+    assert sent == [
+        ['09d05b87-4d30-4dfb-b243-3327005095f2'],
+        ['related-0', 'related-1'],
+        ['related-2', 'related-3'],
+        ['related-4'],
+    ]
+    assert bulk_invalidation_service.tracker.handled_messages == [
+        mock_transaction_message
+    ]
+
+
+def test_services_bulk_invalidation_bulk_invalidation_service_searches_related_uuids_concurrently(
+        mocker,
+):
+    from snoindex.services.invalidation import BulkInvalidationServiceProps
+    from snoindex.services.invalidation import BulkInvalidationService
+
+    def get_related_uuids_from_updated_and_renamed(updated, renamed):
+        for uuid in updated + renamed:
+            yield f'related-{uuid}'
+    opensearch = mocker.Mock()
+    opensearch.get_related_uuids_from_updated_and_renamed.side_effect = (
+        get_related_uuids_from_updated_and_renamed
+    )
+    bulk_invalidation_service = BulkInvalidationService(
+        props=BulkInvalidationServiceProps(
+            transaction_queue=mocker.Mock(),
+            invalidation_queue=mocker.Mock(),
+            opensearch=opensearch,
+            related_uuids_search_batch_size=2,
+            max_concurrent_related_uuids_searches=3,
+        )
+    )
+    related_uuids = set(
+        bulk_invalidation_service.iter_related_uuids(
+            all_uuids=set(),
+            all_updated_uuids={'a', 'b', 'c', 'd', 'e'},
+            all_renamed_uuids={'f'},
+        )
+    )
+    assert related_uuids == {
+        f'related-{uuid}'
+        for uuid in 'abcdef'
+    }
+    # Three batches of updated and one of renamed.
+    assert opensearch.get_related_uuids_from_updated_and_renamed.call_count == 4
+
+
+def test_services_bulk_invalidation_bulk_invalidation_service_extends_visibility_timeout(
+        mock_transaction_message,
+        mocker,
+):
+    from snoindex.services.invalidation import BulkInvalidationServiceProps
+    from snoindex.services.invalidation import BulkInvalidationService
+    transaction_queue = mocker.MagicMock()
+    transaction_queue.get_messages.return_value = [mock_transaction_message]
+    bulk_invalidation_service = BulkInvalidationService(
+        props=BulkInvalidationServiceProps(
+            transaction_queue=transaction_queue,
+            invalidation_queue=mocker.Mock(),
+            opensearch=mocker.Mock(),
+            extend_visibility_timeout=True,
+        )
+    )
+    lease = transaction_queue.lease.return_value.__enter__.return_value
+    handled_with_lease = []
+
+    def try_to_handle_messages():
+        handled_with_lease.append(
+            transaction_queue.lease.return_value.__enter__.called
+            and not transaction_queue.lease.return_value.__exit__.called
+        )
+    bulk_invalidation_service.try_to_handle_messages = try_to_handle_messages
+    bulk_invalidation_service.run_once()
+    # Leased as received, not after the whole batch is pulled.
+    transaction_queue.lease.assert_called_once_with()
+    assert transaction_queue.get_messages.call_args[1]['lease'] is lease
+    assert handled_with_lease == [True]
+    assert transaction_queue.lease.return_value.__exit__.called
+
+
 @pytest.mark.integration
 def test_services_bulk_invalidation_bulk_invalidation_service_handle_messages(
         bulk_invalidation_service,
@@ -264,3 +384,32 @@ def test_services_bulk_invalidation_bulk_invalidation_service_run_once(
     assert bulk_invalidation_service.tracker.stats()['failed'] == 0
     bulk_invalidation_service.props.transaction_queue.clear()
     bulk_invalidation_service.props.invalidation_queue.clear()
+
+
+def test_services_bulk_invalidation_bulk_invalidation_service_mark_handled_messages_as_processed_logs_errors(
+        mock_transaction_message,
+        mocker,
+):
+    from snoindex.repository.queue.sqs import FailedEntriesError
+    from snoindex.services.invalidation import BulkInvalidationServiceProps
+    from snoindex.services.invalidation import BulkInvalidationService
+    transaction_queue = mocker.Mock()
+    transaction_queue.mark_as_processed.side_effect = FailedEntriesError(
+        'ReceiptHandleIsInvalid'
+    )
+    bulk_invalidation_service = BulkInvalidationService(
+        props=BulkInvalidationServiceProps(
+            transaction_queue=transaction_queue,
+            invalidation_queue=mocker.Mock(),
+            opensearch=mocker.Mock(),
+        )
+    )
+    bulk_invalidation_service.tracker.add_handled_messages(
+        [
+            mock_transaction_message
+        ]
+    )
+    bulk_invalidation_service.mark_handled_messages_as_processed()
+    transaction_queue.mark_as_processed.assert_called_once_with(
+        [mock_transaction_message]
+    )
@@ -12,6 +12,281 @@ def test_services_indexing_get_uuid_and_version_from_message(
     assert actual == expected
 
 
+def test_services_indexing_deduplicate_messages(make_invalidation_message):
+    from snoindex.domain.message import InboundMessage
+    from snoindex.services.indexing import deduplicate_messages
+    a1 = make_invalidation_message('uuid-a', message_id='a1', xid=1)
+    a3 = make_invalidation_message('uuid-a', message_id='a3', xid=3)
+    a2 = make_invalidation_message('uuid-a', message_id='a2', xid=2)
+    b1 = make_invalidation_message('uuid-b', message_id='b1', xid=1)
+    b1_again = make_invalidation_message(
+        'uuid-b',
+        message_id='b1-again',
+        xid=1,
+    )
+    c5 = make_invalidation_message('uuid-c', message_id='c5', xid=5)
+    malformed = InboundMessage(
+        message_id='malformed',
+        receipt_handle='xyz',
+        md5_of_body='abc',
+        body='{}',
+    )
+    kept, superseded = deduplicate_messages(
+        [a1, b1, a3, malformed, b1_again, a2, c5]
+    )
+    assert kept == [a3, b1, c5, malformed]
+    assert superseded == [a1, b1_again, a2]
+    assert deduplicate_messages([]) == ([], [])
+
+
+def test_services_indexing_split_up_to_date_messages(make_invalidation_message):
+    from snoindex.domain.message import InboundMessage
+    from snoindex.services.indexing import split_up_to_date_messages
+    a = make_invalidation_message('uuid-a', message_id='a', xid=10)
+    b = make_invalidation_message('uuid-b', message_id='b', xid=10)
+    c = make_invalidation_message('uuid-c', message_id='c', xid=10)
+    d = make_invalidation_message('uuid-d', message_id='d', xid=10)
+    malformed = InboundMessage(
+        message_id='malformed',
+        receipt_handle='xyz',
+        md5_of_body='abc',
+        body='{}',
+    )
+    indexed_versions = {
+        'uuid-a': 11,
+        'uuid-b': 10,
+        'uuid-c': 9,
+    }
+    stale, up_to_date = split_up_to_date_messages(
+        [a, b, c, d, malformed],
+        indexed_versions,
+    )
+    assert stale == [b, c, d, malformed]
+    assert up_to_date == [a]
+
+
+def test_services_indexing_indexing_service_skip_up_to_date_messages(
+        make_invalidation_message,
+        mocker,
+):
+    from snoindex.services.indexing import IndexingService
+    from snoindex.services.indexing import IndexingServiceProps
+    portal = mocker.Mock()
+    portal.get_item.side_effect = lambda uuid: mocker.Mock(uuid=uuid)
+    opensearch = mocker.Mock()
+    opensearch.get_indexed_versions.return_value = {'uuid-a': 20}
+    indexing_service = IndexingService(
+        props=IndexingServiceProps(
+            invalidation_queue=mocker.Mock(),
+            portal=portal,
+            opensearch=opensearch,
+            messages_to_handle_per_run=10,
+        )
+    )
+    messages = [
+        make_invalidation_message('uuid-a', message_id='a', xid=10),
+        make_invalidation_message('uuid-b', message_id='b', xid=10),
+    ]
+    # Off by default.
+    indexing_service.tracker.add_new_messages(messages)
+    indexing_service.try_to_handle_messages()
+    assert portal.get_item.call_count == 2
+    opensearch.get_indexed_versions.assert_not_called()
+    indexing_service.clear()
+    portal.get_item.reset_mock()
+    indexing_service.props.skip_up_to_date_messages = True
+    indexing_service.tracker.add_new_messages(messages)
+    indexing_service.try_to_handle_messages()
+    opensearch.get_indexed_versions.assert_called_once_with(
+        ['uuid-a', 'uuid-b']
+    )
+    portal.get_item.assert_called_once_with('uuid-b')
+    assert indexing_service.tracker.handled_messages == messages
+    indexing_service.clear()
+    portal.get_item.reset_mock()
+    # Falls back to fetching everything when the check fails.
+    opensearch.get_indexed_versions.side_effect = Exception('unavailable')
+    indexing_service.tracker.add_new_messages(messages)
+    indexing_service.try_to_handle_messages()
+    assert portal.get_item.call_count == 2
+
+
+def test_services_indexing_indexing_service_handles_packed_messages(
+        make_packed_message,
+        mocker,
+):
+    from snoindex.domain.message import InboundMessage
+    from snoindex.services.indexing import IndexingService
+    from snoindex.services.indexing import IndexingServiceProps
+
+    def get_item(uuid):
+        if uuid == 'uuid-c':
+            raise Exception('portal error')
+        return mocker.Mock(uuid=uuid)
+
+    portal = mocker.Mock()
+    portal.get_item.side_effect = get_item
+    invalidation_queue = mocker.Mock()
+    invalidation_queue.get_messages.return_value = [
+        make_packed_message('ok', ['uuid-a', 'uuid-b']),
+        make_packed_message('partly-failed', ['uuid-b', 'uuid-c']),
+    ]
+    indexing_service = IndexingService(
+        props=IndexingServiceProps(
+            invalidation_queue=invalidation_queue,
+            portal=portal,
+            opensearch=mocker.Mock(),
+            messages_to_handle_per_run=10,
+        )
+    )
+    indexing_service.run_once()
+    assert sorted(
+        call[0][0]
+        for call in portal.get_item.call_args_list
+    ) == ['uuid-a', 'uuid-b', 'uuid-c']
+    # Failed uuids of a partly failed packed message are sent again on
+    # their own, and every packed message is deleted once.
+    repacked, = invalidation_queue.send_messages.call_args[0][0]
+    assert repacked.body['data']['uuids'] == ['uuid-c']
+    processed = invalidation_queue.mark_as_processed.call_args[0][0]
+    assert sorted(message.receipt_handle for message in processed) == [
+        'ok-receipt',
+        'partly-failed-receipt',
+    ]
+    # Only the failed uuid is indexed again when the new message comes
+    # back, and when it fails on its own it is left for the DLQ.
+    portal.get_item.reset_mock()
+    invalidation_queue.send_messages.reset_mock()
+    invalidation_queue.get_messages.return_value = [
+        InboundMessage(
+            message_id='repacked',
+            receipt_handle='repacked-receipt',
+            md5_of_body='abc',
+            body=repacked.str_body,
+        )
+    ]
+    indexing_service.run_once()
+    assert [
+        call[0][0]
+        for call in portal.get_item.call_args_list
+    ] == ['uuid-c']
+    invalidation_queue.send_messages.assert_not_called()
+    assert invalidation_queue.mark_as_processed.call_args[0][0] == []
+
+
+def test_services_indexing_indexing_service_leases_packed_messages(
+        make_packed_message,
+        mocker,
+):
+    from snoindex.services.indexing import IndexingService
+    from snoindex.services.indexing import IndexingServiceProps
+    packed = make_packed_message('xyz', ['uuid-a', 'uuid-b'])
+    invalidation_queue = mocker.MagicMock()
+    invalidation_queue.get_messages.return_value = iter([packed])
+    lease = invalidation_queue.lease.return_value
+    events = []
+    lease.__exit__.side_effect = lambda *args: events.append('lease stopped')
+    invalidation_queue.mark_as_processed.side_effect = lambda messages: events.append(
+        'processed'
+    )
+    indexing_service = IndexingService(
+        props=IndexingServiceProps(
+            invalidation_queue=invalidation_queue,
+            portal=mocker.Mock(),
+            opensearch=mocker.Mock(),
+            messages_to_handle_per_run=10,
+            extend_visibility_timeout=True,
+        )
+    )
+    indexing_service.run_once()
+    # Leased by the queue as received, before unpacking.
+    assert invalidation_queue.get_messages.call_args[1]['lease'] is lease.__enter__.return_value
+    assert indexing_service.props.portal.get_item.call_count == 2
+    assert events == ['lease stopped', 'processed']
+
+
+def test_services_indexing_indexing_service_try_to_handle_messages_deduplicates(
+        make_invalidation_message,
+        mocker,
+):
+    from snoindex.services.indexing import IndexingService
+    from snoindex.services.indexing import IndexingServiceProps
+    portal = mocker.Mock()
+    portal.get_item.side_effect = lambda uuid: mocker.Mock(uuid=uuid)
+    indexing_service = IndexingService(
+        props=IndexingServiceProps(
+            invalidation_queue=mocker.Mock(),
+            portal=portal,
+            opensearch=mocker.Mock(),
+            messages_to_handle_per_run=10,
+        )
+    )
+    messages = [
+        make_invalidation_message('uuid-a', message_id=f'a{i}', xid=i)
+        for i in range(5)
+    ] + [
+        make_invalidation_message('uuid-b', message_id='b', xid=1)
+    ]
+    indexing_service.tracker.add_new_messages(messages)
+    indexing_service.try_to_handle_messages()
+    assert portal.get_item.call_count == 2
+    assert indexing_service.tracker.number_handled_messages == 6
+    assert indexing_service.tracker.number_failed_messages == 0
+
+
+def test_services_indexing_record_reverse_links_heartbeat(mocker):
+    from snoindex.services.indexing import record_reverse_links_heartbeat
+    record_reverse_links_heartbeat(None)
+    reverse_links = mocker.Mock()
+    record_reverse_links_heartbeat(reverse_links)
+    reverse_links.record_writer_heartbeat.assert_called_once()
+    # Errors are logged, indexing goes on.
+    reverse_links.record_writer_heartbeat.side_effect = Exception('locked')
+    record_reverse_links_heartbeat(reverse_links)
+
+
+def test_services_indexing_mark_handled_messages_as_processed_logs_errors(
+        mock_invalidation_message,
+        mocker,
+):
+    from snoindex.repository.queue.sqs import FailedEntriesError
+    from snoindex.services.indexing import BulkIndexingService
+    from snoindex.services.indexing import BulkIndexingServiceProps
+    from snoindex.services.indexing import IndexingService
+    from snoindex.services.indexing import IndexingServiceProps
+    queue = mocker.Mock()
+    queue.mark_as_processed.side_effect = FailedEntriesError(
+        'ReceiptHandleIsInvalid'
+    )
+    indexing_service = IndexingService(
+        props=IndexingServiceProps(
+            invalidation_queue=queue,
+            portal=mocker.Mock(),
+            opensearch=mocker.Mock(),
+        )
+    )
+    indexing_service.tracker.add_handled_messages(
+        [
+            mock_invalidation_message
+        ]
+    )
+    indexing_service.mark_handled_messages_as_processed()
+    bulk_indexing_service = BulkIndexingService(
+        props=BulkIndexingServiceProps(
+            bulk_invalidation_queue=queue,
+            portal=mocker.Mock(),
+            opensearch=mocker.Mock(),
+        )
+    )
+    bulk_indexing_service.tracker.add_handled_messages(
+        [
+            mock_invalidation_message
+        ]
+    )
+    bulk_indexing_service.mark_handled_messages_as_processed()
+    assert queue.mark_as_processed.call_count == 2
+
+
 @pytest.mark.integration
 def test_services_indexing_indexing_service_init(
         indexing_service_props,
@@ -88,6 +363,82 @@ def test_services_indexing_indexing_service_try_to_handle_messages_error(
     assert indexing_service.tracker.number_failed_messages == 1
 
 
+@pytest.mark.integration
+def test_services_indexing_indexing_service_try_to_handle_messages_concurrently(
+        indexing_service_props,
+        mock_invalidation_message,
+        get_all_results,
+        mocker,
+):
+    from snoindex.services.indexing import IndexingService
+    indexing_service_props.max_workers = 4
+    indexing_service = IndexingService(
+        props=indexing_service_props
+    )
+    assert indexing_service.executor is not None
+    indexing_service.tracker.add_new_messages(
+        [
+            mock_invalidation_message
+            for i in range(10)
+        ]
+    )
+    indexing_service.try_to_handle_messages()
+    indexing_service.props.opensearch.refresh_resources_index()
+    assert indexing_service.tracker.number_handled_messages == 10
+    assert indexing_service.tracker.number_failed_messages == 0
+    results = list(
+        get_all_results(
+            indexing_service.props.opensearch.props.client
+        )['hits']['hits']
+    )
+    assert len(results) == 1
+
+
+def test_services_indexing_indexing_service_try_to_handle_messages_concurrently_with_errors(
+        make_invalidation_message,
+        mocker,
+):
+    from snoindex.services.indexing import IndexingService
+    from snoindex.services.indexing import IndexingServiceProps
+    portal = mocker.Mock()
+
+    def get_item(uuid):
+        if uuid == 'bad-uuid':
+            raise Exception('something went wrong')
+        return mocker.Mock(uuid=uuid)
+    portal.get_item = get_item
+    indexing_service = IndexingService(
+        props=IndexingServiceProps(
+            invalidation_queue=mocker.Mock(),
+            portal=portal,
+            opensearch=mocker.Mock(),
+            messages_to_handle_per_run=10,
+            max_workers=3,
+        )
+    )
+    bad_message = make_invalidation_message(
+        'bad-uuid',
+        message_id='bad',
+        xid=1,
+    )
+    good_messages = [
+        make_invalidation_message(
+            f'good-uuid-{i}',
+            message_id=f'good-{i}',
+            xid=1,
+        )
+        for i in range(5)
+    ]
+    indexing_service.tracker.add_new_messages(
+        good_messages + [bad_message]
+    )
+    indexing_service.try_to_handle_messages()
+    assert indexing_service.tracker.number_handled_messages == 5
+    assert indexing_service.tracker.number_failed_messages == 1
+    assert indexing_service.tracker.failed_messages == [bad_message]
+    assert indexing_service.props.opensearch.index_item.call_count == 5
+
+
 @pytest.mark.integration
 def test_services_indexing_indexing_service_get_new_messages_from_queue(
         indexing_service,
@@ -230,6 +581,150 @@ def test_services_indexing_bulk_indexing_service_try_to_handle_messages_error(
     assert bulk_indexing_service.tracker.number_failed_messages == 1
 
 
+def test_services_indexing_bulk_indexing_service_handle_messages_isolates_failures(
+        make_invalidation_message,
+        mocker,
+):
+    from snoindex.domain.message import InboundMessage
+    from snoindex.remote.portal import ItemResult
+    from snoindex.services.indexing import BulkIndexingService
+    from snoindex.services.indexing import BulkIndexingServiceProps
+
+    def get_items(uuids):
+        for uuid in uuids:
+            if uuid == 'portal-error':
+                yield ItemResult(uuid=uuid, error=Exception('portal error'))
+                continue
+            yield ItemResult(uuid=uuid, item=mocker.Mock(uuid=uuid))
+    portal = mocker.Mock()
+    portal.get_items = get_items
+    opensearch = mocker.Mock()
+    indexed_items = []
+
+    def bulk_index_items(items):
+        indexed_items.extend(items)
+        return ['bulk-error']
+    opensearch.bulk_index_items.side_effect = bulk_index_items
+    reverse_links = mocker.Mock()
+    bulk_indexing_service = BulkIndexingService(
+        props=BulkIndexingServiceProps(
+            bulk_invalidation_queue=mocker.Mock(),
+            portal=portal,
+            opensearch=opensearch,
+            reverse_links=reverse_links,
+        )
+    )
+    ok = make_invalidation_message('ok')
+    ok_again = make_invalidation_message('ok')
+    portal_error = make_invalidation_message('portal-error')
+    bulk_error = make_invalidation_message('bulk-error')
+    malformed = InboundMessage(
+        message_id='malformed',
+        receipt_handle='xyz',
+        md5_of_body='abc',
+        body='{}',
+    )
+    bulk_indexing_service.tracker.add_new_messages(
+        [ok, portal_error, bulk_error, ok_again, malformed]
+    )
+    bulk_indexing_service.try_to_handle_messages()
+    assert len(bulk_indexing_service.tracker.handled_messages) == 2
+    assert ok in bulk_indexing_service.tracker.handled_messages
+    assert ok_again in bulk_indexing_service.tracker.handled_messages
+    assert len(bulk_indexing_service.tracker.failed_messages) == 3
+    assert portal_error in bulk_indexing_service.tracker.failed_messages
+    assert bulk_error in bulk_indexing_service.tracker.failed_messages
+    assert malformed in bulk_indexing_service.tracker.failed_messages
+    assert [item.uuid for item in indexed_items] == ['ok', 'bulk-error']
+    # Only indexed items update reverse links.
+    items = reverse_links.update_items.call_args[0][0]
+    assert [item.uuid for item in items] == ['ok']
+
+
+def test_services_indexing_bulk_indexing_service_leases_packed_messages(
+        make_packed_message,
+        mocker,
+):
+    from snoindex.services.indexing import BulkIndexingService
+    from snoindex.services.indexing import BulkIndexingServiceProps
+    packed = make_packed_message('xyz', ['uuid-a', 'uuid-b'])
+    queue = mocker.MagicMock()
+    queue.get_messages.return_value = iter([packed])
+    lease = queue.lease.return_value
+    bulk_indexing_service = BulkIndexingService(
+        props=BulkIndexingServiceProps(
+            bulk_invalidation_queue=queue,
+            portal=mocker.Mock(),
+            opensearch=mocker.Mock(),
+            extend_visibility_timeout=True,
+        )
+    )
+    handled_with_lease = []
+
+    def try_to_handle_messages():
+        handled_with_lease.append(
+            lease.__enter__.called
+            and not lease.__exit__.called
+        )
+    bulk_indexing_service.try_to_handle_messages = try_to_handle_messages
+    bulk_indexing_service.run_once()
+    assert queue.get_messages.call_args[1]['lease'] is lease.__enter__.return_value
+    assert handled_with_lease == [True]
+    assert lease.__exit__.called
+
+
+def test_services_indexing_bulk_indexing_service_update_batch_size(
+        mock_invalidation_message,
+        make_packed_message,
+        mocker,
+):
+    from snoindex.domain.batch import AdaptiveBatchSize
+    from snoindex.domain.batch import AdaptiveBatchSizeProps
+    from snoindex.services.indexing import BulkIndexingService
+    from snoindex.services.indexing import BulkIndexingServiceProps
+    queue = mocker.Mock()
+    queue.info.return_value = {'ApproximateNumberOfMessages': '5000'}
+    bulk_indexing_service = BulkIndexingService(
+        props=BulkIndexingServiceProps(
+            bulk_invalidation_queue=queue,
+            portal=mocker.Mock(),
+            opensearch=mocker.Mock(),
+            batch_size=AdaptiveBatchSize(
+                props=AdaptiveBatchSizeProps(
+                    initial_size=2,
+                    min_size=1,
+                    max_size=100,
+                    target_seconds=10,
+                )
+            )
+        )
+    )
+    assert bulk_indexing_service._get_messages_to_handle_per_run() == 2
+    queue.get_messages.return_value = iter([mock_invalidation_message] * 2)
+    bulk_indexing_service.get_new_messages_from_queue()
+    bulk_indexing_service.update_batch_size(1)
+    assert bulk_indexing_service._get_messages_to_handle_per_run() == 4
+    bulk_indexing_service.clear()
+    # A packed message counts once, not once per uuid.
+    queue.get_messages.return_value = iter(
+        [
+            make_packed_message('xyz', ['a', 'b', 'c', 'd', 'e']),
+        ]
+    )
+    bulk_indexing_service.get_new_messages_from_queue()
+    assert len(bulk_indexing_service.tracker.new_messages) == 5
+    bulk_indexing_service.update_batch_size(1)
+    assert bulk_indexing_service._get_messages_to_handle_per_run() == 4
+    bulk_indexing_service.update_batch_size(40)
+    assert bulk_indexing_service._get_messages_to_handle_per_run() == 1
+    # Keeps the current size when queue depth is unavailable.
+    queue.info.side_effect = Exception('unavailable')
+    bulk_indexing_service.update_batch_size(1)
+    assert bulk_indexing_service._get_messages_to_handle_per_run() == 1
+    bulk_indexing_service.props.batch_size = None
+    assert bulk_indexing_service._get_messages_to_handle_per_run() == 50
+
+
 @pytest.mark.integration
 def test_services_indexing_bulk_indexing_service_run_once(
         bulk_indexing_service,
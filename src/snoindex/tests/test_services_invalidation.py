@@ -1,6 +1,143 @@
 import pytest
 
 
+def test_services_invalidation_chunked():
+    from snoindex.services.invalidation import chunked
+    actual = list(chunked(iter(range(7)), 3))
+    assert actual == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(chunked(iter([]), 3)) == []
+
+
+def make_transaction_message(xid, updated, renamed):
+    import json
+    from snoindex.domain.message import InboundMessage
+    return InboundMessage(
+        message_id=f'message-{xid}',
+        receipt_handle='xyz',
+        md5_of_body='abc',
+        body=json.dumps(
+            {
+                'metadata': {
+                    'xid': xid,
+                    'tid': 'abcd',
+                },
+                'data': {
+                    'payload': {
+                        'updated': updated,
+                        'renamed': renamed,
+                    }
+                }
+            }
+        ),
+    )
+
+
+def test_services_invalidation_get_uuids_from_transactions():
+    from snoindex.services.invalidation import get_uuids_from_transactions
+    messages = [
+        make_transaction_message(1, ['a', 'b'], ['b']),
+        make_transaction_message(2, ['c'], ['d']),
+    ]
+    all_uuids, updated, renamed = get_uuids_from_transactions(messages)
+    assert all_uuids == {'a', 'b', 'c', 'd'}
+    assert updated == {'a', 'b', 'c'}
+    assert renamed == {'b', 'd'}
+
+
+def test_services_invalidation_get_latest_transaction():
+    from snoindex.services.invalidation import get_latest_transaction
+    messages = [
+        make_transaction_message(9, ['a'], []),
+        make_transaction_message(10, ['b'], []),
+        make_transaction_message(2, ['c'], []),
+    ]
+    assert get_latest_transaction(messages) == messages[1]
+
+
+def test_services_invalidation_get_new_uuids():
+    from snoindex.services.invalidation import get_new_uuids
+    actual = list(get_new_uuids(iter(['a', 'b', 'c', 'b', 'd']), {'a'}, 10))
+    assert actual == ['b', 'c', 'd']
+    # Only the most recent uuids are remembered.
+    actual = list(get_new_uuids(iter(['b', 'c', 'd', 'b', 'd']), {'a'}, 2))
+    assert actual == ['b', 'c', 'd', 'b']
+
+
+def test_services_invalidation_pack_uuids():
+    from snoindex.services.invalidation import pack_uuids
+    uuids = [f'uuid-{i}' for i in range(7)]
+    actual = list(pack_uuids(iter(uuids), uuids_per_message=3))
+    assert actual == [uuids[:3], uuids[3:6], uuids[6:]]
+    # Every uuid takes 10 bytes with quotes and separators.
+    actual = list(pack_uuids(iter(uuids), uuids_per_message=3, max_bytes=25))
+    assert actual == [uuids[:2], uuids[2:4], uuids[4:6], uuids[6:]]
+
+
+def test_services_invalidation_make_outbound_messages(mock_transaction_message):
+    from snoindex.domain.message import unpack_message
+    from snoindex.services.invalidation import make_outbound_messages
+    outbound_messages = make_outbound_messages(
+        mock_transaction_message,
+        iter(['a', 'b', 'c']),
+    )
+    assert [
+        message.body['data']['uuid']
+        for message in outbound_messages
+    ] == ['a', 'b', 'c']
+    outbound_messages = make_outbound_messages(
+        mock_transaction_message,
+        iter(['a', 'b', 'c']),
+        uuids_per_message=2,
+    )
+    assert len(outbound_messages) == 2
+    assert outbound_messages[0].unique_id == 'a-1234'
+    assert outbound_messages[0].body == {
+        'metadata': {
+            'xid': 1234,
+            'tid': 'abcd',
+        },
+        'data': {
+            'uuids': ['a', 'b'],
+        },
+    }
+    assert outbound_messages[1].body['data']['uuids'] == ['c']
+
+
+def test_services_invalidation_fan_out_window(mock_transaction_message, mocker, caplog):
+    from snoindex.services.invalidation import fan_out_window
+
+    def search_related_uuids(updated, renamed):
+        yield '09d05b87-4d30-4dfb-b243-3327005095f2'
+        for i in range(3):
+            yield f'related-{i}'
+            yield f'related-{i}'
+    invalidation_queue = mocker.Mock()
+    actual = fan_out_window(
+        [mock_transaction_message],
+        invalidation_queue,
+        search_related_uuids,
+        uuids_per_outbound_message=2,
+        outbound_messages_batch_size=2,
+        related_uuids_dedupe_window=10,
+    )
+    assert actual == (1, 3)
+    sent = [
+        [
+            message.body['data']['uuids']
+            for message in call[0][0]
+        ]
+        for call in invalidation_queue.send_messages.call_args_list
+    ]
+    # Related uuids are streamed in chunks, packed and deduplicated.
+    assert sent == [
+        [['09d05b87-4d30-4dfb-b243-3327005095f2']],
+        [['related-0', 'related-1']],
+        [['related-2']],
+    ]
+    # Throughput is reported once per window.
+    assert caplog.text.count('Sent 4 uuids in') == 1
+
+
 def test_services_invalidation_get_updated_uuids_from_transaction(mock_transaction_message):
     from snoindex.services.invalidation import get_updated_uuids_from_transaction
     assert get_updated_uuids_from_transaction(mock_transaction_message) == [
@@ -101,6 +238,161 @@ def test_services_invalidation_invalidation_service_invalidate_all_related_uuids
     invalidation_service.props.invalidation_queue.clear()
 
 
+def test_services_invalidation_invalidation_service_get_related_uuids_from_reverse_links(
+        mocker,
+):
+    from snoindex.services.invalidation import InvalidationServiceProps
+    from snoindex.services.invalidation import InvalidationService
+    opensearch = mocker.Mock()
+    opensearch.get_related_uuids_from_updated_and_renamed.return_value = iter(
+        ['from-opensearch']
+    )
+    reverse_links = mocker.Mock()
+    reverse_links.is_complete.return_value = True
+    reverse_links.get_related_uuids_from_updated_and_renamed.return_value = iter(
+        ['from-reverse-links']
+    )
+    invalidation_service = InvalidationService(
+        props=InvalidationServiceProps(
+            transaction_queue=mocker.Mock(),
+            invalidation_queue=mocker.Mock(),
+            opensearch=opensearch,
+            reverse_links=reverse_links,
+        )
+    )
+    related_uuids = invalidation_service.get_related_uuids_from_updated_and_renamed(
+        ['a'],
+        [],
+    )
+    assert list(related_uuids) == ['from-reverse-links']
+    assert not opensearch.get_related_uuids_from_updated_and_renamed.called
+    # Falls back to Opensearch until reverse links are complete.
+    reverse_links.is_complete.return_value = False
+    related_uuids = invalidation_service.get_related_uuids_from_updated_and_renamed(
+        ['a'],
+        [],
+    )
+    assert list(related_uuids) == ['from-opensearch']
+    # And when no indexer keeps them up to date.
+    opensearch.get_related_uuids_from_updated_and_renamed.return_value = iter(
+        ['from-opensearch']
+    )
+    reverse_links.is_complete.return_value = True
+    reverse_links.has_active_writers.return_value = False
+    related_uuids = invalidation_service.get_related_uuids_from_updated_and_renamed(
+        ['a'],
+        [],
+    )
+    assert list(related_uuids) == ['from-opensearch']
+    reverse_links.has_active_writers.return_value = True
+    # And when reverse links fail.
+    opensearch.get_related_uuids_from_updated_and_renamed.return_value = iter(
+        ['from-opensearch']
+    )
+    reverse_links.is_complete.return_value = True
+    reverse_links.get_related_uuids_from_updated_and_renamed.side_effect = Exception(
+        'database is locked'
+    )
+    related_uuids = invalidation_service.get_related_uuids_from_updated_and_renamed(
+        ['a'],
+        [],
+    )
+    assert list(related_uuids) == ['from-opensearch']
+
+
+def test_services_invalidation_invalidation_service_mark_handled_messages_as_processed_logs_errors(
+        mock_transaction_message,
+        mocker,
+):
+    from snoindex.repository.queue.sqs import FailedEntriesError
+    from snoindex.services.invalidation import InvalidationServiceProps
+    from snoindex.services.invalidation import InvalidationService
+    transaction_queue = mocker.Mock()
+    transaction_queue.mark_as_processed.side_effect = FailedEntriesError(
+        'ReceiptHandleIsInvalid'
+    )
+    invalidation_service = InvalidationService(
+        props=InvalidationServiceProps(
+            transaction_queue=transaction_queue,
+            invalidation_queue=mocker.Mock(),
+            opensearch=mocker.Mock(),
+        )
+    )
+    invalidation_service.tracker.add_handled_messages(
+        [
+            mock_transaction_message
+        ]
+    )
+    invalidation_service.mark_handled_messages_as_processed()
+    transaction_queue.mark_as_processed.assert_called_once_with(
+        [mock_transaction_message]
+    )
+
+
+def test_services_invalidation_invalidation_service_try_to_handle_messages_as_window(
+        mocker,
+):
+    from snoindex.services.invalidation import InvalidationServiceProps
+    from snoindex.services.invalidation import InvalidationService
+    opensearch = mocker.Mock()
+    opensearch.get_related_uuids_from_updated_and_renamed.return_value = iter(
+        ['a', 'related-1', 'related-2', 'related-1', 'related-3']
+    )
+    invalidation_queue = mocker.Mock()
+    invalidation_service = InvalidationService(
+        props=InvalidationServiceProps(
+            transaction_queue=mocker.Mock(),
+            invalidation_queue=invalidation_queue,
+            opensearch=opensearch,
+            messages_to_handle_per_run=10,
+            outbound_messages_batch_size=2,
+        )
+    )
+    messages = [
+        make_transaction_message(5, ['a'], []),
+        make_transaction_message(7, ['b'], ['b']),
+    ]
+    invalidation_service.tracker.add_new_messages(messages)
+    invalidation_service.try_to_handle_messages()
+    # One search with merged updated and renamed uuids.
+    opensearch.get_related_uuids_from_updated_and_renamed.assert_called_once()
+    updated, renamed = opensearch.get_related_uuids_from_updated_and_renamed.call_args[0]
+    assert sorted(updated) == ['a', 'b']
+    assert renamed == ['b']
+    sent = [
+        call[0][0]
+        for call in invalidation_queue.send_messages.call_args_list
+    ]
+    primary_uuids = sorted(
+        message.body['data']['uuid']
+        for message in sent[0]
+    )
+    assert primary_uuids == ['a', 'b']
+    assert [
+        [message.body['data']['uuid'] for message in outbound]
+        for outbound in sent[1:]
+    ] == [
+        ['related-1', 'related-2'],
+        ['related-3'],
+    ]
+    # Every outbound message carries the highest xid of the window.
+    assert {
+        message.body['metadata']['xid']
+        for outbound in sent
+        for message in outbound
+    } == {7}
+    assert invalidation_service.tracker.handled_messages == messages
+    # The whole window fails together.
+    invalidation_service.clear()
+    opensearch.get_related_uuids_from_updated_and_renamed.side_effect = Exception(
+        'opensearch error'
+    )
+    invalidation_service.tracker.add_new_messages(messages)
+    invalidation_service.try_to_handle_messages()
+    assert invalidation_service.tracker.failed_messages == messages
+    assert invalidation_service.tracker.handled_messages == []
+
+
 @pytest.mark.integration
 def test_services_invalidation_invalidation_service_handle_message(
         invalidation_service,